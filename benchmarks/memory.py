@@ -0,0 +1,75 @@
+'''
+Compare the memory used by the regular and the compact layout, measured
+with :py:meth:`geonear.Globe.memory_stats` on a Redis server. The pins are
+written to the namespaces `memory-regular` and `memory-compact`, which are
+deleted afterwards.
+
+    python benchmarks/memory.py --url redis://localhost:6379/15 --pins 50000
+'''
+
+import argparse
+import os
+import random
+import sys
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fill(globe, pins):
+    with globe.buffer(batch_size=500, cache_size=0) as buf:
+        for pin_id, latlon in pins:
+            buf.pin(pin_id, latlon=latlon)
+
+
+def delete_namespace(redis, namespace):
+    keys = list(redis.scan_iter('globe:{}:*'.format(namespace), count=1000))
+    for i in range(0, len(keys), 1000):
+        redis.delete(*keys[i:i + 1000])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--url', default='redis://localhost:6379/15')
+    parser.add_argument('--pins', type=int, default=50000)
+    parser.add_argument('--precision', type=int, default=6)
+    parser.add_argument('--spread', type=float, default=0.3,
+                        help='degrees around Berlin, default %(default)s')
+    parser.add_argument('--int-ids', action='store_true',
+                        help='use integer pin ids instead of uuids')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    import redis
+    import geonear
+
+    client = redis.StrictRedis.from_url(args.url)
+    random.seed(1)
+    pins = []
+    for i in range(args.pins):
+        pin_id = str(i) if args.int_ids else str(uuid.UUID(
+            int=random.getrandbits(128)))
+        pins.append((pin_id, (
+            52.5 + random.uniform(-args.spread, args.spread),
+            13.4 + random.uniform(-args.spread, args.spread))))
+
+    print('{:>10} {:>12} {:>12} {:>12}'.format(
+        'layout', 'pins', 'cells', 'total'))
+    for compact in (False, True):
+        namespace = 'memory-compact' if compact else 'memory-regular'
+        delete_namespace(client, namespace)
+        globe = geonear.Globe(client, args.precision, namespace=namespace,
+                              compact=compact,
+                              pin_buckets=max(1, args.pins // 64))
+        try:
+            fill(globe, pins)
+            stats = globe.memory_stats()
+        finally:
+            delete_namespace(client, namespace)
+        print('{:>10} {:>12} {:>12} {:>12}'.format(
+            'compact' if compact else 'regular',
+            stats['pins'], stats['cells'], stats['total']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Measure the cold start of geonear: the time to import the package in a
+fresh interpreter and to construct a :py:class:`geonear.Globe` once the
+scripts are loaded. Exits with status 1 if a budget is exceeded.
+
+    python benchmarks/startup.py --url redis://localhost:6379/15
+    python benchmarks/startup.py --fakeredis
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# only geocoding and debug() need these
+OPTIONAL = ['requests', 'gpolyencode', 'webbrowser', 'numpy']
+
+IMPORT_CODE = '''
+import sys, time
+start = time.time()
+import geonear
+print(time.time() - start)
+print(' '.join(name for name in {!r} if name in sys.modules))
+'''.format(OPTIONAL)
+
+
+def import_time(runs):
+    '''Return the fastest time of importing geonear in `runs` fresh
+    interpreters and the optional modules that import pulled in.
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [ROOT, env.get('PYTHONPATH')]))
+    times = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', IMPORT_CODE],
+                                      env=env, universal_newlines=True)
+        seconds, imported = (out.split('\n') + [''])[:2]
+        times.append(float(seconds))
+    return min(times), imported.split()
+
+
+def globe_time(redis, number):
+    '''Return the seconds to construct one globe for a client whose
+    scripts are loaded already.
+    '''
+    import geonear
+    geonear.Globe(redis, 8)  # loads the scripts
+    timer = timeit.Timer(lambda: geonear.Globe(redis, 8))
+    return min(timer.repeat(5, number)) / number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--url', default='redis://localhost:6379/15')
+    parser.add_argument('--fakeredis', action='store_true',
+                        help='use fakeredis instead of a Redis server')
+    parser.add_argument('--import-budget', type=float, default=60.0,
+                        help='milliseconds, default %(default)s')
+    parser.add_argument('--globe-budget', type=float, default=50.0,
+                        help='microseconds, default %(default)s')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    if args.fakeredis:
+        import fakeredis
+        redis = fakeredis.FakeStrictRedis()
+    else:
+        import redis
+        redis = redis.StrictRedis.from_url(args.url)
+
+    seconds, imported = import_time(args.runs)
+    print('import geonear: {:.1f} ms (budget {} ms)'.format(
+        seconds * 1000, args.import_budget))
+    failed = seconds * 1000 > args.import_budget
+    if imported:
+        print('  imported optional modules: ' + ', '.join(imported))
+        failed = True
+
+    seconds = globe_time(redis, args.runs * 1000)
+    print('Globe(): {:.1f} us (budget {} us)'.format(
+        seconds * 1e6, args.globe_budget))
+    failed = failed or seconds * 1e6 > args.globe_budget
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -26,22 +26,38 @@
 #  TODO: add namespace support, call it label?
 #  TODO: find nicer method names, especially for almost_near and friends.
 
+import copy
 import hashlib
 import json
-import webbrowser
+import math
+import struct
+import time
+import uuid
+import warnings
+import weakref
+from array import array
+from collections import Counter, OrderedDict
 from random import choice
 from string import ascii_uppercase
 
-import gpolyencode
-import requests
-
 import geohash  # install with `pip install python-geohash`
+import cover
+from common import BASE32
+import snapshot
+from snapshot import geohash_to_int, int_to_geohash
+from codec import LazyData, LazyDataMap, serialize_pin_data
+from readers import ReaderPool
 from colornames import colornames
 
 PROJECT_URL = 'http://github.com/ihuecos/geonear'
 DEFAULT_NOMINATIM_ENDPOINT = 'http://nominatim.openstreetmap.org/search'
+MAX_PRECISION = 12
+COMPACT_PRECISION = 10  # geohash length kept by the compact layout
+SESSION_MARKER_TTL = 600  # seconds a replica may lag behind a session
+EARTH_RADIUS = 6371008.8  # mean radius in meters
 
-__all__ = ["Globe", "Area"]
+__all__ = ["Globe", "Area", "WriteBuffer", "Reindex", "Snapshot",
+           "SnapshotResult"]
 
 
 def hash_iter(args):
@@ -79,6 +95,1017 @@ def geohash_and_neighbors(gh, neighbors_deepth=1):
     return ghs
 
 
+# Lua functions shared by the scripts altering pins
+LUA_HELPERS = '''
+    local BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+    local MAX_PRECISION = 12
+
+    -- return the geohash length of the namespace, it is saved in Redis
+    -- when the namespace is reindexed
+    local function get_precision(key_prefix, default)
+        return tonumber(redis.call('get', key_prefix..'precision')) or
+            tonumber(default)
+    end
+
+    -- return the precision a running reindex copies the pins to or nil
+    local function get_reindex_precision(key_prefix)
+        local reindex = redis.call('hmget', key_prefix..'reindex',
+                                   'status', 'precision')
+        if reindex[1] == 'copying' then
+            return tonumber(reindex[2])
+        end
+    end
+
+    -- An index of pins is described by a table with the fields
+    -- key_prefix, suffix (an empty string for the index in use and ":next"
+    -- for the one of a running reindex), precision, split_threshold and
+    -- merge_threshold (both nil to never split crowded geohashes) and
+    -- full_geohashes. Pins are saved with their geohash cut to the
+    -- precision, or with their most precise known geohash if
+    -- full_geohashes is set. The geohash of the set holding them is cut
+    -- to the precision or longer if the shorter geohashes are split into
+    -- their children.
+
+    -- In the compact layout the pins are spread over pin-buckets small
+    -- hashes, pins:<bucket>, which Redis keeps in its compact encoding.
+    -- Their geohashes are saved as integers, with a leading 1 bit to keep
+    -- their length.
+    local COMPACT_PRECISION = 10 -- 51 bits, exact as a Lua number
+
+    -- return the amount of hashes of a compact namespace or nil
+    local function get_pin_buckets(key_prefix)
+        return tonumber(redis.call('get', key_prefix..'pin-buckets'))
+    end
+
+    -- return the key of the hash holding the geohash of a pin
+    local function pins_key(index, pin_id)
+        if not index.buckets then
+            return index.key_prefix..'pins'..index.suffix
+        end
+        local hash = 0
+        for i = 1, #pin_id do
+            hash = (hash * 31 + string.byte(pin_id, i)) % 2147483647
+        end
+        return index.key_prefix..'pins:'..hash % index.buckets
+    end
+
+    local function geohash_to_int(gh)
+        local n = 1
+        for i = 1, #gh do
+            n = n * 32 + string.find(BASE32, string.sub(gh, i, i), 1, true) - 1
+        end
+        return n
+    end
+
+    local function int_to_geohash(n)
+        local chars = {}
+        while n > 1 do
+            local digit = n % 32
+            table.insert(chars, 1, string.sub(BASE32, digit + 1, digit + 1))
+            n = (n - digit) / 32
+        end
+        return table.concat(chars)
+    end
+
+    -- return the saved geohash of a pin or false
+    local function get_pin_gh(index, pin_id)
+        local value = redis.call('hget', pins_key(index, pin_id), pin_id)
+        if value and index.buckets then
+            return int_to_geohash(tonumber(value))
+        end
+        return value
+    end
+
+    local function set_pin_gh(index, pin_id, gh)
+        -- only splitting needs more than the namespace precision
+        if not index.full_geohashes then
+            gh = string.sub(gh, 1, index.precision)
+        end
+        if index.buckets then
+            gh = string.format('%.0f', geohash_to_int(
+                string.sub(gh, 1, COMPACT_PRECISION)))
+        end
+        redis.call('hset', pins_key(index, pin_id), pin_id, gh)
+    end
+
+    local function delete_pin_gh(index, pin_id)
+        if index.suffix == '' then
+            -- forget when the pin was updated
+            redis.call('zrem', index.key_prefix..'updated', pin_id)
+        end
+        redis.call('hdel', pins_key(index, pin_id), pin_id)
+    end
+
+    -- remove a geohash without pins from the index of geohashes
+    local function forget_empty_cell(index, cell)
+        if redis.call('exists', index.key_prefix..'gh:'..cell) == 0 then
+            redis.call('zrem', index.key_prefix..'cells'..index.suffix, cell)
+        end
+    end
+
+    -- return the geohash of the set holding a pin at gh and a table
+    -- with the split geohashes containing this set
+    local function get_cell(index, gh)
+        local cell = string.sub(gh, 1, index.precision)
+        local splits = {}
+        if index.suffix == '' and index.has_splits then
+            while #cell < #gh and redis.call(
+                    'hexists', index.key_prefix..'split', cell) == 1 do
+                table.insert(splits, cell)
+                cell = string.sub(gh, 1, #cell + 1)
+            end
+        end
+        return cell, splits
+    end
+
+    -- the split hash counts the pins inside every split geohash
+    local function count_split_pins(index, splits, increment)
+        for _, cell in ipairs(splits) do
+            redis.call('hincrby', index.key_prefix..'split', cell, increment)
+        end
+    end
+
+    -- move the pins of a crowded set into the sets of its children
+    local function split_cell(index, cell)
+        local key = index.key_prefix..'gh:'..cell
+        local count = redis.call('scard', key)
+        for _, pin_id in ipairs(redis.call('smembers', key)) do
+            local gh = get_pin_gh(index, pin_id)
+            -- pins saved with a short geohash stay where they are
+            if #gh > #cell then
+                local child = string.sub(gh, 1, #cell + 1)
+                redis.call('smove', key, index.key_prefix..'gh:'..child,
+                           pin_id)
+                redis.call('zadd', index.key_prefix..'cells', 0, child)
+            end
+        end
+        redis.call('hset', index.key_prefix..'split', cell, count)
+        index.has_splits = true
+        forget_empty_cell(index, cell)
+
+        -- the pins may be crowded in one child as well
+        for i = 1, #BASE32 do
+            local child = cell..string.sub(BASE32, i, i)
+            if redis.call('scard', index.key_prefix..'gh:'..child) >
+                    index.split_threshold and #child < MAX_PRECISION then
+                split_cell(index, child)
+            end
+        end
+    end
+
+    -- move the pins of the children of a split geohash back into its set
+    local function merge_cell(index, cell)
+        local key = index.key_prefix..'gh:'..cell
+        for i = 1, #BASE32 do
+            local child = cell..string.sub(BASE32, i, i)
+            if redis.call(
+                    'hexists', index.key_prefix..'split', child) == 1 then
+                merge_cell(index, child)
+            end
+            local child_key = index.key_prefix..'gh:'..child
+            if redis.call('exists', child_key) == 1 then
+                redis.call('sunionstore', key, key, child_key)
+                redis.call('del', child_key)
+                redis.call('zrem', index.key_prefix..'cells', child)
+            end
+        end
+        redis.call('hdel', index.key_prefix..'split', cell)
+        if redis.call('exists', key) == 1 then
+            redis.call('zadd', index.key_prefix..'cells', 0, cell)
+        end
+    end
+
+    -- split the set of a pin which just got crowded
+    local function split_if_crowded(index, cell)
+        if index.split_threshold and #cell < MAX_PRECISION and
+                redis.call('scard', index.key_prefix..'gh:'..cell) >
+                index.split_threshold then
+            split_cell(index, cell)
+        end
+    end
+
+    -- merge the innermost split geohash a pin just left if it got sparse
+    local function merge_if_sparse(index, splits)
+        local cell = splits[#splits]
+        if cell and index.merge_threshold and tonumber(redis.call(
+                'hget', index.key_prefix..'split', cell)) <
+                index.merge_threshold then
+            merge_cell(index, cell)
+        end
+    end
+
+    -- put a pin at the geohash gh and return its previous geohash
+    local function index_pin(index, pin_id, gh)
+        local pin_gh = get_pin_gh(index, pin_id)
+        local new_cell, new_splits = get_cell(index, gh)
+
+        -- if this pin has an location in our redis database
+        if pin_gh then
+            local cell, splits = get_cell(index, pin_gh)
+            if cell ~= new_cell then
+                redis.call(
+                    'smove', -- move this pin
+                    index.key_prefix..'gh:'..cell,     -- from his current set
+                    index.key_prefix..'gh:'..new_cell, -- to the requested one
+                    pin_id)
+                forget_empty_cell(index, cell)
+                count_split_pins(index, splits, -1)
+                count_split_pins(index, new_splits, 1)
+                merge_if_sparse(index, splits)
+            end
+        else
+            -- or if it is not known yet add it to the database
+            redis.call('sadd', index.key_prefix..'gh:'..new_cell, pin_id)
+            count_split_pins(index, new_splits, 1)
+        end
+        -- keep the geohashes with pins in lexicographical order
+        redis.call('zadd', index.key_prefix..'cells'..index.suffix, 0,
+                   new_cell)
+        -- update this pin location at the central index
+        set_pin_gh(index, pin_id, gh)
+
+        split_if_crowded(index, new_cell)
+        return pin_gh
+    end
+
+    -- remove a pin from the index and return its geohash
+    local function unindex_pin(index, pin_id)
+        local pin_gh = get_pin_gh(index, pin_id)
+        if pin_gh then
+            local cell, splits = get_cell(index, pin_gh)
+            delete_pin_gh(index, pin_id)
+            redis.call('srem', index.key_prefix..'gh:'..cell, pin_id)
+            forget_empty_cell(index, cell)
+            count_split_pins(index, splits, -1)
+            merge_if_sparse(index, splits)
+        end
+        return pin_gh
+    end
+
+    -- return the index in use and the one of a running reindex or nil
+    local function get_indexes(key_prefix, options)
+        local index = {
+            key_prefix = key_prefix,
+            suffix = '',
+            precision = get_precision(key_prefix, options.precision),
+            has_splits = redis.call('exists', key_prefix..'split') == 1,
+            buckets = get_pin_buckets(key_prefix),
+        }
+        -- the layout is chosen by the first write to the namespace
+        if options.compact and not index.buckets then
+            if redis.call('exists', key_prefix..'pins') == 1 then
+                error('the namespace does not use the compact layout')
+            end
+            redis.call('set', key_prefix..'pin-buckets', options.compact)
+            index.buckets = options.compact
+        elseif index.buckets and not options.compact then
+            error('the namespace uses the compact layout')
+        end
+        -- splitting while reindexing could mix up the sets of both
+        if redis.call('exists', key_prefix..'reindex') == 0 then
+            index.split_threshold = options.split_threshold
+            index.merge_threshold = options.merge_threshold
+        end
+        -- pins keep their full geohashes if asked to or where geohashes
+        -- may be split
+        local full_geohashes = options.full_geohashes or
+            options.split_threshold ~= nil
+        index.full_geohashes = full_geohashes or index.has_splits
+        local reindex_precision = get_reindex_precision(key_prefix)
+        if reindex_precision then
+            return index, {key_prefix = key_prefix, suffix = ':next',
+                           precision = reindex_precision,
+                           full_geohashes = full_geohashes}
+        end
+        return index, nil
+    end
+
+    -- move one pin from old_gh to new_gh in the density counters, any of
+    -- them may be nil for added or deleted pins. The geohashes with a
+    -- counter are kept in lexicographical order as well.
+    local function update_density(key_prefix, options, old_gh, new_gh)
+        for _, precision in ipairs(options.density_precisions) do
+            local key = key_prefix..'density:'..precision
+            local old_cell = old_gh and string.sub(old_gh, 1, precision)
+            local new_cell = new_gh and string.sub(new_gh, 1, precision)
+            if old_cell ~= new_cell then
+                if old_cell and
+                        redis.call('hincrby', key, old_cell, -1) <= 0 then
+                    redis.call('hdel', key, old_cell)
+                    redis.call('zrem', key..':cells', old_cell)
+                end
+                if new_cell and
+                        redis.call('hincrby', key, new_cell, 1) == 1 then
+                    redis.call('zadd', key..':cells', 0, new_cell)
+                end
+            end
+        end
+    end
+
+    -- return the lengths of the geohashes used by geofences
+    local function get_fence_precisions(key_prefix)
+        return redis.call('hkeys', key_prefix..'fence-precisions')
+    end
+
+    -- return a table with the names of the fences containing a geohash
+    local function get_fences(key_prefix, fence_precisions, gh)
+        local fences = {}
+        if not gh then
+            return fences
+        end
+        for _, precision in ipairs(fence_precisions) do
+            precision = tonumber(precision)
+            if precision <= #gh then
+                for _, name in ipairs(redis.call(
+                        'smembers', key_prefix..'fencecell:'..
+                        string.sub(gh, 1, precision))) do
+                    fences[name] = true
+                end
+            end
+        end
+        return fences
+    end
+
+    -- publish the enter and exit events of a pin moving from old_gh to
+    -- new_gh, any of them may be nil for added or deleted pins
+    local function emit_fence_events(key_prefix, options, fence_precisions,
+                                     pin_id, old_gh, new_gh)
+        if #fence_precisions == 0 then
+            return
+        end
+        local old_fences = get_fences(key_prefix, fence_precisions, old_gh)
+        local new_fences = get_fences(key_prefix, fence_precisions, new_gh)
+        local function emit(name, event)
+            redis.call('xadd', key_prefix..'fence-events',
+                       'maxlen', '~', options.max_fence_events, '*',
+                       'fence', name, 'event', event, 'pin', pin_id)
+        end
+        for name in pairs(old_fences) do
+            if not new_fences[name] then
+                emit(name, 'exit')
+            end
+        end
+        for name in pairs(new_fences) do
+            if not old_fences[name] then
+                emit(name, 'enter')
+            end
+        end
+    end
+'''
+
+
+ADD_OR_MOVE_PIN_SCRIPT = LUA_HELPERS + '''
+    local key_prefix = ARGV[1]   -- prepend this to all keys
+    local options = cjson.decode(ARGV[2])
+
+    -- the updated ordered set keeps when pins were written, by the clock
+    -- of Redis which needs replicating the writes instead of the script
+    local now
+    if options.track_updates then
+        if redis.replicate_commands then
+            redis.replicate_commands()
+        end
+        local time = redis.call('time')
+        now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    end
+
+    local index, next_index = get_indexes(key_prefix, options)
+    local precision = index.precision
+    local fence_precisions = get_fence_precisions(key_prefix)
+
+    -- the remaining arguments come in groups, one per pin: the pin
+    -- that will be added or moved, where this pin should be pinned
+    -- (a geohash at least as precise as the namespace), which data
+    -- should be saved for this pin (an empty string leaves the data
+    -- untouched) and the values of the projected fields of this data
+    -- (an empty string deletes the field)
+    local fields = options.projected_fields
+    for i = 3, #ARGV, 3 + #fields do
+        local pin_id = ARGV[i]
+        local new_pin_gh = ARGV[i + 1]
+        local pin_data = ARGV[i + 2]
+
+        -- set pin data if requested
+        if pin_data ~= '' then
+            redis.call('hset', key_prefix..'data', pin_id, pin_data)
+            for j, field in ipairs(fields) do
+                local value = ARGV[i + 2 + j]
+                if value == '' then
+                    redis.call('hdel', key_prefix..'field:'..field,
+                               pin_id)
+                else
+                    redis.call('hset', key_prefix..'field:'..field,
+                               pin_id, value)
+                end
+            end
+        end
+
+        local pin_gh = index_pin(index, pin_id, new_pin_gh)
+        if now then
+            redis.call('zadd', key_prefix..'updated', now, pin_id)
+        end
+
+        -- a running reindex gets the pin too
+        if next_index then
+            index_pin(next_index, pin_id, new_pin_gh)
+        end
+
+        local old_cell = pin_gh and string.sub(pin_gh, 1, precision)
+        local new_cell = string.sub(new_pin_gh, 1, precision)
+        if old_cell ~= new_cell then
+            update_density(key_prefix, options, old_cell, new_cell)
+            -- tell whoever listens about crossed geofence borders
+            emit_fence_events(key_prefix, options, fence_precisions,
+                              pin_id, old_cell, new_cell)
+        end
+    end'''
+
+DELETE_PIN_SCRIPT = LUA_HELPERS + '''
+    local key_prefix = ARGV[1] -- prepend this to all keys
+    local options = cjson.decode(ARGV[2])
+    local pin_id = ARGV[3]
+    local index, next_index = get_indexes(key_prefix, options)
+
+    local pin_gh = unindex_pin(index, pin_id)
+    if pin_gh then
+        if next_index then
+            unindex_pin(next_index, pin_id)
+        end
+        -- delete data if any
+        redis.call('hdel', key_prefix..'data', pin_id)
+        for _, field in ipairs(options.projected_fields) do
+            redis.call('hdel', key_prefix..'field:'..field, pin_id)
+        end
+        local cell = string.sub(pin_gh, 1, index.precision)
+        update_density(key_prefix, options, cell, nil)
+        emit_fence_events(key_prefix, options,
+                          get_fence_precisions(key_prefix),
+                          pin_id, cell, nil)
+    end
+    return pin_gh'''
+
+AREA_SCRIPT = LUA_HELPERS + '''
+    local key_prefix = ARGV[1] -- prepend this to all keys
+    local precision = get_precision(key_prefix, ARGV[2])
+    -- "pins", "count", "geohashes" to return the pins alternating
+    -- with their most precise known geohashes, "data" to return the pins,
+    -- their geohashes and their data or "explain" to describe the cost
+    -- of the other modes
+    local mode = ARGV[3]
+    -- only return pins updated in this time window, empty for no limit
+    local since = tonumber(ARGV[4])
+    local until_ = tonumber(ARGV[5])
+    -- all other arguments are the geohashes of the area
+
+    local lookups = 0 -- zrangebylex calls
+    local split_checks = 0 -- hexists calls
+    local cells = {}
+    local seen = {} -- geohashes of the area may overlap
+    local function add_cell(cell)
+        if not seen[cell] then
+            seen[cell] = true
+            table.insert(cells, cell)
+        end
+    end
+    for i = 6, #ARGV do
+        local gh = ARGV[i]
+        if #gh < precision then
+            -- look up the geohashes with pins inside this one
+            lookups = lookups + 1
+            for _, cell in ipairs(redis.call(
+                    'zrangebylex', key_prefix..'cells',
+                    '['..gh, '['..gh..'\\255')) do
+                add_cell(cell)
+            end
+        else
+            -- the namespace may have been reindexed to a lower precision
+            gh = string.sub(gh, 1, precision)
+            split_checks = split_checks + 1
+            if redis.call('hexists', key_prefix..'split', gh) == 1 then
+                -- the pins are in the sets of the children
+                lookups = lookups + 1
+                for _, cell in ipairs(redis.call(
+                        'zrangebylex', key_prefix..'cells',
+                        '['..gh, '['..gh..'\\255')) do
+                    add_cell(cell)
+                end
+            else
+                add_cell(gh)
+            end
+        end
+    end
+
+    local index = {key_prefix = key_prefix, suffix = '',
+                   buckets = get_pin_buckets(key_prefix)}
+
+    -- filter by the time window with a table of the pins updated inside
+    -- it, or if the window holds more pins than the area by the update
+    -- time of every pin
+    local window_count = -1
+    local in_window = function(member) return true end
+    if since or until_ then
+        local updated_key = key_prefix..'updated'
+        local min = since or '-inf'
+        local max = until_ or '+inf'
+        window_count = redis.call('zcount', updated_key, min, max)
+        local area_count = 0
+        for _, cell in ipairs(cells) do
+            area_count = area_count + redis.call(
+                'scard', key_prefix..'gh:'..cell)
+        end
+        if window_count < area_count then
+            local window = {}
+            for _, member in ipairs(redis.call(
+                    'zrangebyscore', updated_key, min, max)) do
+                window[member] = true
+            end
+            in_window = function(member) return window[member] end
+        else
+            in_window = function(member)
+                local score = tonumber(redis.call(
+                    'zscore', updated_key, member))
+                return score and (not since or score >= since) and
+                    (not until_ or score <= until_)
+            end
+        end
+    end
+
+    local result = {}
+    if mode == 'explain' then
+        -- the amount of lookups, whether the layout is compact, the amount
+        -- of pins in the time window or -1, then every cell with its
+        -- amount of pins and the length of a random pin id
+        result = {lookups, split_checks, index.buckets and 1 or 0,
+                  window_count}
+        for _, cell in ipairs(cells) do
+            local key = key_prefix..'gh:'..cell
+            local pin_id = redis.call('srandmember', key)
+            table.insert(result, cell)
+            table.insert(result, redis.call('scard', key))
+            table.insert(result, pin_id and #pin_id or 0)
+        end
+    elseif mode == 'count' and window_count == -1 then
+        result = 0
+        for _, cell in ipairs(cells) do
+            result = result + redis.call(
+                'scard', key_prefix..'gh:'..cell)
+        end
+    elseif mode == 'count' then
+        result = 0
+        for _, cell in ipairs(cells) do
+            for _, member in ipairs(redis.call(
+                    'smembers', key_prefix..'gh:'..cell)) do
+                if in_window(member) then
+                    result = result + 1
+                end
+            end
+        end
+    else
+        local data_key = key_prefix..'data'
+        for _, cell in ipairs(cells) do
+            for _, pin_id in ipairs(redis.call(
+                    'smembers', key_prefix..'gh:'..cell)) do
+                if in_window(pin_id) then
+                    table.insert(result, pin_id)
+                    if mode == 'geohashes' or mode == 'data' then
+                        table.insert(result, get_pin_gh(index, pin_id))
+                    end
+                    if mode == 'data' then
+                        table.insert(result,
+                                     redis.call('hget', data_key, pin_id))
+                    end
+                end
+            end
+        end
+    end
+    return result'''
+
+PIN_GEOHASHES_SCRIPT = LUA_HELPERS + '''
+    local key_prefix = ARGV[1] -- prepend this to all keys
+    -- all other arguments are pins, return their geohashes or nil
+
+    local index = {key_prefix = key_prefix, suffix = '',
+                   buckets = get_pin_buckets(key_prefix)}
+    local result = {}
+    for i = 2, #ARGV do
+        table.insert(result, get_pin_gh(index, ARGV[i]))
+    end
+    return result'''
+
+SET_FENCE_SCRIPT = '''
+    local key_prefix = ARGV[1] -- prepend this to all keys
+    local name = ARGV[2]       -- the fence to (re)define
+    -- all other arguments are the geohashes covered by the fence
+
+    -- forget the current definition of this fence
+    local fence_key = key_prefix..'fence:'..name
+    for _, gh in ipairs(redis.call('smembers', fence_key)) do
+        redis.call('srem', key_prefix..'fencecell:'..gh, name)
+        if redis.call(
+                'hincrby', key_prefix..'fence-precisions',
+                #gh, -1) <= 0 then
+            redis.call('hdel', key_prefix..'fence-precisions', #gh)
+        end
+    end
+    redis.call('del', fence_key)
+    redis.call('srem', key_prefix..'fences', name)
+
+    -- and save the new one
+    for i = 3, #ARGV do
+        local gh = ARGV[i]
+        if redis.call('sadd', fence_key, gh) == 1 then
+            redis.call('sadd', key_prefix..'fencecell:'..gh, name)
+            redis.call('hincrby', key_prefix..'fence-precisions', #gh, 1)
+        end
+    end
+    if #ARGV > 2 then
+        redis.call('sadd', key_prefix..'fences', name)
+    end'''
+
+
+REINDEX_BATCH_SCRIPT = LUA_HELPERS + '''
+    local key_prefix = ARGV[1] -- prepend this to all keys
+    local cursor = ARGV[2]     -- where to continue scanning the pins
+    -- the remaining arguments come in groups of three: a pin, the geohash
+    -- it had when it was scanned and the geohash to save for it, at
+    -- least as precise as the new precision
+
+    -- the geohashes to save are cut already if they have to be
+    local next_index = {key_prefix = key_prefix, suffix = ':next',
+                        precision = get_reindex_precision(key_prefix),
+                        full_geohashes = true}
+    if not next_index.precision then
+        return redis.error_reply('no reindex is copying pins')
+    end
+
+    local copied = 0
+    for i = 3, #ARGV, 3 do
+        local pin_id = ARGV[i]
+        -- pins moved or deleted since they were scanned are up to date
+        -- already, the pin scripts write to both indexes meanwhile
+        if redis.call('hget', key_prefix..'pins', pin_id) == ARGV[i + 1] and
+                redis.call('hexists', key_prefix..'pins:next', pin_id) == 0
+                then
+            index_pin(next_index, pin_id, ARGV[i + 2])
+            copied = copied + 1
+        end
+    end
+
+    redis.call('hincrby', key_prefix..'reindex', 'copied', copied)
+    redis.call('hset', key_prefix..'reindex', 'cursor', cursor)
+    if cursor == '0' then
+        redis.call('hset', key_prefix..'reindex', 'status', 'copied')
+    end'''
+
+REINDEX_CUTOVER_SCRIPT = '''
+    local key_prefix = ARGV[1] -- prepend this to all keys
+
+    local reindex = redis.call('hmget', key_prefix..'reindex',
+                               'status', 'precision')
+    if reindex[1] ~= 'copied' then
+        return redis.error_reply('the reindex did not copy all pins yet')
+    end
+
+    -- keep the old index to delete it step by step, deleting it at once
+    -- would block Redis
+    local function swap(name)
+        if redis.call('exists', key_prefix..name) == 1 then
+            redis.call('rename', key_prefix..name, key_prefix..name..':old')
+        end
+        if redis.call('exists', key_prefix..name..':next') == 1 then
+            redis.call('rename', key_prefix..name..':next', key_prefix..name)
+        end
+    end
+    swap('pins')
+    swap('cells')
+
+    redis.call('set', key_prefix..'precision', reindex[2])
+    redis.call('hset', key_prefix..'reindex', 'status', 'cleanup')'''
+
+
+SCRIPTS = {
+    'add_or_move_pin': ADD_OR_MOVE_PIN_SCRIPT,
+    'delete_pin': DELETE_PIN_SCRIPT,
+    'area': AREA_SCRIPT,
+    'pin_geohashes': PIN_GEOHASHES_SCRIPT,
+    'set_fence': SET_FENCE_SCRIPT,
+    'reindex_batch': REINDEX_BATCH_SCRIPT,
+    'reindex_cutover': REINDEX_CUTOVER_SCRIPT,
+}
+
+# script name -> redis-py Script, shared by all clients and called with
+# the client to use, so that it keeps no client alive
+_shared_scripts = {}
+# the connection pools the scripts were loaded with
+_loaded_pools = weakref.WeakKeyDictionary()
+
+
+def get_scripts(redis):
+    """Return the :py:data:`SCRIPTS` as redis-py `Script` objects.
+
+    The scripts are created once and shared by all clients and globes,
+    they are not bound to a client, always pass `client` when calling
+    them. They are loaded into Redis with one pipelined `SCRIPT LOAD` once
+    per connection pool. If Redis forgets them, e.g. after a restart or
+    `SCRIPT FLUSH`, they are loaded again when `EVALSHA` fails with
+    `NOSCRIPT`, see :py:func:`call_script`.
+    """
+    if not _shared_scripts:
+        for name, source in SCRIPTS.items():
+            script = redis.register_script(source)
+            script.registered_client = None
+            _shared_scripts[name] = script
+
+    pool = getattr(redis, 'connection_pool', None)
+    if pool is None or pool not in _loaded_pools:
+        pipe = redis.pipeline(transaction=False)
+        for script in _shared_scripts.values():
+            pipe.script_load(script.script)
+        pipe.execute()
+        if pool is not None:
+            _loaded_pools[pool] = True
+    return _shared_scripts
+
+
+def call_script(script, client, args):
+    """Call a script of :py:func:`get_scripts` with `args` and no keys.
+
+    On a pipeline the call is queued as a plain `EVALSHA`, run the
+    pipeline with :py:func:`execute_pipeline`. Calling the `Script` itself
+    would make redis-py check the scripts of the pipeline with an extra
+    `SCRIPT EXISTS` round trip first.
+    """
+    if hasattr(client, 'command_stack'):
+        return client.evalsha(script.sha, 0, *args)
+    return script(args=args, client=client)
+
+
+def execute_pipeline(pipe):
+    """Execute a pipeline with :py:func:`call_script` calls and return
+    its replies. The calls failing with `NOSCRIPT` are sent again after
+    loading the scripts, costing one more round trip only then. A
+    transaction is sent again as a whole, so that its replies still see
+    the same state.
+    """
+    from redis.exceptions import NoScriptError
+    commands = list(pipe.command_stack)
+    replies = pipe.execute(raise_on_error=False)
+    failed = [i for i, reply in enumerate(replies)
+              if isinstance(reply, NoScriptError)]
+    if failed:
+        if pipe.transaction:
+            failed = range(len(commands))
+        for script in _shared_scripts.values():
+            pipe.script_load(script.script)
+        for i in failed:
+            args, options = commands[i]
+            pipe.pipeline_execute_command(*args, **options)
+        retried = pipe.execute(raise_on_error=False)[len(_shared_scripts):]
+        for i, reply in zip(failed, retried):
+            replies[i] = reply
+    for reply in replies:
+        if isinstance(reply, Exception):
+            raise reply
+    return replies
+
+
+def geohash_children(gh, precision):
+    '''Return all geohashes of length `precision` inside `gh`.
+
+    >>> len(geohash_children('u33', 5))
+    1024
+    >>> geohash_children('u33d', 4)
+    ['u33d']
+    '''
+    ghs = [gh]
+    for i in range(precision - len(gh)):
+        ghs = [child + c for child in ghs for c in BASE32]
+    return ghs
+
+
+# an array of unsigned 64 bit integers, Python 2 only has "L" for this
+try:
+    UINT64 = array('Q').typecode
+except ValueError:
+    UINT64 = 'L'
+
+
+def _unpack_geohash(value):
+    # geohashes of the compact layout are integers with a leading 1 bit
+    number = int(value)
+    chars = []
+    while number > 1:
+        chars.append(BASE32[number & 31])
+        number >>= 5
+    return ''.join(reversed(chars))
+
+
+def _cell_key(gh):
+    '''Return the integer of a geohash in arrays of cells. Its bits are
+    the ones of the geohash padded to :py:data:`MAX_PRECISION` characters,
+    followed by 4 bits with the length of the geohash. Sorting these
+    integers puts geohashes before the ones inside them and these before
+    the geohashes after them.
+
+    >>> _cell_geohash(_cell_key('u33d'))
+    'u33d'
+    >>> sorted(['u33e', 'u33d9', 'u33d'], key=_cell_key)
+    ['u33d', 'u33d9', 'u33e']
+    '''
+    n = geohash_to_int(gh)
+    length = n >> 60
+    value = n & (1 << 60) - 1
+    return value << 5 * (MAX_PRECISION - length) << 4 | length
+
+
+def _cell_geohash(key):
+    '''Return the geohash of an integer of :py:func:`_cell_key`.'''
+    length = key & 0xf
+    return int_to_geohash(length << 60 | key >> 4 >> 5 * (MAX_PRECISION -
+                                                          length))
+
+
+def _cell_range(key):
+    # the half open range of the integers of the most precise geohashes
+    # inside a cell
+    start = key >> 4
+    return start, start + (1 << 5 * (MAX_PRECISION - (key & 0xf)))
+
+
+def _sorted_cells(geohashes):
+    '''Return an array with the sorted integers of a set of geohashes, see
+    :py:func:`_cell_key`.
+    '''
+    return array(UINT64, sorted(set(map(_cell_key, geohashes))))
+
+
+def _drop_nested(cells):
+    # drop the cells of a sorted sequence lying inside a cell before them
+    result = []
+    end = 0
+    for cell in cells:
+        cell_start, cell_end = _cell_range(cell)
+        if cell_start >= end:
+            result.append(cell)
+            end = cell_end
+    return result
+
+
+def _intersect_cells(a, b):
+    '''Merge two sorted sequences of cells into the cells inside both.
+    Of two cells where one lies inside the other the more precise one is
+    kept.
+
+    >>> cells = _intersect_cells(_sorted_cells(['u33', 'u34']),
+    ...                          _sorted_cells(['u33d', 'u33e9', 'u35']))
+    >>> [_cell_geohash(cell) for cell in cells]
+    ['u33d', 'u33e9']
+    '''
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        a_start, a_end = _cell_range(a[i])
+        b_start, b_end = _cell_range(b[j])
+        if a_end <= b_start:
+            i += 1
+        elif b_end <= a_start:
+            j += 1
+        elif a_end - a_start >= b_end - b_start:
+            result.append(b[j])  # inside a[i]
+            j += 1
+        else:
+            result.append(a[i])  # inside b[j]
+            i += 1
+    return _drop_nested(result)
+
+
+def _union_cells(a, b):
+    '''Merge two sorted sequences of cells into their union. Cells lying
+    inside another cell are left out.
+
+    >>> cells = _union_cells(_sorted_cells(['u33', 'u34']),
+    ...                      _sorted_cells(['u33d', 'u35']))
+    >>> [_cell_geohash(cell) for cell in cells]
+    ['u33', 'u34', 'u35']
+    '''
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] <= b[j]:
+            result.append(a[i])
+            i += 1
+        else:
+            result.append(b[j])
+            j += 1
+    result.extend(a[i:])
+    result.extend(b[j:])
+    return _drop_nested(result)
+
+
+def _encode_cells(cells, delta=False):
+    '''Return bytes with the integers of a sorted array, as little endian
+    uint64 or with `delta` as differences in LEB128 varints.
+
+    >>> cells = array(UINT64, [2 ** 62, 2 ** 62 + 1, 2 ** 62 + 300])
+    >>> len(_encode_cells(cells)), len(_encode_cells(cells, delta=True))
+    (25, 13)
+    >>> _decode_cells(_encode_cells(cells, delta=True)) == cells
+    True
+    '''
+    if not delta:
+        return b'r' + struct.pack('<{}Q'.format(len(cells)), *cells)
+    chunks = [b'd']
+    previous = 0
+    for n in cells:
+        n, previous = n - previous, n
+        while n > 0x7f:
+            chunks.append(struct.pack('B', n & 0x7f | 0x80))
+            n >>= 7
+        chunks.append(struct.pack('B', n))
+    return b''.join(chunks)
+
+
+def _decode_cells(data):
+    '''Return the sorted array encoded by :py:func:`_encode_cells`.'''
+    kind, data = data[:1], data[1:]
+    if kind == b'r':
+        return array(UINT64, struct.unpack('<{}Q'.format(len(data) // 8),
+                                           data))
+    if kind != b'd':
+        raise ValueError('unknown cell encoding {!r}'.format(kind))
+    cells = array(UINT64)
+    n = shift = previous = 0
+    for byte in bytearray(data):
+        n |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            previous += n
+            cells.append(previous)
+            n = shift = 0
+    return cells
+
+
+def _spread(count, limit):
+    '''Return up to `limit` evenly spread positions of `count` items.
+
+    >>> _spread(10, 4)
+    [0, 2, 5, 7]
+    >>> _spread(3, 4)
+    [0, 1, 2]
+    '''
+    amount = min(count, limit)
+    return [i * count // amount for i in range(amount)]
+
+
+def distance(a, b):
+    '''Return the great circle distance between two `(latitude,
+    longitude)` points in meters.
+
+    >>> round(distance((52.52, 13.40), (48.14, 11.58)))
+    503833.0
+    '''
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    h = (math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) *
+         math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(1.0, h)))
+
+
+def _grid_range(gh, precision):
+    # the columns and rows of the grid of geohashes of `precision` a
+    # geohash spans, as half open ranges
+    lon_cells = 2 ** ((5 * precision + 1) // 2)
+    lat_cells = 2 ** (5 * precision // 2)
+    bbox = geohash.bbox(gh)
+    x0 = int(math.floor((bbox['w'] + 180) / 360 * lon_cells + 1e-9))
+    x1 = int(math.ceil((bbox['e'] + 180) / 360 * lon_cells - 1e-9))
+    y0 = int(math.floor((bbox['s'] + 90) / 180 * lat_cells + 1e-9))
+    y1 = int(math.ceil((bbox['n'] + 90) / 180 * lat_cells - 1e-9))
+    return x0, max(x1, x0 + 1), y0, max(y1, y0 + 1)
+
+
+def geohash_rings(origin, geohashes, precision):
+    '''Group geohashes by their ring around the geohash of `origin` of
+    length `precision`, the amount of geohashes of this length between
+    them as in :py:func:`geohash_and_neighbors`. Return a list of the
+    `(ring, geohashes)` tuples sorted by ring.
+
+    >>> geohash.encode(52.52, 13.40, precision=6)
+    'u33dbb'
+    >>> geohash_rings((52.52, 13.40), ['u33dbb', 'u33dbc', 'u33d8', 'u33e'], 6)
+    [(0, ['u33dbb']), (1, ['u33d8', 'u33dbc']), (8, ['u33e'])]
+    '''
+    x, _, y, _ = _grid_range(geohash.encode(origin[0], origin[1],
+                                            precision=precision), precision)
+    rings = {}
+    for gh in geohashes:
+        x0, x1, y0, y1 = _grid_range(gh, precision)
+        dx = x0 - x if x < x0 else max(0, x - x1 + 1)
+        dy = y0 - y if y < y0 else max(0, y - y1 + 1)
+        rings.setdefault(max(dx, dy), []).append(gh)
+    return [(ring, sorted(rings[ring])) for ring in sorted(rings)]
+
+
 def hscan(redis, *args, **kw):
     cursor = 0
     while True:
@@ -97,6 +1124,7 @@ class NominatimGeocode(object):
                          'Geonear Pre-Beta ({})'.format(PROJECT_URL)}
 
     def geocode(self, query):
+        import requests  # imported here, query workers do not need it
         result = requests.get(self._endpoint,
                               params={
                                   'q': query, 'email': self._mail,
@@ -138,8 +1166,62 @@ class Globe(object):
     :param str namespace: Namespace for this geonear database.
     :param str nominatim_endpoint: Where geolocation API calls go to.
     :param str nominatim_mail: Optional email sended with nominatim API calls.
-    :param data_serialize: Function to serialize pin data.
+    :param data_serialize: Function to serialize pin data,
+        see :py:mod:`geonear.codec` for compact binary formats.
     :param data_deserialize: Function to deserialize pin data.
+    :param int max_fence_events: Approximate amount of geofence events to
+        keep, see :py:meth:`fence_events`.
+    :param density_precisions: Geohash lengths to keep pin counts for,
+        see :py:meth:`density`. All globes writing to a namespace must use
+        the same `density_precisions`.
+    :param projected_fields: Keys of dict pin data to store separately as
+        well, so that :py:meth:`map_with_field` can read them without
+        deserializing the whole data. All globes writing to a namespace
+        must use the same `projected_fields`.
+    :param int split_threshold: Split a geohash into its 32 children when it
+        holds more than this many pins, so that queries touching crowded
+        places only read the sets of the children they need. None to never
+        split. Implies `full_geohashes`. All globes writing to a namespace
+        should use the same `split_threshold`.
+    :param int merge_threshold: Merge the children back when the split
+        geohash holds less than this many pins, by default a fourth of the
+        `split_threshold`.
+    :param bool full_geohashes: Keep the geohashes pins are written with,
+        of :py:data:`MAX_PRECISION` characters, instead of cutting them to
+        the `geohash_precision`. The pins in the border geohashes of
+        :py:meth:`in_bbox` and :py:meth:`in_polygon` are filtered by these
+        geohashes, as well as the ones sorted by
+        :py:meth:`Area.by_distance` with `exact`. Without, the centres of
+        the cut geohashes are used. All globes writing to a namespace
+        should agree on `full_geohashes`.
+    :param bool compact: Use the compact layout for a new namespace. The
+        geohashes of the pins are kept as integers in `pin_buckets` small
+        hashes instead of one large hash. Redis keeps these in its compact
+        encoding as long as each holds at most `hash-max-listpack-entries`
+        pins (`hash-max-ziplist-entries` before Redis 7). Geohashes are
+        kept with at most :py:data:`COMPACT_PRECISION` characters, so this
+        needs a `geohash_precision` of at most that, and the namespace can
+        not be reindexed. The sets of the geohashes hold the pin ids in
+        both layouts, Redis keeps them as intsets if the ids are integers.
+        All globes using a namespace must agree on `compact`, see
+        :py:meth:`memory_stats` to compare both layouts.
+    :param int pin_buckets: Amount of hashes of a new compact namespace,
+        about the expected amount of pins divided by 64.
+    :param readers: Clients of replicas of `redis` or a
+        :py:class:`geonear.readers.ReaderPool`. Read only commands and
+        scripts are spread over them, writes go to `redis`.
+    :param str consistency: What reads from `readers` see. `eventual`
+        reads whatever the replicas have. With `session` every write also
+        sets a marker and reads pass over replicas which did not get the
+        last write of the globe yet, see :py:meth:`session`. With `wait`
+        every write waits up to `wait_timeout` milliseconds for all
+        replicas to get it, if some do not the globe reads from `redis`
+        until the next write.
+    :param int wait_timeout: See `consistency`.
+    :param bool track_updates: Record when pins are added or moved, by the
+        clock of Redis in seconds since the epoch, so that areas can be
+        limited to the pins updated in a time window. All globes writing
+        to a namespace should agree on `track_updates`.
 
     >>> import redis
     >>> globe = Globe(redis.StrictRedis(), geohash_precision=8)
@@ -156,85 +1238,208 @@ class Globe(object):
                  cache_geocoding=20,  # FIXME: XXX seems not to be working!!!
                  nominatim_mail=None,
                  data_serialize=json.dumps,
-                 data_deserialize=json.loads):
+                 data_deserialize=json.loads,
+                 max_fence_events=100000,
+                 density_precisions=(),
+                 projected_fields=(),
+                 split_threshold=None,
+                 merge_threshold=None,
+                 full_geohashes=False,
+                 compact=False,
+                 pin_buckets=1024,
+                 readers=None,
+                 consistency='eventual',
+                 wait_timeout=100,
+                 track_updates=False):
 
         self._redis = redis
         self._geohash_precision = geohash_precision
         self._cache_geocoding = cache_geocoding
-        self._nominatim = NominatimGeocode(
-            mail=nominatim_mail,
-            endpoint=nominatim_endpoint)
+        self._nominatim_mail = nominatim_mail
+        self._nominatim_endpoint = nominatim_endpoint
+        self._nominatim_geocode = None
         self._key_prefix = 'globe:{}:'.format(namespace)
         self._data_serialize = data_serialize
         self._data_deserialize = data_deserialize
 
-        self._add_or_move_pin_script = redis.register_script('''
-            local key_prefix = ARGV[1]   -- prepend this to all keys
-            local pin_id = ARGV[2]       -- the pin that will be added or moved
-            local new_pin_gh = ARGV[3]   -- where this pin should be pinned
-            local pin_data = ARGV[4] -- which data should be saved for this pin
-
-            -- get the current pin location
-            local pin_gh = redis.call('hget', key_prefix..'pins', pin_id)
-
-            -- set pin data if requested
-            if pin_data then
-                redis.call('hset', key_prefix..'data', pin_id, pin_data)
-            end
+        self._density_precisions = tuple(sorted(set(density_precisions)))
+        for precision in self._density_precisions:
+            if not 0 < precision <= geohash_precision:
+                raise ValueError(
+                    'density precision {} out of range'.format(precision))
+
+        self._projected_fields = tuple(projected_fields)
+        if compact and geohash_precision > COMPACT_PRECISION:
+            raise ValueError('the compact layout keeps geohashes of at most '
+                             '{} characters'.format(COMPACT_PRECISION))
+        self._compact = compact
+        self._full_geohashes = full_geohashes or split_threshold is not None
+        if split_threshold is not None and merge_threshold is None:
+            merge_threshold = split_threshold // 4
+
+        # settings for the scripts, None is left out as cjson decodes it to
+        # a true value
+        self._script_options = json.dumps(dict(
+            (key, value) for key, value in {
+                'precision': geohash_precision,
+                'max_fence_events': max_fence_events,
+                'density_precisions': self._density_precisions,
+                'projected_fields': self._projected_fields,
+                'split_threshold': split_threshold,
+                'merge_threshold': merge_threshold,
+                'full_geohashes': full_geohashes or None,
+                'compact': pin_buckets if compact else None,
+                'track_updates': track_updates or None,
+            }.items() if value is not None))
+        self._track_updates = track_updates
+
+        if consistency not in ('eventual', 'session', 'wait'):
+            raise ValueError('unknown consistency {}'.format(consistency))
+        if readers is not None and not isinstance(readers, ReaderPool):
+            readers = ReaderPool(readers)
+        if readers is not None and readers.fallback is None:
+            readers.fallback = redis
+        self._readers = readers
+        self._consistency = consistency
+        self._wait_timeout = wait_timeout
+        self._start_session()
+
+        scripts = get_scripts(redis)
+        self._add_or_move_pin_script = scripts['add_or_move_pin']
+        self._delete_pin_script = scripts['delete_pin']
+        self._area_script = scripts['area']
+        self._pin_geohashes_script = scripts['pin_geohashes']
+        self._set_fence_script = scripts['set_fence']
+        self._reindex_batch_script = scripts['reindex_batch']
+        self._reindex_cutover_script = scripts['reindex_cutover']
+
+    def _start_session(self):
+        self._marker_key = '{}session:{}'.format(self._key_prefix,
+                                                 uuid.uuid4().hex)
+        self._writes = 0  # writes of this session
+        self._last_write = 0.0
+        self._caught_up = set()  # ids of readers having the last write
+        self._replicas_behind = False
+
+    def session(self):
+        """Return a copy of this globe reading its own writes, but not
+        necessarily the ones of other sessions, when the `consistency` is
+        `session`. Copies are cheap, use one per request or user.
+        """
+        session = copy.copy(self)
+        session._start_session()
+        return session
 
-            -- if this pin has an location in our redis database
-            if pin_gh then
-                redis.call(
-                    'smove', -- move this pin
-                    key_prefix..'gh:'..pin_gh,     -- from his current geohash
-                    key_prefix..'gh:'..new_pin_gh, -- to the requested geohash
-                    pin_id)
-            else
-                -- or if it is not known yet add it to the database
-                redis.call('sadd', key_prefix.."gh:"..new_pin_gh, pin_id)
-            end
-            -- update this pin location at the central index
-            redis.call('hset', key_prefix..'pins', pin_id, new_pin_gh)''')
-
-        self._delete_pin_script = redis.register_script('''
-            local key_prefix = ARGV[1] -- prepend this to all keys
-            local pin_id = ARGV[2]
-
-            local pin_gh = redis.call('hget', key_prefix..'pins', pin_id)
-            if pin_gh then
-                redis.call('hdel', key_prefix..'pins', pin_id)
-                -- delete data if any
-                redis.call('hdel', key_prefix..'data', pin_id)
-                redis.call('srem', key_prefix..'gh:'..pin_gh, pin_id)
-            end
-            return pin_gh''')
+    def _write(self, write):
+        """Return `write(client)` with the client to write to, making the
+        write visible to later reads as the `consistency` demands.
+        """
+        if self._readers is None or self._consistency == 'eventual':
+            return write(self._redis)
+
+        if self._consistency == 'session':
+            # the replicas get the marker after the write
+            pipe = self._redis.pipeline(transaction=False)
+            write(pipe)
+            pipe.set(self._marker_key, self._writes + 1,
+                     ex=SESSION_MARKER_TTL)
+            result = execute_pipeline(pipe)[0]
+            self._writes += 1
+            self._last_write = time.time()
+            self._caught_up.clear()
+            return result
+
+        result = write(self._redis)
+        acked = self._redis.wait(len(self._readers), self._wait_timeout)
+        self._replicas_behind = acked < len(self._readers)
+        return result
+
+    def _read(self, read):
+        """Return `read(client)` with a client for read only commands, a
+        replica if there are `readers`.
+        """
+        if self._readers is None or self._replicas_behind:
+            return read(self._redis)
+        if (self._consistency == 'session' and self._writes and
+                time.time() - self._last_write < SESSION_MARKER_TTL):
+            return self._readers.execute(read, self._has_session_writes)
+        return self._readers.execute(read)
+
+    def _has_session_writes(self, reader):
+        if id(reader) not in self._caught_up:
+            if int(reader.get(self._marker_key) or 0) < self._writes:
+                return False
+            self._caught_up.add(id(reader))
+        return True
 
     def pin(self, pin_id, **loc):
         """Insert a pin or change its position.
 
         See :py:meth:`loc2geohash` for `loc`.
         """
-        # TODO: also allow setting data
-        gh = self.loc2geohash(loc)
-        pin_data = loc.get('data')
-        if pin_data:
-            args = [self._key_prefix, pin_id, gh,
-                    self._data_serialize(pin_data)]
+        # the scripts cut the geohash to the precision of the namespace,
+        # which may differ from ours while it is reindexed
+        gh = self.loc2geohash(loc, MAX_PRECISION)
+        pin_data = self._serialize_pin_data(loc.get('data'))
+        self._pin_many([(pin_id, gh, pin_data)])
+
+    def _serialize_pin_data(self, pin_data, serialized_data=None):
+        """Return a tuple with the serialized data and the serialized
+        projected fields of a pin or None if no data is given. Pass
+        `serialized_data` if the data is serialized already.
+        """
+        return serialize_pin_data(pin_data, self._data_serialize,
+                                  self._projected_fields, serialized_data)
+
+    def _pin_many(self, pins, client=None):
+        """Add or move many pins with one script call.
+
+        :param pins: Iterable of `(pin_id, geohash, serialized_data)` tuples,
+            `geohash` at least as precise as the namespace and
+            `serialized_data` as returned by :py:meth:`_serialize_pin_data`.
+        :param client: A pipeline to queue the call on instead.
+        """
+        args = [self._key_prefix, self._script_options]
+        no_data = ('',) * (1 + len(self._projected_fields))
+        for pin_id, gh, pin_data in pins:
+            args.extend((pin_id, gh))
+            args.extend(pin_data or no_data)
+        if len(args) <= 2:
+            return
+        if client is not None:
+            call_script(self._add_or_move_pin_script, client, args)
         else:
-            args = [self._key_prefix, pin_id, gh]
-        self._add_or_move_pin_script(args=args)
+            self._write(lambda client: call_script(
+                self._add_or_move_pin_script, client, args))
 
-    def near(self, size=1, **loc):
+    def buffer(self, **kw):
+        """Return a :py:class:`WriteBuffer` writing to this globe.
+
+        See :py:class:`WriteBuffer` for the keyword arguments.
+        """
+        return WriteBuffer(self, **kw)
+
+    def snapshot(self):
+        """Return a :py:class:`Snapshot` reading from this globe."""
+        return Snapshot(self)
+
+    def near(self, size=1, since=None, until=None, **loc):
         """Return an :py:class:`Area` object for the specified location.
         A `size` of 1 implicates a search radios of a grid with 3x3 geohashes,
         a `size` of 2 increases the search radius to 5x5 geohashes,
         `size` 3 means a 7x7 grid and so forth.
 
         See :py:meth:`loc2geohash` for `loc`.
+
+        :param since: Only pins added or moved at or after this unix time,
+            needs `track_updates`.
+        :param until: Only pins added or moved at or before this unix time.
         """
-        gh = self.loc2geohash(loc)
+        origin_gh = self.loc2geohash(loc, MAX_PRECISION)
+        gh = origin_gh[:self._geohash_precision]
         geohashes = geohash_and_neighbors(gh, size)
-        return self.make_area(geohashes)
+        return self.make_area(geohashes, since=since, until=until,
+                              origin=geohash.decode(origin_gh))
 
     def almost_near(self, **loc):
         """Return an :py:class:`Area` for a 3x3 geohash grid.
@@ -258,56 +1463,246 @@ class Globe(object):
         """
         return self.near(4, **loc)
 
+    def join(self, other, size=1, buffer=1000, pipeline_size=50):
+        """Yield a `(pin_id, other_pin_ids)` tuple for every pin of this
+        globe, with the list of the pins of the globe `other` in the
+        :py:meth:`near` grid of the pin, as `other.near(size)` finds them.
+
+        Pins are grouped by the geohash of `other` they lie in, the grid of
+        every such geohash is read once. The grids of `pipeline_size`
+        geohashes are read with one round trip, each geohash of `other`
+        inside them with one script call, so the round trips grow with the
+        geohashes holding pins and not with the pins.
+
+        The pins of this globe are read from its index of the geohashes
+        with pins, see :py:meth:`rebuild_cell_index`, `buffer` geohashes at
+        a time with one `ZRANGEBYLEX` and one round trip of `SMEMBERS`
+        calls, plus one for their geohashes if this globe is less precise
+        than `other`. Their tuples are yielded before the next geohashes
+        are read, so the memory used is bounded by `buffer` and not by the
+        size of the globe. This operation is not atomic.
+
+        >>> import redis
+        >>> orders = Globe(redis.StrictRedis(), geohash_precision=6,
+        ...                namespace='orders')
+        >>> couriers = Globe(redis.StrictRedis(), geohash_precision=6,
+        ...                  namespace='couriers')
+        >>> orders.pin('order1', latlon=(52.52, 13.40))
+        >>> couriers.pin('courier1', latlon=(52.52, 13.41))
+        >>> list(orders.join(couriers, size=2))
+        [('order1', ['courier1'])]
+        """
+        precision = other._geohash_precision
+        groups = {}
+        last = None
+        while True:
+            cells, pin_ids = self._cell_batch(last, buffer)
+            short = [pin_id for cell, members in zip(cells, pin_ids)
+                     if len(cell) < precision for pin_id in members]
+            if short:
+                for pin_id, gh in zip(short, self._pin_geohashes(short)):
+                    if gh:  # unless deleted meanwhile
+                        groups.setdefault(gh[:precision], []).append(pin_id)
+            for cell, members in zip(cells, pin_ids):
+                if len(cell) >= precision:
+                    groups.setdefault(cell[:precision], []).extend(members)
+
+            # the sets of the last geohash of `other` may go on in the
+            # next batch, its grid is read with them
+            pending = None
+            if len(cells) == buffer:
+                last = cells[-1]
+                if len(last) >= precision:
+                    pending = last[:precision]
+            batch = dict((cell, group) for cell, group in groups.items()
+                         if cell != pending)
+            for pair in self._join_cells(other, batch, size, pipeline_size):
+                yield pair
+            if len(cells) < buffer:
+                return
+            groups = dict((cell, group) for cell, group in groups.items()
+                          if cell == pending)
+
+    def _cell_batch(self, last, buffer):
+        # the next `buffer` geohashes of the index after `last`, and the
+        # pin ids of their sets
+        def read(client):
+            cells = client.zrangebylex(
+                self._key_prefix + 'cells',
+                '-' if last is None else '(' + last, '+', 0, buffer)
+            if not cells:
+                return [], []
+            pipe = client.pipeline(transaction=False)
+            for cell in cells:
+                pipe.smembers(self._key_prefix + 'gh:' + cell)
+            return cells, pipe.execute()
+        return self._read(read)
+
+    def _join_cells(self, other, groups, size, pipeline_size):
+        # yield the pairs of Globe.join for the pins grouped by the
+        # geohashes of `other`
+        # neighboring geohashes are next to each other when sorted, so
+        # the grids of a batch share most of their geohashes
+        cells = sorted(groups)
+        for start in range(0, len(cells), pipeline_size):
+            batch = cells[start:start + pipeline_size]
+            grids = [geohash_and_neighbors(cell, size) for cell in batch]
+            lookups = sorted(set().union(*grids))
+
+            def read(client):
+                pipe = client.pipeline(transaction=False)
+                for lookup in lookups:
+                    other._area_pins([lookup], client=pipe)
+                return execute_pipeline(pipe)
+            found = dict(zip(lookups, other._read(read)))
+
+            for cell, grid in zip(batch, grids):
+                other_pin_ids = sorted(
+                    pin_id for lookup in grid for pin_id in found[lookup])
+                for pin_id in sorted(groups[cell]):
+                    yield pin_id, other_pin_ids
+
     def data(self, pin_id):
         """Return the data of a pin or None if no data."""
         # check if pin_id exists?
-        return self._redis.hget(self._key_prefix + 'data', pin_id)
+        return self._read(
+            lambda client: client.hget(self._key_prefix + 'data', pin_id))
+
+    def filter_data(self, pin_ids, lazy=False):
+        """Return a tuple containing the data of the given pins if any.
 
-    def filter_data(self, pin_ids):
-        """Return a tuple containing the data of the given pins if any."""
+        With `lazy` return :py:class:`geonear.codec.LazyData` objects only
+        deserializing their `value` when it is accessed.
+        """
         pin_ids = tuple(pin_ids)
         if not pin_ids:
             return ()
-        return (self._data_deserialize(data) for data in
-                self._redis.hmget(self._key_prefix + 'data', *pin_ids)
-                if data is not None)
-
-    def map_with_data(self, pin_ids):
+        pin_datas = self._read(
+            lambda client: client.hmget(self._key_prefix + 'data', *pin_ids))
+        if lazy:
+            return (LazyData(data, self._data_deserialize)
+                    for data in pin_datas if data is not None)
+        return (self._data_deserialize(data)
+                for data in pin_datas if data is not None)
+
+    def map_with_data(self, pin_ids, lazy=False):
         """Return a dict of the given pins with their data
         or None for no data.
+
+        With `lazy` return a :py:class:`geonear.codec.LazyDataMap`
+        deserializing the data of a pin when it is looked up.
         """
         pin_ids = tuple(pin_ids)
         if not pin_ids:
             return ()
-        pin_datas = self._redis.hmget(self._key_prefix + 'data', *pin_ids)
+        pin_datas = self._read(
+            lambda client: client.hmget(self._key_prefix + 'data', *pin_ids))
+        if lazy:
+            return LazyDataMap(dict(zip(pin_ids, pin_datas)),
+                               self._data_deserialize)
         return dict(zip(pin_ids,
                         ((self._data_deserialize(data)
                           if data is not None else None)
                          for data in pin_datas)))
 
+    def map_with_field(self, pin_ids, field):
+        """Return a dict of the given pins with the value of one of the
+        `projected_fields` of their data or None if not set.
+
+        Only this field is fetched and deserialized, not the whole data.
+        """
+        if field not in self._projected_fields:
+            raise ValueError('field {} is not projected'.format(field))
+        pin_ids = tuple(pin_ids)
+        if not pin_ids:
+            return {}
+        values = self._read(lambda client: client.hmget(
+            self._key_prefix + 'field:' + field, *pin_ids))
+        return dict(zip(pin_ids,
+                        ((self._data_deserialize(value)
+                          if value is not None else None)
+                         for value in values)))
+
     def delete(self, pin_id):
         """Delete this pin."""
         # TODO: can also delete a Area object and a list of pin ids
-        success = self._delete_pin_script(args=[self._key_prefix, pin_id])
+        success = self._write(lambda client: call_script(
+            self._delete_pin_script, client,
+            [self._key_prefix, self._script_options, pin_id]))
         if not success:
             raise ValueError('pin {} not found'.format(pin_id))
 
     def __contains__(self, pin_id):
         """Check a `pin_id` exists in this database."""
-        return bool(self._redis.hexists(self._key_prefix + "pins", pin_id))
+        if self._compact:
+            return self._pin_geohashes([pin_id])[0] is not None
+        return bool(self._read(lambda client: client.hexists(
+            self._key_prefix + 'pins', pin_id)))
 
     def __len__(self):
         """Return number of known pins."""
-        return self._redis.hlen(self._key_prefix + 'pins')
+        if not self._compact:
+            return self._read(
+                lambda client: client.hlen(self._key_prefix + 'pins'))
+
+        def read(client):
+            pipe = client.pipeline(transaction=False)
+            for key in self._pin_bucket_keys(client):
+                pipe.hlen(key)
+            return sum(pipe.execute())
+        return self._read(read)
 
     def geohash_scan(self, buffer=50):
         """:param int buffer: `buffer` is the amount of pins to fetch with each `hscan` Redis call.
         Returns an iterable of two element sized tuples,
         first element is the pin id, second its geohash.
         It is guaranteed that the iterable contains all known pin_ids.
+        The compact layout reads `buffer` of its hashes per call instead.
         This operation is not atomic.
         """
-        return hscan(self._redis, self._key_prefix + 'pins', count=buffer)
+        if not self._compact:
+            return (pin for _, page in self._hscan_pages(
+                self._key_prefix + 'pins', buffer) for pin in page.items())
+        return self._compact_geohash_scan(buffer)
+
+    def _compact_geohash_scan(self, buffer):
+        # the hashes are small, read `buffer` of them per round trip
+        keys = self._read(self._pin_bucket_keys)
+        for i in range(0, len(keys), buffer):
+            def read(client):
+                pipe = client.pipeline(transaction=False)
+                for key in keys[i:i + buffer]:
+                    pipe.hgetall(key)
+                return pipe.execute()
+            for pins in self._read(read):
+                for pin_id, value in pins.items():
+                    yield pin_id, _unpack_geohash(value)
+
+    def _pin_bucket_keys(self, client=None):
+        """Return the keys of the hashes of the pins of the compact
+        layout.
+        """
+        client = client or self._redis
+        count = int(client.get(self._key_prefix + 'pin-buckets') or 0)
+        return ['{}pins:{}'.format(self._key_prefix, bucket)
+                for bucket in range(count)]
+
+    def _hscan_pages(self, key, buffer):
+        """Yield the client and the dict of every page of an `hscan` of
+        `key`.
+
+        The first page is read with :py:meth:`_read`, so that a failing
+        replica is passed over. The cursor only works with the client the
+        scan started with, so a replica failing in the middle of a scan
+        raises its error.
+        """
+        client, (cursor, page) = self._read(lambda client: (
+            client, client.hscan(key, cursor=0, count=buffer)))
+        while True:
+            yield client, page
+            if not int(cursor):  # int because cursor is returned as string
+                break
+            cursor, page = client.hscan(key, cursor=cursor, count=buffer)
 
     def latlon_scan(self, buffer=50):
         """Same as geohash_scan, but instead of a geohash gives a tuple with
@@ -321,13 +1716,90 @@ class Globe(object):
         return ((pin, geohash.bbox(gh))
                 for pin, gh in self.geohash_scan(buffer))
 
-    def data_scan(self, buffer=50):
-        """Analog to :py:meth:`geohash_scan` for the pin's data."""
+    def data_scan(self, buffer=50, lazy=False):
+        """Analog to :py:meth:`geohash_scan` for the pin's data.
+
+        See :py:meth:`filter_data` for `lazy`.
+        """
+        scan = (pin for _, page in self._hscan_pages(
+            self._key_prefix + 'data', buffer) for pin in page.items())
+        if lazy:
+            return ((pin_id, LazyData(data, self._data_deserialize))
+                    for pin_id, data in scan)
         return (
             (pin_id, (self._data_deserialize(data)
                       if data is not None else None))
-            for pin_id, data
-            in hscan(self._redis, self._key_prefix + 'data', count=buffer))
+            for pin_id, data in scan)
+
+    def export(self, path, buffer=1000):
+        """Write all pins with their geohashes and data to the snapshot
+        file `path`, see :py:mod:`geonear.snapshot`. Return the amount of
+        written pins.
+
+        Pins are read and written in blocks of `buffer` pins. This operation
+        is not atomic, pins written meanwhile may be left out.
+        """
+        count = 0
+        with open(path, 'wb') as f:
+            writer = snapshot.SnapshotWriter(f)
+            block = []
+            for pin in self.geohash_scan(buffer):
+                block.append(pin)
+                if len(block) >= buffer:
+                    count += self._export_block(writer, block)
+                    block = []
+            count += self._export_block(writer, block)
+            writer.close()
+        return count
+
+    def _export_block(self, writer, pins):
+        if not pins:
+            return 0
+        pin_ids = [pin_id for pin_id, _ in pins]
+        datas = self._read(lambda client: client.hmget(
+            self._key_prefix + 'data', *pin_ids))
+        writer.write_block([(pin_id, gh, data) for (pin_id, gh), data
+                            in zip(pins, datas)])
+        return len(pins)
+
+    def import_(self, path, batch_size=500, pipeline_size=10):
+        """Add or move the pins of a snapshot file written by
+        :py:meth:`export`, return the amount of pins.
+
+        The file is read memory mapped. Pins are written with one script
+        call per `batch_size` pins, sending `pipeline_size` calls per round
+        trip. The data is written as it is, so both globes must use the
+        same `data_serialize`, or compatible ones like the
+        :py:class:`geonear.codec.Codec` family.
+        """
+        count = 0
+        queued = 0
+        pipe = self._redis.pipeline(transaction=False)
+        for block in snapshot.read_snapshot(path):
+            for i in range(0, len(block), batch_size):
+                batch = []
+                for pin_id, gh, data in block[i:i + batch_size]:
+                    if len(gh) < self._geohash_precision:
+                        # saved with a shorter geohash by an older version
+                        gh = geohash.encode(*geohash.decode(gh),
+                                            precision=MAX_PRECISION)
+                    batch.append((pin_id, gh, self._imported_pin_data(data)))
+                self._pin_many(batch, client=pipe)
+                count += len(batch)
+                queued += 1
+                if queued >= pipeline_size:
+                    execute_pipeline(pipe)
+                    queued = 0
+        if queued:
+            execute_pipeline(pipe)
+        return count
+
+    def _imported_pin_data(self, data):
+        if data is None:
+            return None
+        if not self._projected_fields:
+            return (data,)
+        return self._serialize_pin_data(self._data_deserialize(data), data)
 
     def scan(self, buffer=50):
         """Return an iterable with all pins."""
@@ -339,8 +1811,15 @@ class Globe(object):
         return geohash.decode(gh)
 
     def geohash(self, pin_id):
-        """Return the geohash of a pin."""
-        gh = self._redis.hget(self._key_prefix + 'pins', pin_id)
+        """Return the geohash of a pin, of :py:data:`MAX_PRECISION`
+        characters with `full_geohashes`, or of
+        :py:data:`COMPACT_PRECISION` ones in the compact layout.
+        """
+        if self._compact:
+            gh, = self._pin_geohashes([pin_id])
+        else:
+            gh = self._read(lambda client: client.hget(
+                self._key_prefix + 'pins', pin_id))
         if not gh:
             raise ValueError('no such pin_id')
         return gh
@@ -351,22 +1830,427 @@ class Globe(object):
         gh = self.geohash(pin_id)
         return geohash.bbox(gh)
 
-    def make_area(self, geohashes):
-        """get an :py:class:`Area` object for specified geohashes."""
-        return Area(self._redis, geohashes, key_prefix=self._key_prefix)
+    def make_area(self, geohashes, since=None, until=None, origin=None):
+        """get an :py:class:`Area` object for specified geohashes, see
+        :py:meth:`near` for `since` and `until` and
+        :py:meth:`Area.by_distance` for `origin`.
+        """
+        return Area(self, geohashes, since=since, until=until, origin=origin)
+
+    def in_bbox(self, s, w, n, e, max_cells=64, since=None, until=None):
+        """Return an :py:class:`Area` with the pins inside a bounding box.
 
-    def loc2geohash(self, loc):
+        The box is covered with at most `max_cells` geohashes of mixed
+        precision, pins in geohashes crossing its border are filtered by
+        their location, exactly with `full_geohashes`.
+
+        :param s: Southern latitude.
+        :param w: Western longitude.
+        :param n: Northern latitude.
+        :param e: Eastern longitude.
         """
-        Used internally to convert the "\\*\\*loc" into a geohash.
+        return self._cover_area(cover.BBoxRegion(s, w, n, e), max_cells,
+                                since, until)
+
+    def in_polygon(self, points, max_cells=64, since=None, until=None):
+        """Return an :py:class:`Area` with the pins inside a polygon.
+
+        Analog to :py:meth:`in_bbox`, the exact filter is vectorised with
+        numpy if it is installed.
+
+        :param points: The `(latitude, longitude)` corners of the polygon.
+        """
+        return self._cover_area(cover.PolygonRegion(points), max_cells,
+                                since, until)
+
+    def _cover_area(self, region, max_cells, since=None, until=None):
+        inside, edges = cover.cover(region, max_cells=max_cells,
+                                    max_precision=self._geohash_precision)
+        return Area(self, inside | edges, clip=region, edges=edges,
+                    since=since, until=until)
+
+    def _area_pins(self, geohashes, count=False, with_geohashes=False,
+                   explain=False, client=None, since=None, until=None,
+                   with_data=False):
+        """Return the pins inside `geohashes` which may be less precise
+        than the globe, or only their amount if `count` is set. With
+        `with_geohashes` return a flat list alternating the pin ids and
+        their geohashes, with `with_data` a flat list of the pin ids, their
+        geohashes and their serialized data, with `explain` the raw plan of
+        the area script.
+        `since` and `until` limit the pins to a time window.
+        """
+        if (since is not None or until is not None) and \
+                not self._track_updates:
+            raise ValueError('time windows need a globe with track_updates')
+        if explain:
+            mode = 'explain'
+        elif count:
+            mode = 'count'
+        elif with_data:
+            mode = 'data'
+        elif with_geohashes:
+            mode = 'geohashes'
+        else:
+            mode = 'pins'
+        args = [self._key_prefix, self._geohash_precision, mode,
+                '' if since is None else repr(float(since)),
+                '' if until is None else repr(float(until))] + \
+            list(geohashes)
+        if client is None:
+            return self._read(
+                lambda client: call_script(self._area_script, client, args))
+        return call_script(self._area_script, client, args)
+
+    def _pin_geohashes(self, pin_ids, client=None):
+        """Return a list with the geohashes of the given pins, None for
+        unknown pins.
+        """
+        args = [self._key_prefix] + list(pin_ids)
+        if client is None:
+            return self._read(lambda client: call_script(
+                self._pin_geohashes_script, client, args))
+        return call_script(self._pin_geohashes_script, client, args)
+
+    def rebuild_cell_index(self, buffer=1000):
+        """Index the geohashes with pins, needed once for namespaces
+        written by older versions before querying areas with geohashes
+        less precise than the globe.
+
+        This operation is not atomic.
+        """
+        key = self._key_prefix + 'cells'
+        cells = set()
+        offset = len(self._key_prefix + 'gh:')
+        for gh_key in self._redis.scan_iter(
+                match=self._key_prefix + 'gh:*', count=buffer):
+            cells.add(gh_key[offset:])
+            if len(cells) >= buffer:
+                self._redis.zadd(key, dict.fromkeys(cells, 0))
+                cells.clear()
+        if cells:
+            self._redis.zadd(key, dict.fromkeys(cells, 0))
+
+    def density(self, precision, area=None):
+        """Return a dict mapping geohashes of length `precision` to the
+        amount of pins inside them, geohashes without pins are left out.
+
+        The counts come from counters maintained on every write, so the
+        cost depends on the amount of returned geohashes, not of pins.
+        The counters inside area geohashes less precise than `precision`
+        are looked up in an index of the geohashes with counters, needing
+        a second round trip.
+
+        :param int precision: One of the `density_precisions` of the globe.
+        :param area: Only count the geohashes overlapping this
+            :py:class:`Area`.
+        """
+        if precision not in self._density_precisions:
+            raise ValueError(
+                'no density kept for precision {}'.format(precision))
+        key = self._key_prefix + 'density:{}'.format(precision)
+
+        if area is None:
+            counts = self._read(lambda client: client.hgetall(key)).items()
+        else:
+            cells = set()
+            coarse = []
+            for gh in area.geohashes:
+                if len(gh) >= precision:
+                    cells.add(gh[:precision])
+                else:
+                    coarse.append(gh)
+
+            def read(client):
+                if coarse:
+                    # '~' sorts after all geohash characters
+                    pipe = client.pipeline(transaction=False)
+                    for gh in coarse:
+                        pipe.zrangebylex(key + ':cells', '[' + gh,
+                                         '[' + gh + '~')
+                    for found in pipe.execute():
+                        cells.update(found)
+                if not cells:
+                    return []
+                return zip(cells, client.hmget(key, *cells))
+            counts = self._read(read)
+
+        return dict((cell, int(count)) for cell, count in counts
+                    if count is not None and int(count) > 0)
+
+    def rebuild_density(self, buffer=1000):
+        """Recount the pins for all `density_precisions` of this globe.
+
+        Needed once after adding a precision to a namespace with pins, and
+        for namespaces whose counters were written without the index of
+        their geohashes.
+        This operation is not atomic, do not write to the globe meanwhile.
+        """
+        counts = dict((precision, {})
+                      for precision in self._density_precisions)
+        for pin_id, gh in self.geohash_scan(buffer):
+            for precision, cells in counts.iteritems():
+                cell = gh[:precision]
+                cells[cell] = cells.get(cell, 0) + 1
+
+        pipe = self._redis.pipeline()
+        for precision, cells in counts.iteritems():
+            key = self._key_prefix + 'density:{}'.format(precision)
+            pipe.delete(key, key + ':cells')
+            items = cells.items()
+            for i in range(0, len(items), buffer):
+                pipe.hmset(key, dict(items[i:i + buffer]))
+                pipe.zadd(key + ':cells',
+                          dict((cell, 0) for cell, _ in items[i:i + buffer]))
+        pipe.execute()
+
+    def memory_stats(self, samples=5, max_keys=1000, buffer=100):
+        """Return a dict with the bytes of memory used by the namespace,
+        measured with the `MEMORY USAGE` command of Redis 4 or later.
+
+        The keys `pins`, `data`, `fields`, `cells` (the sets of the
+        geohashes), `index` (the ordered set of the geohashes, the split
+        counters and the update times of `track_updates`), `density`,
+        `fences` and `sessions` (the markers of :py:meth:`session` writes)
+        hold the bytes of these structures, `total` their sum.
+        `pin_count` and `cell_count` are the amounts of pins and
+        geohashes with pins, `cell_sizes` is a
+        histogram of the measured sets mapping powers of two to the amount
+        of sets with at most that many but more than half as many pins.
+
+        :param int samples: Amount of fields or members `MEMORY USAGE`
+            samples of a hash or set, 0 for all of them.
+        :param int max_keys: Measure at most this many evenly spread sets
+            of geohashes and extrapolate to all of them. The same goes for
+            the small hashes of the compact layout and the session markers.
+        :param int buffer: Amount of keys measured per round trip.
+        """
+        prefix = self._key_prefix
+
+        def usage(keys):
+            return sum(self._memory_usage(keys, samples, buffer))
+
+        def sampled_usage(keys, count):
+            # the bytes of `count` keys estimated from the given ones
+            if not keys:
+                return 0
+            return usage(keys) * count // len(keys)
+
+        stats = {
+            'data': usage([prefix + 'data']),
+            'fields': usage(prefix + 'field:' + field
+                            for field in self._projected_fields),
+            'index': usage([prefix + 'cells', prefix + 'split',
+                            prefix + 'updated']),
+            'density': usage(prefix + 'density:{}{}'.format(precision, suffix)
+                             for precision in self._density_precisions
+                             for suffix in ('', ':cells')),
+        }
+
+        if self._compact:
+            keys = self._pin_bucket_keys()
+            stats['pins'] = usage([prefix + 'pin-buckets']) + sampled_usage(
+                [keys[i] for i in _spread(len(keys), max_keys)], len(keys))
+        else:
+            stats['pins'] = usage([prefix + 'pins'])
+
+        fences = list(self.fences())
+        fence_keys = [prefix + 'fences', prefix + 'fence-precisions',
+                      prefix + 'fence-events']
+        if fences:
+            pipe = self._redis.pipeline(transaction=False)
+            for name in fences:
+                fence_keys.append(prefix + 'fence:' + name)
+                pipe.smembers(prefix + 'fence:' + name)
+            fence_keys.extend(prefix + 'fencecell:' + gh
+                              for gh in set().union(*pipe.execute()))
+        stats['fences'] = usage(fence_keys)
+
+        # markers of the sessions that wrote in the last
+        # SESSION_MARKER_TTL seconds
+        markers = list(self._redis.scan_iter(prefix + 'session:*',
+                                             count=buffer))
+        stats['sessions'] = sampled_usage(
+            [markers[i] for i in _spread(len(markers), max_keys)],
+            len(markers))
+
+        # measure evenly spread sets, the first ones in lexicographic
+        # order would all be in the same place
+        cell_count = self._redis.zcard(prefix + 'cells')
+        positions = _spread(cell_count, max_keys)
+        cells = []
+        for i in range(0, len(positions), buffer):
+            pipe = self._redis.pipeline(transaction=False)
+            for position in positions[i:i + buffer]:
+                pipe.zrange(prefix + 'cells', position, position)
+            cells.extend(cell for found in pipe.execute() for cell in found)
+        cell_keys = [prefix + 'gh:' + cell for cell in cells]
+        stats['cells'] = sampled_usage(cell_keys, cell_count)
+
+        cell_sizes = {}
+        for i in range(0, len(cell_keys), buffer):
+            pipe = self._redis.pipeline(transaction=False)
+            for key in cell_keys[i:i + buffer]:
+                pipe.scard(key)
+            for size in pipe.execute():
+                bucket = 1
+                while bucket < size:
+                    bucket *= 2
+                cell_sizes[bucket] = cell_sizes.get(bucket, 0) + 1
+
+        stats['total'] = sum(stats.values())
+        stats['pin_count'] = len(self)
+        stats['cell_count'] = cell_count
+        stats['cell_sizes'] = cell_sizes
+        return stats
+
+    def _memory_usage(self, keys, samples, buffer):
+        """Return a list with the bytes used by every key, 0 for missing
+        keys.
+        """
+        keys = list(keys)
+        sizes = []
+        for i in range(0, len(keys), buffer):
+            pipe = self._redis.pipeline(transaction=False)
+            for key in keys[i:i + buffer]:
+                pipe.execute_command('MEMORY USAGE', key, 'SAMPLES', samples)
+            sizes.extend(size or 0 for size in pipe.execute())
+        return sizes
+
+    def reindex(self, precision):
+        """Start or resume moving the namespace to another geohash
+        precision, return a :py:class:`Reindex` to drive it.
+
+        Only one reindex can run at a time, and not while geohashes are
+        split, see `split_threshold`. No geohashes are split meanwhile.
+        """
+        if not 0 < precision <= MAX_PRECISION:
+            raise ValueError('precision {} out of range'.format(precision))
+        if self._density_precisions and precision < max(
+                self._density_precisions):
+            raise ValueError('precision is lower than a density precision')
+        fence_precisions = self._redis.hkeys(
+            self._key_prefix + 'fence-precisions')
+        if fence_precisions and precision < max(map(int, fence_precisions)):
+            raise ValueError('precision is lower than the one of a fence')
+
+        if self._redis.exists(self._key_prefix + 'split'):
+            raise ValueError('can not reindex with split geohashes')
+        if self._compact:
+            raise ValueError('can not reindex the compact layout')
+
+        key = self._key_prefix + 'reindex'
+        if self._redis.hsetnx(key, 'precision', precision):
+            current = self._redis.get(self._key_prefix + 'precision')
+            if int(current or self._geohash_precision) == precision:
+                self._redis.delete(key)
+                raise ValueError('the namespace has this precision already')
+            self._redis.hmset(key, {'status': 'copying', 'cursor': 0,
+                                    'copied': 0})
+        elif int(self._redis.hget(key, 'precision')) != precision:
+            raise ValueError('another reindex is running')
+        return Reindex(self)
+
+    def set_fence(self, name, geohashes):
+        """Define or redefine the geofence `name` covering `geohashes`.
+
+        Every pin entering or leaving the fence from now on publishes an
+        event, see :py:meth:`fence_events`. Pins already inside the fence
+        do not.
+
+        :param geohashes: An :py:class:`Area` or an iterable of geohashes
+            not longer than the `geohash_precision`. Shorter geohashes
+            cover all their children.
+        """
+        if isinstance(geohashes, Area):
+            geohashes = geohashes.geohashes
+        geohashes = tuple(set(geohashes))
+        if not geohashes:
+            raise ValueError('a fence needs at least one geohash')
+        for gh in geohashes:
+            if len(gh) > self._geohash_precision:
+                raise ValueError(
+                    'geohash {} is more precise than the globe'.format(gh))
+        self._write(lambda client: call_script(
+            self._set_fence_script, client,
+            [self._key_prefix, name] + list(geohashes)))
+
+    def delete_fence(self, name):
+        """Delete the geofence `name`."""
+        if not self._redis.sismember(self._key_prefix + 'fences', name):
+            raise ValueError('fence {} not found'.format(name))
+        self._write(lambda client: call_script(
+            self._set_fence_script, client, [self._key_prefix, name]))
+
+    def fences(self):
+        """Return a set with the names of all geofences."""
+        return self._read(
+            lambda client: client.smembers(self._key_prefix + 'fences'))
+
+    def fence_geohashes(self, name):
+        """Return the set of geohashes covered by the geofence `name`."""
+        return self._read(lambda client: client.smembers(
+            self._key_prefix + 'fence:' + name))
+
+    def fence_events(self, last_id='0-0', count=100, block=None,
+                     group=None, consumer=None):
+        """Read a batch of geofence events published by moved pins.
+
+        Returns a list of `(event_id, event)` tuples, `event` being a dict
+        with the keys `fence`, `pin` and `event`, the later being `enter`
+        or `exit`. Pass the last `event_id` as `last_id` to read the next
+        batch. Only about `max_fence_events` events are kept.
+
+        :param int count: Maximal amount of events to return.
+        :param int block: Wait that many milliseconds for new events if there
+            are none.
+        :param str group: Read as `consumer` of this consumer group instead,
+            so that every event is delivered to only one of its consumers.
+            `last_id` is ignored, acknowledge processed events with
+            :py:meth:`ack_fence_events`.
+        """
+        from redis.exceptions import ResponseError
+
+        stream = self._key_prefix + 'fence-events'
+        if group is None:
+            result = self._redis.xread({stream: last_id},
+                                       count=count, block=block)
+        else:
+            if consumer is None:
+                raise TypeError('reading as a group requires a consumer')
+            try:
+                self._redis.xgroup_create(stream, group, id='0',
+                                          mkstream=True)
+            except ResponseError as exc:
+                if 'BUSYGROUP' not in str(exc):
+                    raise
+            result = self._redis.xreadgroup(group, consumer, {stream: '>'},
+                                            count=count, block=block)
+        if not result:
+            return []
+        return [(event_id, event) for event_id, event in result[0][1]]
+
+    def ack_fence_events(self, group, *event_ids):
+        """Acknowledge events read by a consumer group."""
+        if event_ids:
+            self._redis.xack(self._key_prefix + 'fence-events',
+                             group, *event_ids)
+
+    def loc2geohash(self, loc, precision=None):
+        """
+        Used internally to convert the "\\*\\*loc" into a geohash of
+        length `precision`, by default the `geohash_precision`.
 
         :param latlon: E.g. (38.70, -90.29)
         :param location: String to be be geocoded.  Example "Sophienstr. 9, 10178 Berlin".
         :param geohash: A geohash. Example: "u33dbczk"
         :param who: Use the location of another pin.
         """
+        if precision is None:
+            precision = self._geohash_precision
+
         if 'latlon' in loc:
-            return geohash.encode(loc['latlon'],
-                                  precision=self._geohash_precision)
+            return geohash.encode(*loc['latlon'], precision=precision)
 
         elif 'location' in loc:
 
@@ -378,16 +2262,19 @@ class Globe(object):
             if cache_geocoding:
                 cache_key = hash_iter(('geocoding',
                                        'google',
-                                       str(self._geohash_precision),
+                                       str(precision),
                                        loc['location']))
                 gh = self._redis.get(cache_key)
                 if gh:
                     return gh
 
             # geocode the location to a geohash
-            lat, lon = self._nominatim.geocode(loc['location'])
-            gh = geohash.encode(lat, lon,
-                                precision=self._geohash_precision)
+            if self._nominatim_geocode is None:
+                self._nominatim_geocode = NominatimGeocode(
+                    mail=self._nominatim_mail,
+                    endpoint=self._nominatim_endpoint)
+            lat, lon = self._nominatim_geocode.geocode(loc['location'])
+            gh = geohash.encode(lat, lon, precision=precision)
 
             # if cache the geolocated location
             if cache_geocoding:
@@ -397,10 +2284,13 @@ class Globe(object):
 
         elif 'geohash' in loc:
             return geohash.encode(*geohash.decode(loc['geohash']),
-                                  precision=self._geohash_precision)
+                                  precision=precision)
 
         elif 'who' in loc:
-            return self.geohash(loc['who'])
+            gh = self.geohash(loc['who'])
+            if len(gh) == precision:
+                return gh
+            return geohash.encode(*geohash.decode(gh), precision=precision)
 
         else:
             raise TypeError('wrong location specificaton')
@@ -412,6 +2302,10 @@ class Globe(object):
             if maptype not in ('roadmap', 'satellite', 'hybrid', 'terrain'):
                 raise TypeError('maptype not supported')
 
+            # only needed for debugging, keep them out of the import time
+            import webbrowser
+            import gpolyencode
+
             polyenc = gpolyencode.GPolyEncoder()
             url = 'http://maps.googleapis.com/maps/api/staticmap?'
             url += 'size={}x{}&maptype={}&sensor=false&scale=2'.format(
@@ -449,65 +2343,585 @@ class Globe(object):
 
             webbrowser.open_new_tab(url)
 
+    def render(self, path, items, size=(800, 600), pins=True,
+               cluster_size=4, format=None):
+        """Draw areas and pins to an SVG or PNG file, unlike
+        :py:meth:`debug` without network access and for areas of any size.
+        Return the names of the colors of the items.
+
+        See :py:func:`geonear.render.render` for the other arguments.
+
+        :param items: :py:class:`Area` objects and pin ids.
+        :param bool pins: Draw the pins of the areas as well.
+
+        >>> globe.render('berlin.svg', [globe.in_bbox(52.3, 13.1, 52.7, 13.8)])
+        ['blue']
+        """
+        # only needed for debugging, keep it out of the import time
+        import render
+
+        layers = []
+        color_names = []
+        for (color_name, color_hex), item in zip(colornames, items):
+            color_names.append(color_name)
+            if isinstance(item, Area):
+                latlons = []
+                if pins:
+                    latlons = [geohash.decode(gh)
+                               for _, gh in item._located_pins()]
+                layers.append(('{} geohashes'.format(len(item.geohashes)),
+                               color_hex, render.outlines(item.geohashes),
+                               latlons))
+            elif isinstance(item, basestring):
+                gh = self.geohash(item)
+                layers.append((item, color_hex, [],
+                               [geohash.decode(gh)] if gh else []))
+            else:
+                raise TypeError()
+        render.render(path, layers, size=size, cluster_size=cluster_size,
+                      format=format)
+        return color_names
+
     def __repr__(self):
         return '<Globe with {} pins at {}>'.format(len(self), hex(id(self)))
 
 
+class Reindex(object):
+    """Move a namespace to another geohash precision while it is in use.
+
+    The pins are copied in bounded batches to a second index at the new
+    precision, meanwhile every write goes to both indexes. The cutover
+    switches to the new index atomically, the old one is deleted in
+    bounded batches afterwards. The state is kept in Redis, so an
+    interrupted reindex continues where it stopped when
+    :py:meth:`Globe.reindex` is called again.
+
+    Raising the precision places pins saved with a shorter geohash than the
+    new precision at the center of that geohash.
+
+    Globes created with the old `geohash_precision` keep working, but
+    should be created with the new one after the cutover.
+
+    >>> reindex = globe.reindex(9)
+    >>> reindex.run(batch=1000, pause=0.01)
+    >>> reindex.progress()['status']
+    'done'
+    """
+
+    def __init__(self, globe):
+        self._globe = globe
+        self._redis = globe._redis
+        self._key_prefix = globe._key_prefix
+        self._key = globe._key_prefix + 'reindex'
+        self._started = time.time()
+        self._done = 0  # pins copied or deleted by this object
+
+    @property
+    def status(self):
+        """`copying`, `copied`, `cleanup`, `aborting` or `done`."""
+        return self._redis.hget(self._key, 'status') or 'done'
+
+    def progress(self):
+        """Return a dict with the `status`, the target `precision`, the
+        amount of `copied` pins, the `total` amount of pins and the
+        `pins_per_second` handled by this object.
+        """
+        status, precision, copied = self._redis.hmget(
+            self._key, 'status', 'precision', 'copied')
+        elapsed = time.time() - self._started
+        return {
+            'status': status or 'done',
+            'precision': int(precision) if precision else None,
+            'copied': int(copied or 0),
+            'total': len(self._globe),
+            'pins_per_second': self._done / elapsed if elapsed else 0.0,
+        }
+
+    def step(self, batch=500):
+        """Do one bounded batch of the current phase of the reindex,
+        return False when there is nothing left to do.
+
+        The cutover happens in the step after all pins are copied.
+        """
+        status = self.status
+        if status == 'copying':
+            self._copy(batch)
+        elif status == 'copied':
+            self.cutover()
+        elif status in ('cleanup', 'aborting'):
+            if status == 'cleanup':
+                suffix = ':old'
+            else:
+                suffix = ':next'
+            if not self._drop_index(suffix, batch):
+                self._redis.delete(self._key)
+        else:
+            return False
+        return True
+
+    def run(self, batch=500, pause=0.0, report=None):
+        """Run the reindex to the end.
+
+        :param int batch: Amount of pins handled per step.
+        :param float pause: Seconds to sleep between steps, to leave Redis
+            more room for other clients.
+        :param report: Called with :py:meth:`progress` after every step.
+        """
+        while self.step(batch):
+            if report:
+                report(self.progress())
+            if pause:
+                time.sleep(pause)
+
+    def _copy(self, batch):
+        precision = int(self._redis.hget(self._key, 'precision'))
+        cursor = self._redis.hget(self._key, 'cursor')
+        cursor, pins = self._redis.hscan(self._key_prefix + 'pins',
+                                         cursor=cursor, count=batch)
+        args = [self._key_prefix, cursor]
+        for pin_id, gh in pins.items():
+            if len(gh) < precision:
+                new_gh = geohash.encode(*geohash.decode(gh),
+                                        precision=precision)
+            elif self._globe._full_geohashes:
+                new_gh = gh
+            else:
+                new_gh = gh[:precision]
+            args.extend((pin_id, gh, new_gh))
+        call_script(self._globe._reindex_batch_script, self._globe._redis,
+                    args)
+        self._done += len(pins)
+
+    def cutover(self):
+        """Switch reads and writes to the new index, all pins must have
+        been copied.
+        """
+        call_script(self._globe._reindex_cutover_script, self._globe._redis,
+                    [self._key_prefix])
+        self._globe._geohash_precision = int(
+            self._redis.get(self._key_prefix + 'precision'))
+
+    def abort(self):
+        """Stop the reindex and delete the new index with the following
+        steps. Not possible after the cutover.
+        """
+        if self.status not in ('copying', 'copied'):
+            raise ValueError('the reindex can not be aborted anymore')
+        self._redis.hset(self._key, 'status', 'aborting')
+
+    def _drop_index(self, suffix, batch):
+        # delete one batch of the pins map and index with this suffix,
+        # return False if nothing was left
+        cells_key = self._key_prefix + 'cells' + suffix
+        pins_key = self._key_prefix + 'pins' + suffix
+
+        cells = self._redis.zrange(cells_key, 0, batch - 1)
+        if cells:
+            pipe = self._redis.pipeline()
+            pipe.delete(*(self._key_prefix + 'gh:' + cell for cell in cells))
+            pipe.zrem(cells_key, *cells)
+            pipe.execute()
+            return True
+
+        cursor = 0
+        while True:
+            cursor, pins = self._redis.hscan(pins_key, cursor=cursor,
+                                             count=batch)
+            if pins:
+                self._redis.hdel(pins_key, *pins.keys())
+                self._done += len(pins)
+                return True
+            if not int(cursor):
+                return False
+
+    def __repr__(self):
+        return '<Reindex {status} to precision {precision}, {copied} of ' \
+            '{total} pins copied>'.format(**self.progress())
+
+
 class Area(object):
-    """Documentation here"""
-    def __init__(self, redis, geohashes, key_prefix):
-        self._geohashes = set(geohashes)
-        self._redis = redis
-        self._key_prefix = key_prefix
+    """A set of geohashes and the pins inside them.
+
+    The geohashes are kept as sorted integers in an array, the set
+    operations `&`, `|` and `==` merge these arrays. `&` and `|` match
+    geohashes with the more precise ones inside them, so that areas of
+    different precision can be combined. `&` keeps the regions areas of
+    :py:meth:`Globe.in_bbox` and :py:meth:`Globe.in_polygon` are clipped
+    to, `|` raises a ValueError for these areas. Areas pickle to these
+    integers without the globe, attach an unpickled area to a globe with
+    :py:meth:`attach` before reading its pins. Set `delta` to pickle the
+    integers delta encoded, which is smaller but slower.
+
+    `since` and `until` limit the area to the pins added or moved in a time
+    window, see :py:meth:`Globe.near`. The `origin` is the `(latitude,
+    longitude)` point areas of :py:meth:`Globe.near` are around, see
+    :py:meth:`by_distance`.
+
+    Make areas with :py:meth:`Globe.make_area` and the other methods of
+    the globe, the former `Area(redis, geohashes, key_prefix)` still works
+    but is deprecated.
+
+    >>> import pickle
+    >>> area = pickle.loads(pickle.dumps(globe.near(latlon=(52.52, 13.40))))
+    >>> list(area.attach(globe))
+    ['user1']
+    """
+
+    delta = False
+
+    def __init__(self, globe, geohashes, key_prefix=None, clip=None,
+                 edges=(), since=None, until=None, origin=None):
+        if isinstance(geohashes, array):
+            self._cells = geohashes  # sorted already
+        else:
+            self._cells = _sorted_cells(geohashes)
+        self._geohashes = None  # the set of strings, made when needed
+        if key_prefix is not None or not isinstance(globe, Globe):
+            globe = self._legacy_globe(globe, key_prefix)
+        self._globe = globe
+        # pins in the `edges` geohashes are only part of this area if they
+        # lie inside the `clip` region
+        self._clip = clip
+        self._edges = set(edges) & self.geohashes if clip else set()
+        self._since = since
+        self._until = until
+        self._origin = origin
+
+    def _legacy_globe(self, redis, key_prefix):
+        # areas used to be made with `Area(redis, geohashes, key_prefix)`
+        warnings.warn('Area(redis, geohashes, key_prefix) is deprecated, '
+                      'use Globe.make_area', DeprecationWarning, stacklevel=3)
+        precision = max(len(gh) for gh in self.geohashes) \
+            if self._cells else MAX_PRECISION
+        globe = Globe(redis, precision)
+        if key_prefix is not None:
+            globe._key_prefix = key_prefix
+        return globe
+
+    def __getstate__(self):
+        return {
+            'cells': _encode_cells(self._cells, self.delta),
+            'edges': _encode_cells(_sorted_cells(self._edges), self.delta),
+            'clip': self._clip,
+            'delta': self.delta,
+            'since': self._since,
+            'until': self._until,
+            'origin': self._origin,
+        }
+
+    def __setstate__(self, state):
+        self._cells = _decode_cells(state['cells'])
+        self._geohashes = None
+        self._globe = None
+        self._clip = state['clip']
+        self._edges = set(map(_cell_geohash, _decode_cells(state['edges'])))
+        if state['delta']:
+            self.delta = True
+        self._since = state.get('since')
+        self._until = state.get('until')
+        self._origin = state.get('origin')
+
+    def attach(self, globe):
+        """Read the pins of this area from `globe` and return the area."""
+        self._globe = globe
+        return self
+
+    @property
+    def globe(self):
+        """The :py:class:`Globe` the pins are read from."""
+        if self._globe is None:
+            raise ValueError('the area is not attached to a globe')
+        return self._globe
+
+    def _window(self):
+        return {'since': self._since, 'until': self._until}
+
+    @property
+    def origin(self):
+        """The `(latitude, longitude)` point this area is around or None."""
+        return self._origin
 
     def __iter__(self):
-        pin_ids = self._redis.sunion(
-            *(self._key_prefix + "gh:" + gh for gh in self.geohashes))
         # sorted makes the results more consistent
-        return iter(sorted(pin_ids))
+        return iter(sorted(self._pins()))
+
+    def _pins(self):
+        if self._edges:
+            return self._clipped_pins()
+        return self.globe._area_pins(self.geohashes, **self._window())
+
+    def by_distance(self, exact=False, origin=None):
+        """Yield the pin ids ring by ring around the origin, the pins of
+        the geohash of the origin first, then the ones of the geohashes
+        around it and so forth, see :py:func:`geohash_rings`.
+
+        Every ring is read with its own round trip when the pins of the
+        rings before are consumed, so the nearest pins are there before the
+        outer geohashes are read and stopping early saves reading them.
+
+        :param bool exact: Sort the pins of a ring by their distance to the
+            origin, which reads their geohashes as well. Pins of an outer
+            ring may still be nearer than some of the ring before.
+        :param origin: A `(latitude, longitude)` point, by default the one
+            of :py:meth:`Globe.near`.
+
+        >>> from itertools import islice
+        >>> area = globe.near(latlon=(52.52, 13.40), size=5)
+        >>> nearest = list(islice(area.by_distance(exact=True), 10))
+        """
+        if origin is None:
+            origin = self._origin
+        if origin is None:
+            raise ValueError('the area has no origin, pass one')
+        globe = self.globe
+        for _, geohashes in geohash_rings(origin, self.geohashes,
+                                          globe._geohash_precision):
+            ring = Area(globe, geohashes, clip=self._clip, edges=self._edges,
+                        **self._window())
+            if not exact:
+                for pin_id in ring._pins():
+                    yield pin_id
+                continue
+            pins = sorted(
+                (distance(origin, geohash.decode(gh)), pin_id)
+                for pin_id, gh in ring._located_pins())
+            for _, pin_id in pins:
+                yield pin_id
+
+    def _clipped_pins(self):
+        def read(client):
+            pipe = client.pipeline()
+            self._queue_pins(pipe)
+            return execute_pipeline(pipe)
+        return self._parse_pins(self.globe._read(read))
+
+    def _queue_pins(self, pipe, with_data=False):
+        # queue the script calls reading the pins, one for the geohashes
+        # and one more for the edges to clip, see _parse_pins
+        self.globe._area_pins(self.geohashes - self._edges, client=pipe,
+                              with_data=with_data, **self._window())
+        if self._edges:
+            self.globe._area_pins(self._edges, with_geohashes=True,
+                                  with_data=with_data, client=pipe,
+                                  **self._window())
+
+    def _parse_pins(self, replies, with_data=False):
+        # return the pin ids, or `(pin_id, serialized data)` tuples with
+        # `with_data`, from the replies of the calls of _queue_pins
+        if with_data:
+            pins = zip(replies[0][0::3], replies[0][2::3])
+        else:
+            pins = list(replies[0])
+        if not self._edges:
+            return pins
+
+        step = 3 if with_data else 2
+        edge_pins = replies[1]
+        edge_ids = edge_pins[0::step]
+        latlons = [geohash.decode(gh) for gh in edge_pins[1::step]]
+        inside = self._clip.contains_points(
+            [lat for lat, lon in latlons], [lon for lat, lon in latlons])
+        if with_data:
+            edge_ids = zip(edge_ids, edge_pins[2::step])
+        return pins + [pin for pin, keep in zip(edge_ids, inside) if keep]
+
+    def _located_pins(self):
+        # the pins with their geohashes, as __iter__ reads them
+        flat = self.globe._area_pins(self.geohashes, with_geohashes=True,
+                                     **self._window())
+        pins = zip(flat[0::2], flat[1::2])
+        if not self._edges:
+            return pins
+        lengths = set(map(len, self._edges))
+        edge_pins = [(pin_id, gh) for pin_id, gh in pins
+                     if any(gh[:length] in self._edges for length in lengths)]
+        latlons = [geohash.decode(gh) for _, gh in edge_pins]
+        inside = self._clip.contains_points(
+            [lat for lat, lon in latlons], [lon for lat, lon in latlons])
+        outside = set(pin for pin, keep in zip(edge_pins, inside)
+                      if not keep)
+        return [pin for pin in pins if pin not in outside]
 
     def __len__(self):
-        pipe = self._redis.pipeline()
-        for gh in self.geohashes:
-            pipe.scard(self._key_prefix + 'gh:' + gh)
-        return sum(pipe.execute())
+        if self._edges:
+            return len(self._clipped_pins())
+        return self.globe._area_pins(self.geohashes, count=True,
+                                     **self._window())
+
+    def explain(self):
+        """Return a dict describing what iterating this area costs,
+        gathered with one round trip:
+
+        - `cells`: the sets of geohashes read, mapped to their amount of
+          pins. Geohashes less precise than the globe stand for the sets
+          with pins inside them.
+        - `non_empty`: how many of these sets hold pins.
+        - `pins`: the amount of pins read, before the ones outside the
+          region of :py:meth:`Globe.in_bbox` or :py:meth:`Globe.in_polygon`
+          are filtered out.
+        - `commands`: the Redis commands sent, including the ones run by
+          the scripts, mapped to how often they are called.
+        - `round_trips`: one, also for areas with edges to clip, whose two
+          script calls are sent together in a transaction. One more only
+          if Redis forgot the scripts and they are loaded again.
+        - `bytes`: the estimated size of the replies.
+        - `cost`: the amount of commands plus the pins read, a rough
+          measure of the work of Redis to compare queries or enforce
+          budgets.
+
+        >>> plan = globe.near(latlon=(52.52, 13.40), size=3).explain()
+        >>> if plan['cost'] > 10000:
+        ...     raise ValueError('query too expensive')
+        """
+        # the same script calls as __iter__, in explain mode
+        queries = [(self.geohashes - self._edges, False)]
+        if self._edges:
+            queries.append((self._edges, True))
+
+        def read(client):
+            pipe = client.pipeline(transaction=False)
+            for geohashes, _ in queries:
+                self.globe._area_pins(geohashes, explain=True, client=pipe,
+                                      **self._window())
+            return execute_pipeline(pipe)
+
+        def bulk_size(length):
+            # a bulk string in a reply: $<length>\r\n<string>\r\n
+            return length + len(str(length)) + 5
+
+        commands = Counter()
+        if self._edges:
+            commands.update(('MULTI', 'EXEC'))
+        cells = {}
+        reply_bytes = 0
+        plans = self.globe._read(read)
+        for (_, with_geohashes), plan in zip(queries, plans):
+            lookups, split_checks, compact, window_count = plan[:4]
+            commands['EVALSHA'] += 1
+            commands['GET'] += 1  # the precision of the namespace
+            commands['EXISTS'] += 1  # whether the layout is compact
+            commands['ZRANGEBYLEX'] += lookups
+            commands['HEXISTS'] += split_checks
+            # the geohashes of pins to filter by their location
+            lookups_per_pin = int(with_geohashes)
+            if compact:
+                gh_length = COMPACT_PRECISION
+            elif self.globe._full_geohashes:
+                gh_length = MAX_PRECISION
+            else:
+                gh_length = self.globe._geohash_precision
+            sizes = []
+            for i in range(4, len(plan), 3):
+                cell, size, id_length = plan[i:i + 3]
+                cells[cell] = size
+                sizes.append(size)
+                commands['SMEMBERS'] += 1
+                commands['HGET'] += size * lookups_per_pin
+                reply_bytes += size * bulk_size(id_length)
+                if with_geohashes:
+                    reply_bytes += size * bulk_size(gh_length)
+            if window_count >= 0:
+                # the script counts the pins of the window and the area,
+                # then reads the window or looks up every pin
+                commands['ZCOUNT'] += 1
+                commands['SCARD'] += len(sizes)
+                if window_count < sum(sizes):
+                    commands['ZRANGEBYSCORE'] += 1
+                else:
+                    commands['ZSCORE'] += sum(sizes)
+        pins = sum(cells.values())
+        commands = dict((name, count) for name, count in commands.items()
+                        if count)
+        return {
+            'cells': cells,
+            'non_empty': sum(1 for size in cells.values() if size),
+            'pins': pins,
+            'commands': commands,
+            'round_trips': 1,
+            'bytes': reply_bytes,
+            'cost': sum(commands.values()) + pins,
+        }
 
     def __include__(self, pin_id):
-        pipe = self._redis.pipeline()
-        for gh in self.geohashes:
-            pipe.sismember(self._key_prefix + 'gh:' + gh, pin_id)
-        return any(pipe.execute())
+        gh, = self.globe._pin_geohashes([pin_id])
+        if gh is None:
+            return False
+        return any(gh[:i] in self.geohashes for i in range(1, len(gh) + 1))
 
     def __and__(self, other):
         if not isinstance(other, Area):
             raise TypeError('other must also be a Area')
-        return Area(self._redis,
-                    self.geohashes.intersection(other.geohashes),
-                    key_prefix=self._key_prefix)
+        # the intersection of the time windows, the later since and the
+        # earlier until
+        sinces = [since for since in (self._since, other._since)
+                  if since is not None]
+        untils = [until for until in (self._until, other._until)
+                  if until is not None]
+        cells = array(UINT64, _intersect_cells(self._cells, other._cells))
+
+        # the cells inside an edge of either area still need its clip
+        clips = [area._clip for area in (self, other) if area._edges]
+        edges = self._edges | other._edges
+        lengths = set(map(len, edges))
+        cell_edges = [gh for gh in map(_cell_geohash, cells)
+                      if any(gh[:length] in edges for length in lengths)]
+        if len(clips) == 2:
+            clip = cover.IntersectionRegion(*clips)
+        else:
+            clip = clips[0] if clips else None
+
+        return Area(self._globe, cells, clip=clip, edges=cell_edges,
+                    since=max(sinces) if sinces else None,
+                    until=min(untils) if untils else None,
+                    origin=self._joined_origin(other))
 
     def __or__(self, other):
         if not isinstance(other, Area):
             raise TypeError('other must also be a Area')
-        return Area(self._redis,
-                    self.geohashes.union(other.geohashes),
-                    key_prefix=self._key_prefix)
+        if self._window() != other._window():
+            raise ValueError('can not join areas of different time windows')
+        if self._edges or other._edges:
+            raise ValueError('can not join areas clipped to a region')
+        return Area(self._globe, array(
+            UINT64, _union_cells(self._cells, other._cells)),
+            origin=self._joined_origin(other), **self._window())
+
+    def _joined_origin(self, other):
+        # keep the origin if only one of the areas has one or both agree
+        if self._origin is None or self._origin == other._origin:
+            return other._origin
+        if other._origin is None:
+            return self._origin
+        return None
 
     def __eq__(self, other):
         if not isinstance(other, Area):
             return False
-        return self.geohashes == other.geohashes
+        return self._cells == other._cells and \
+            self._window() == other._window() and \
+            self._edges == other._edges and \
+            (not self._edges or self._clip == other._clip)
+
+    def __ne__(self, other):
+        return not self == other
 
     def __repr__(self):
+        if self._globe is None:
+            return '<Area of {} geohashes, not attached>'.format(
+                len(self._cells))
+        # the amount of pins of the same read, not a second one
         pins = tuple(self)
         if pins:
             more = ' (e.g. {})'.format(repr(choice(pins)))
         else:
             more = ''
         return '<Area containing {} pins{}, size {} >'.format(
-            len(self), more, len(self.geohashes))
+            len(pins), more, len(self.geohashes))
 
     @property
     def geohashes(self):
+        if self._geohashes is None:
+            self._geohashes = set(map(_cell_geohash, self._cells))
         return self._geohashes
 
     @property
@@ -669,3 +3083,282 @@ class Area(object):
             polygons.append(polygon_points)
 
         return polygons
+
+
+class WriteBuffer(object):
+    """Coalesce high frequency :py:meth:`Globe.pin` calls on the client side.
+
+    Pins are kept in memory with last-write-wins per pin id and written in
+    batched script calls once `max_pins` pins are pending or `max_delay`
+    seconds passed since the last flush. Writes of a pin to the position
+    it was last written to are dropped without talking to Redis.
+
+    The time trigger is only checked when :py:meth:`pin` is called, call
+    :py:meth:`flush` yourself when updates may stop arriving.
+
+    The last written positions are cached assuming this buffer is the only
+    writer of its pins. If another globe or buffer moves a pin, a later
+    write of it back to the cached position is dropped and the pin stays
+    where the other writer put it. Use a `cache_size` of 0 when pins are
+    written from several places.
+
+    :param globe: The :py:class:`Globe` to write to.
+    :param int max_pins: Flush when this many pins are pending.
+    :param float max_delay: Flush when the oldest pending write is older
+        than this many seconds.
+    :param int batch_size: Maximal amount of pins written per script call.
+    :param int cache_size: Maximal amount of last known geohashes to keep
+        for dropping no-op moves, the least recently used ones are evicted
+        first.
+    :param bool drop_cell_moves: Also drop moves that stay in the geohash
+        of the `geohash_precision` of the globe the pin was last written
+        to. This is lossy: areas still find the pin, but :py:meth:`latlon`,
+        the exact filter of :py:meth:`Globe.in_bbox` and
+        :py:meth:`Area.by_distance` see its old position.
+    :param on_flush: Called with a tuple of the pin ids every time a batch
+        has been written to Redis.
+
+    >>> with globe.buffer(max_pins=500) as buf:
+    ...     buf.pin('car1', latlon=(52.52, 13.40))
+    ...     buf.pin('car1', latlon=(52.52, 13.41))  # only this one is written
+    """
+
+    def __init__(self, globe, max_pins=1000, max_delay=1.0, batch_size=200,
+                 cache_size=100000, on_flush=None, drop_cell_moves=False):
+        self._globe = globe
+        self._max_pins = max_pins
+        self._max_delay = max_delay
+        self._batch_size = batch_size
+        self._cache_size = cache_size
+        self._on_flush = on_flush
+        self._drop_cell_moves = drop_cell_moves
+        self._pending = OrderedDict()  # pin_id -> (geohash, serialized data)
+        # pin_id -> geohash last written to Redis, least recently used
+        # first
+        self._known = OrderedDict()
+        self._oldest = None
+
+    def pin(self, pin_id, **loc):
+        """Buffer an insert or move of a pin, see :py:meth:`Globe.pin`."""
+        gh = self._globe.loc2geohash(loc, MAX_PRECISION)
+        pin_data = self._globe._serialize_pin_data(loc.get('data'))
+
+        if pin_id in self._pending:
+            _, pending_data = self._pending.pop(pin_id)
+            # a move without data does not discard data waiting to be written
+            if pin_data is None:
+                pin_data = pending_data
+        elif pin_data is None and self._is_known(pin_id, gh):
+            return  # the pin did not move
+
+        self._pending[pin_id] = (gh, pin_data)
+        if self._oldest is None:
+            self._oldest = time.time()
+
+        if (len(self._pending) >= self._max_pins or
+                time.time() - self._oldest >= self._max_delay):
+            self.flush()
+
+    def _is_known(self, pin_id, gh):
+        known = self._known.pop(pin_id, None)
+        if known is None:
+            return False
+        self._known[pin_id] = known  # used most recently now
+        if self._drop_cell_moves:
+            precision = self._globe._geohash_precision
+            return known[:precision] == gh[:precision]
+        return known == gh
+
+    def delete(self, pin_id):
+        """Discard buffered writes of a pin and delete it from the globe."""
+        was_pending = self._pending.pop(pin_id, None) is not None
+        self._known.pop(pin_id, None)
+        try:
+            self._globe.delete(pin_id)
+        except ValueError:
+            # the pin only existed in this buffer
+            if not was_pending:
+                raise
+
+    def flush(self):
+        """Write all pending pins to Redis."""
+        while self._pending:
+            batch = []
+            for pin_id, (gh, pin_data) in self._pending.iteritems():
+                batch.append((pin_id, gh, pin_data))
+                if len(batch) >= self._batch_size:
+                    break
+
+            # pins stay pending if writing them fails
+            self._globe._pin_many(batch)
+
+            for pin_id, gh, _ in batch:
+                del self._pending[pin_id]
+                self._known.pop(pin_id, None)
+                self._known[pin_id] = gh
+            while len(self._known) > self._cache_size:
+                self._known.popitem(last=False)
+
+            if self._on_flush:
+                self._on_flush(tuple(pin_id for pin_id, _, _ in batch))
+        self._oldest = None
+
+    def __len__(self):
+        """Return the number of pending pins."""
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def __repr__(self):
+        return '<WriteBuffer with {} pending pins at {}>'.format(
+            len(self), hex(id(self)))
+
+
+class SnapshotResult(object):
+    """The result of a read of a :py:class:`Snapshot`, available as `value`
+    once the snapshot ran.
+    """
+
+    def __init__(self):
+        self._done = False
+        self._value = None
+
+    @property
+    def value(self):
+        if not self._done:
+            raise ValueError('the snapshot did not run yet')
+        return self._value
+
+    def _set(self, value):
+        self._value = value
+        self._done = True
+
+    def __repr__(self):
+        if not self._done:
+            return '<SnapshotResult, pending>'
+        return '<SnapshotResult {!r}>'.format(self._value)
+
+
+class Snapshot(object):
+    """Collect reads of a globe and run them in one MULTI/EXEC transaction,
+    so that they see the same state of the globe. The transaction is sent
+    with one round trip, the script calls as plain `EVALSHA`, one more is
+    only needed if Redis forgot the scripts, see :py:func:`call_script`.
+
+    Every read returns a :py:class:`SnapshotResult`, its value is set when
+    the `with` block is left or :py:meth:`execute` is called.
+
+    >>> area = globe.near(latlon=(52.52, 13.40))
+    >>> with globe.snapshot() as s:
+    ...     pins = s.pins_with_data(area)
+    ...     count = s.count(area)
+    >>> len(pins.value) == count.value
+    True
+    """
+
+    def __init__(self, globe):
+        self._globe = globe
+        self._reads = []  # (queue, parse, result) tuples
+
+    def _add(self, queue, parse):
+        # queue(pipe) queues the commands of a read, parse gets their
+        # replies and returns the value
+        result = SnapshotResult()
+        self._reads.append((queue, parse, result))
+        return result
+
+    def pins(self, area):
+        """Read the sorted pin ids of an :py:class:`Area`."""
+        return self._add(area._queue_pins,
+                         lambda replies: sorted(area._parse_pins(replies)))
+
+    def count(self, area):
+        """Read the amount of pins of an :py:class:`Area`."""
+        if area._edges:
+            return self._add(area._queue_pins,
+                             lambda replies: len(area._parse_pins(replies)))
+        return self._add(
+            lambda pipe: self._globe._area_pins(
+                area.geohashes, count=True, client=pipe, **area._window()),
+            lambda replies: replies[0])
+
+    def pins_with_data(self, area, lazy=False):
+        """Read a dict of the pins of an :py:class:`Area` with their data,
+        with one script call instead of reading the pins and then their
+        data. See :py:meth:`Globe.map_with_data` for `lazy`.
+        """
+        def parse(replies):
+            return self._deserialize(area._parse_pins(replies, True), lazy)
+        return self._add(lambda pipe: area._queue_pins(pipe, True), parse)
+
+    def map_with_data(self, pin_ids, lazy=False):
+        """Read a dict of the given pins with their data, see
+        :py:meth:`Globe.map_with_data`.
+        """
+        pin_ids = tuple(pin_ids)
+        if not pin_ids:
+            return self._add(lambda pipe: None, lambda replies: {})
+        return self._add(
+            lambda pipe: pipe.hmget(self._globe._key_prefix + 'data',
+                                    *pin_ids),
+            lambda replies: self._deserialize(zip(pin_ids, replies[0]),
+                                              lazy))
+
+    def data(self, pin_id):
+        """Read the data of a pin or None if no data."""
+        deserialize = self._globe._data_deserialize
+        return self._add(
+            lambda pipe: pipe.hget(self._globe._key_prefix + 'data', pin_id),
+            lambda replies: (deserialize(replies[0])
+                             if replies[0] is not None else None))
+
+    def geohashes(self, pin_ids):
+        """Read a list of the geohashes of the given pins, None for unknown
+        pins.
+        """
+        pin_ids = tuple(pin_ids)
+        return self._add(
+            lambda pipe: self._globe._pin_geohashes(pin_ids, client=pipe),
+            lambda replies: [gh or None for gh in replies[0]])
+
+    def _deserialize(self, pins, lazy):
+        if lazy:
+            return LazyDataMap(dict(pins), self._globe._data_deserialize)
+        deserialize = self._globe._data_deserialize
+        return dict((pin_id, deserialize(data) if data is not None else None)
+                    for pin_id, data in pins)
+
+    def execute(self):
+        """Run the collected reads and set the values of their results."""
+        reads, self._reads = self._reads, []
+        if not reads:
+            return
+
+        def read(client):
+            pipe = client.pipeline(transaction=True)
+            sizes = []
+            for queue, _, _ in reads:
+                before = len(pipe)
+                queue(pipe)
+                sizes.append(len(pipe) - before)
+            return sizes, execute_pipeline(pipe)
+        sizes, replies = self._globe._read(read)
+
+        offset = 0
+        for (_, parse, result), size in zip(reads, sizes):
+            result._set(parse(replies[offset:offset + size]))
+            offset += size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def __repr__(self):
+        return '<Snapshot with {} pending reads>'.format(len(self._reads))
@@ -0,0 +1,114 @@
+'''
+The `geonear` command.
+
+    geonear ingest cars.csv --precision 8 --namespace cars \\
+        --checkpoint cars.checkpoint --bad-rows cars.bad
+'''
+
+import argparse
+import json
+import sys
+
+import codec
+import ingest
+
+
+def _print_progress(progress):
+    sys.stderr.write('\r{rows} rows, {pins} pins, {bad_rows} bad, '
+                     '{rows_per_second:.0f} rows/s'.format(**progress))
+    sys.stderr.flush()
+
+
+def _ingest(args):
+    import redis
+    from geonear import Globe
+
+    if args.codec == 'json':
+        serialize, deserialize = json.dumps, json.loads
+    else:
+        data_codec = codec.Codec(args.codec)
+        serialize, deserialize = data_codec.serialize, data_codec.deserialize
+    globe = Globe(redis.StrictRedis.from_url(args.redis_url),
+                  args.precision, namespace=args.namespace,
+                  data_serialize=serialize, data_deserialize=deserialize,
+                  projected_fields=args.projected_fields or (),
+                  compact=args.compact)
+
+    bad_rows = open(args.bad_rows, 'a') if args.bad_rows else None
+
+    def on_bad_row(row_number, row, reason):
+        bad_rows.write('{}\t{}\t{}\n'.format(row_number, reason,
+                                             json.dumps(row)))
+
+    try:
+        stats = ingest.ingest(
+            globe, args.file, format=args.format, id_field=args.id_field,
+            lat_field=args.lat_field, lon_field=args.lon_field,
+            data_fields=args.data_fields, processes=args.processes,
+            chunk_size=args.chunk_size, batch_size=args.batch_size,
+            pipeline_size=args.pipeline_size, checkpoint=args.checkpoint,
+            on_bad_row=on_bad_row if bad_rows else None,
+            report=None if args.quiet else _print_progress)
+    finally:
+        if bad_rows:
+            bad_rows.close()
+    if not args.quiet:
+        sys.stderr.write('\n')
+    print json.dumps(stats, sort_keys=True)
+    return 1 if stats['bad_rows'] and args.strict else 0
+
+
+def _fields(value):
+    return [field for field in value.split(',') if field]
+
+
+def main(argv=None):
+    '''Run the `geonear` command with `argv`, by default the arguments of
+    the process, and return the exit status.
+    '''
+    parser = argparse.ArgumentParser(prog='geonear')
+    commands = parser.add_subparsers(dest='command')
+
+    ingest_parser = commands.add_parser(
+        'ingest', help='add or move the pins of a CSV or GeoJSON file')
+    ingest_parser.add_argument('file')
+    ingest_parser.add_argument('--precision', type=int, required=True,
+                               help='geohash precision of the globe')
+    ingest_parser.add_argument('--namespace', default='')
+    ingest_parser.add_argument('--redis-url',
+                               default='redis://localhost:6379/0')
+    ingest_parser.add_argument('--format', choices=('csv', 'geojson'),
+                               help='by default guessed by the extension')
+    ingest_parser.add_argument('--id-field', default='id')
+    ingest_parser.add_argument('--lat-field', default='lat')
+    ingest_parser.add_argument('--lon-field', default='lon')
+    ingest_parser.add_argument('--data-fields', type=_fields,
+                               help='comma separated, default all')
+    ingest_parser.add_argument('--projected-fields', type=_fields,
+                               help='the projected fields of the globe')
+    ingest_parser.add_argument('--codec', default='json',
+                               choices=('json', 'msgpack', 'marshal'))
+    ingest_parser.add_argument('--compact', action='store_true',
+                               help='use the compact layout')
+    ingest_parser.add_argument('--processes', type=int,
+                               help='default one per CPU')
+    ingest_parser.add_argument('--chunk-size', type=int, default=2000)
+    ingest_parser.add_argument('--batch-size', type=int, default=500)
+    ingest_parser.add_argument('--pipeline-size', type=int, default=10)
+    ingest_parser.add_argument('--checkpoint',
+                               help='file to resume an interrupted run')
+    ingest_parser.add_argument('--bad-rows',
+                               help='append rows which can not be parsed '
+                               'to this file')
+    ingest_parser.add_argument('--strict', action='store_true',
+                               help='exit with 1 if there were bad rows')
+    ingest_parser.add_argument('--quiet', action='store_true',
+                               help='do not report the progress')
+    ingest_parser.set_defaults(run=_ingest)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
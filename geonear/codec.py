@@ -0,0 +1,178 @@
+'''
+Compact binary codecs for pin data.
+
+Serialized data starts with a NUL byte, a codec tag and a compression tag.
+Data without this header is read as JSON, the default format of a
+:py:class:`geonear.Globe`, so switching a namespace to another codec keeps
+the existing pins readable.
+
+>>> codec = Codec('marshal', compress_above=None)
+>>> blob = codec.serialize({'speed': 12})
+>>> blob[:3]
+'\\x00r-'
+>>> deserialize(blob) == deserialize('{"speed": 12}') == {'speed': 12}
+True
+'''
+
+import json
+import marshal
+import zlib
+from collections import Mapping
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional
+    msgpack = None
+
+HEADER = '\x00'
+NOT_COMPRESSED = '-'
+ZLIB = 'z'
+
+
+def _msgpack_dumps(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _msgpack_loads(blob):
+    return msgpack.unpackb(blob, raw=False)
+
+
+def _marshal_dumps(data):
+    return marshal.dumps(data, 2)
+
+
+# tag: (name, serialize, deserialize)
+CODECS = {
+    'j': ('json', json.dumps, json.loads),
+    'm': ('msgpack', _msgpack_dumps, _msgpack_loads),
+    'r': ('marshal', _marshal_dumps, marshal.loads),
+}
+
+
+class Codec(object):
+    '''Serialize pin data into a tagged binary format.
+
+    Use it for the `data_serialize` and `data_deserialize` arguments of a
+    :py:class:`geonear.Globe`.
+
+    :param str name: `msgpack` (needs the msgpack package), `marshal` (only
+        for data written and read by the same Python version) or `json`.
+    :param int compress_above: Compress serialized data with zlib if it is
+        longer than this many bytes, None to never compress.
+    :param int compress_level: The zlib compression level.
+    '''
+
+    def __init__(self, name='msgpack', compress_above=1024, compress_level=6):
+        for tag, (codec_name, dumps, _) in CODECS.items():
+            if codec_name == name:
+                break
+        else:
+            raise ValueError('unknown codec {}'.format(name))
+        if name == 'msgpack' and msgpack is None:
+            raise ImportError('the msgpack codec needs the msgpack package')
+        self._tag = tag
+        self._dumps = dumps
+        self._compress_above = compress_above
+        self._compress_level = compress_level
+
+    def serialize(self, data):
+        '''Return `data` serialized.'''
+        blob = self._dumps(data)
+        if (self._compress_above is not None and
+                len(blob) > self._compress_above):
+            return HEADER + self._tag + ZLIB + zlib.compress(
+                blob, self._compress_level)
+        return HEADER + self._tag + NOT_COMPRESSED + blob
+
+    def deserialize(self, blob):
+        '''Return the data of a blob written by any codec.'''
+        return deserialize(blob)
+
+    def __repr__(self):
+        return '<Codec {}>'.format(CODECS[self._tag][0])
+
+
+def deserialize(blob):
+    '''Return the data of a blob written by any codec or plain JSON.'''
+    if not blob.startswith(HEADER):
+        return json.loads(blob)
+    try:
+        _, _, loads = CODECS[blob[1:2]]
+    except KeyError:
+        raise ValueError('unknown codec tag {!r}'.format(blob[1:2]))
+    if blob[2:3] == ZLIB:
+        return loads(zlib.decompress(blob[3:]))
+    return loads(blob[3:])
+
+
+def serialize_pin_data(pin_data, serialize, projected_fields=(),
+                       serialized_data=None):
+    '''Return a tuple with the serialized data and the serialized
+    projected fields of a pin as sent to the scripts of a globe, or None if
+    there is no data. Pass `serialized_data` if the data is serialized
+    already.
+    '''
+    if not pin_data:
+        return None
+    serialized = [serialized_data or serialize(pin_data)]
+    for field in projected_fields:
+        # an empty string deletes the field
+        if isinstance(pin_data, dict) and field in pin_data:
+            serialized.append(serialize(pin_data[field]))
+        else:
+            serialized.append('')
+    return tuple(serialized)
+
+
+class LazyData(object):
+    '''Serialized pin data deserialized on first access of `value`.'''
+
+    __slots__ = ('_blob', '_deserialize', '_value')
+
+    def __init__(self, blob, deserialize):
+        self._blob = blob
+        self._deserialize = deserialize
+
+    @property
+    def value(self):
+        try:
+            return self._value
+        except AttributeError:
+            self._value = self._deserialize(self._blob)
+            del self._blob
+            return self._value
+
+    def __repr__(self):
+        return '<LazyData {}>'.format(
+            'decoded' if hasattr(self, '_value') else 'not decoded')
+
+
+class LazyDataMap(Mapping):
+    '''Read only dict of pin ids to their data, deserializing the data of
+    a pin when it is looked up the first time. Pins without data map to
+    None.
+    '''
+
+    def __init__(self, blobs, deserialize):
+        self._blobs = blobs
+        self._deserialize = deserialize
+        self._values = {}
+
+    def __getitem__(self, pin_id):
+        try:
+            return self._values[pin_id]
+        except KeyError:
+            blob = self._blobs[pin_id]
+            value = None if blob is None else self._deserialize(blob)
+            self._values[pin_id] = value
+            return value
+
+    def __iter__(self):
+        return iter(self._blobs)
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def __repr__(self):
+        return '<LazyDataMap with {} pins, {} decoded>'.format(
+            len(self), len(self._values))
@@ -0,0 +1,22 @@
+'''
+Constants and helpers shared by the modules of geonear.
+'''
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def import_numpy():
+    '''Return the numpy module, or None if it is not installed.
+
+    numpy is optional and slow to import, so this is only done when it is
+    needed the first time.
+    '''
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as _numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+_numpy = False  # not imported yet
@@ -0,0 +1,254 @@
+'''
+Cover bounding boxes and polygons with geohashes of mixed precision.
+
+Geohashes lying completely inside a region are kept as coarse as possible,
+the ones crossing its border are refined until a cell budget is used up.
+'''
+
+import heapq
+
+import geohash  # install with `pip install python-geohash`
+from common import BASE32, import_numpy
+
+OUTSIDE = 0
+PARTIAL = 1
+INSIDE = 2
+
+
+class BBoxRegion(object):
+    '''A region limited by two latitudes and two longitudes.
+
+    >>> region = BBoxRegion(52.50, 13.38, 52.53, 13.42)
+    >>> region.relation(geohash.bbox('u33d9'))
+    1
+    >>> region.relation(geohash.bbox('u33d9n'))
+    2
+    >>> region.contains_points([52.51, 52.6], [13.40, 13.40])
+    [True, False]
+    '''
+
+    def __init__(self, s, w, n, e):
+        if s > n or w > e:
+            raise ValueError('south/west must not exceed north/east')
+        self.s, self.w, self.n, self.e = s, w, n, e
+
+    def relation(self, bbox):
+        '''Return `INSIDE`, `PARTIAL` or `OUTSIDE` for a geohash bbox.'''
+        if (bbox['s'] >= self.n or bbox['n'] <= self.s or
+                bbox['w'] >= self.e or bbox['e'] <= self.w):
+            return OUTSIDE
+        if (bbox['s'] >= self.s and bbox['n'] <= self.n and
+                bbox['w'] >= self.w and bbox['e'] <= self.e):
+            return INSIDE
+        return PARTIAL
+
+    def contains_points(self, lats, lons):
+        '''Return a list of booleans telling which points lie inside.'''
+        numpy = import_numpy()
+        if numpy is not None:
+            lats, lons = numpy.asarray(lats), numpy.asarray(lons)
+            return ((lats >= self.s) & (lats <= self.n) &
+                    (lons >= self.w) & (lons <= self.e)).tolist()
+        return [self.s <= lat <= self.n and self.w <= lon <= self.e
+                for lat, lon in zip(lats, lons)]
+
+    def __eq__(self, other):
+        return isinstance(other, BBoxRegion) and (
+            (self.s, self.w, self.n, self.e) ==
+            (other.s, other.w, other.n, other.e))
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class PolygonRegion(object):
+    '''A simple polygon given by its `(latitude, longitude)` corners.
+
+    >>> region = PolygonRegion([(0, 0), (0, 10), (10, 0)])
+    >>> region.contains_points([1, 9, -1], [1, 9, 1])
+    [True, False, False]
+    >>> region.relation(geohash.bbox('s0'))
+    1
+    '''
+
+    def __init__(self, points):
+        points = [(float(lat), float(lon)) for lat, lon in points]
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()  # the polygon closes itself
+        if len(points) < 3:
+            raise ValueError('a polygon needs at least three points')
+        self.points = points
+        self.edges = list(zip(points, points[1:] + points[:1]))
+        self.s = min(lat for lat, lon in points)
+        self.n = max(lat for lat, lon in points)
+        self.w = min(lon for lat, lon in points)
+        self.e = max(lon for lat, lon in points)
+
+    def relation(self, bbox):
+        '''Return `INSIDE`, `PARTIAL` or `OUTSIDE` for a geohash bbox.'''
+        if (bbox['s'] >= self.n or bbox['n'] <= self.s or
+                bbox['w'] >= self.e or bbox['e'] <= self.w):
+            return OUTSIDE
+
+        corners = [(bbox['s'], bbox['w']), (bbox['s'], bbox['e']),
+                   (bbox['n'], bbox['e']), (bbox['n'], bbox['w'])]
+        sides = list(zip(corners, corners[1:] + corners[:1]))
+        for a, b in self.edges:
+            for c, d in sides:
+                if _segments_intersect(a, b, c, d):
+                    return PARTIAL
+
+        # no borders cross, so the cell is either completely inside,
+        # completely outside or contains the whole polygon
+        lat, lon = corners[0]
+        if self.contains_points([lat], [lon])[0]:
+            return INSIDE
+        lat, lon = self.points[0]
+        if bbox['s'] <= lat <= bbox['n'] and bbox['w'] <= lon <= bbox['e']:
+            return PARTIAL
+        return OUTSIDE
+
+    def contains_points(self, lats, lons):
+        '''Return a list of booleans telling which points lie inside.
+
+        Uses the even-odd rule, vectorised over the points if numpy is
+        installed.
+        '''
+        numpy = import_numpy()
+        if numpy is not None:
+            lats = numpy.asarray(lats, dtype=float)
+            lons = numpy.asarray(lons, dtype=float)
+            inside = numpy.zeros(lats.shape, dtype=bool)
+            for (lat1, lon1), (lat2, lon2) in self.edges:
+                if lat1 == lat2:
+                    continue
+                crosses = (lat1 > lats) != (lat2 > lats)
+                at_lon = (lon2 - lon1) * (lats - lat1) / (lat2 - lat1) + lon1
+                inside ^= crosses & (lons < at_lon)
+            return inside.tolist()
+
+        result = []
+        for lat, lon in zip(lats, lons):
+            inside = False
+            for (lat1, lon1), (lat2, lon2) in self.edges:
+                if (lat1 > lat) != (lat2 > lat) and lon < (
+                        (lon2 - lon1) * (lat - lat1) / (lat2 - lat1) + lon1):
+                    inside = not inside
+            result.append(inside)
+        return result
+
+    def __eq__(self, other):
+        return isinstance(other, PolygonRegion) and \
+            self.points == other.points
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class IntersectionRegion(object):
+    '''The region inside both of two regions.
+
+    >>> region = IntersectionRegion(BBoxRegion(0, 0, 10, 10),
+    ...                             BBoxRegion(5, 5, 20, 20))
+    >>> region.contains_points([7, 2, 15], [7, 2, 15])
+    [True, False, False]
+    '''
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+    def relation(self, bbox):
+        '''Return `INSIDE`, `PARTIAL` or `OUTSIDE` for a geohash bbox,
+        `PARTIAL` also for some cells outside of both regions.
+        '''
+        return min(self.a.relation(bbox), self.b.relation(bbox))
+
+    def contains_points(self, lats, lons):
+        '''Return a list of booleans telling which points lie inside.'''
+        return [in_a and in_b for in_a, in_b in zip(
+            self.a.contains_points(lats, lons),
+            self.b.contains_points(lats, lons))]
+
+    def __eq__(self, other):
+        return isinstance(other, IntersectionRegion) and (
+            (self.a == other.a and self.b == other.b) or
+            (self.a == other.b and self.b == other.a))
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _orientation(a, b, c):
+    value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (value > 0) - (value < 0)
+
+
+def _segments_intersect(a, b, c, d):
+    # touching counts as intersecting, that only costs a finer cover
+    o1, o2 = _orientation(a, b, c), _orientation(a, b, d)
+    o3, o4 = _orientation(c, d, a), _orientation(c, d, b)
+    if o1 != o2 and o3 != o4:
+        return True
+
+    def on_segment(p, q, r):
+        return (min(p[0], r[0]) <= q[0] <= max(p[0], r[0]) and
+                min(p[1], r[1]) <= q[1] <= max(p[1], r[1]))
+
+    return ((o1 == 0 and on_segment(a, c, b)) or
+            (o2 == 0 and on_segment(a, d, b)) or
+            (o3 == 0 and on_segment(c, a, d)) or
+            (o4 == 0 and on_segment(c, b, d)))
+
+
+def cover(region, max_cells=64, max_precision=12):
+    '''Return a tuple `(inside, edges)` of two sets of geohashes which
+    together cover `region`.
+
+    Geohashes in `inside` lie completely inside the region, the ones in
+    `edges` cross its border. Starting from the 32 geohashes of length one
+    the coarsest geohashes crossing the border are split into their
+    children as long as the result stays within `max_cells` geohashes
+    and `max_precision`.
+
+    >>> inside, edges = cover(BBoxRegion(52.50, 13.38, 52.53, 13.42), 32, 7)
+    >>> len(inside) + len(edges) <= 32
+    True
+    >>> sorted(inside)[:3]
+    ['u33d8w', 'u33d8x', 'u33d8y']
+    '''
+    inside = set()
+    edges = set()
+    candidates = []  # the border geohashes that still may be split
+
+    for gh in BASE32:
+        relation = region.relation(geohash.bbox(gh))
+        if relation == INSIDE:
+            inside.add(gh)
+        elif relation == PARTIAL:
+            heapq.heappush(candidates, (len(gh), gh))
+
+    while candidates:
+        _, gh = heapq.heappop(candidates)
+        if len(gh) >= max_precision:
+            edges.add(gh)
+            continue
+
+        children = []
+        for child in (gh + c for c in BASE32):
+            relation = region.relation(geohash.bbox(child))
+            if relation != OUTSIDE:
+                children.append((child, relation))
+
+        cells = len(inside) + len(edges) + len(candidates)
+        if cells + len(children) > max_cells:
+            edges.add(gh)  # splitting would exceed the budget
+            continue
+
+        for child, relation in children:
+            if relation == INSIDE:
+                inside.add(child)
+            else:
+                heapq.heappush(candidates, (len(child), child))
+
+    return inside, edges
@@ -0,0 +1,315 @@
+'''
+Load large CSV or GeoJSON files into a globe.
+
+Rows are read in chunks which a pool of processes parses, geohashes and
+serializes, while this process writes the parsed chunks in input order
+with pipelined batches of script calls. Later rows of a pin id therefore
+always win over earlier ones.
+
+>>> from geonear.ingest import ingest
+>>> ingest(globe, 'cars.csv', lat_field='latitude', lon_field='longitude',
+...        checkpoint='cars.checkpoint')
+{'rows': 120000, 'pins': 119998, 'bad_rows': 2, 'seconds': 3.1, ...}
+'''
+
+import csv
+import json
+import multiprocessing
+import os
+import pickle
+import types
+import time
+from collections import deque
+
+import geohash  # install with `pip install python-geohash`
+from codec import serialize_pin_data
+from geonear import execute_pipeline
+
+GEOHASH_LENGTH = 12  # pins are sent to the scripts with full geohashes
+FEATURE_PER_LINE = ('.geojsonl', '.geojsons', '.ndjson')
+
+
+def guess_format(path):
+    '''Return `csv` or `geojson` by the file extension of `path`.
+
+    `.geojson` files are read as a whole, `.geojsonl`, `.geojsons` and
+    `.ndjson` files are read as one feature per line.
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.csv', '.tsv', '.txt'):
+        return 'csv'
+    if extension in ('.geojson', '.json', '.geojsonl', '.geojsons',
+                     '.ndjson'):
+        return 'geojson'
+    raise ValueError('can not guess the format of {}'.format(path))
+
+
+def read_rows(path, format):
+    '''Yield the raw rows of a file, dicts for CSV and JSON strings or
+    dicts for GeoJSON features.
+    '''
+    if format == 'csv':
+        with open(path, 'rb') as f:
+            dialect = 'excel-tab' if path.endswith('.tsv') else 'excel'
+            for row in csv.DictReader(f, dialect=dialect):
+                yield row
+    elif format == 'geojson':
+        with open(path, 'rb') as f:
+            if os.path.splitext(path)[1].lower() in FEATURE_PER_LINE:
+                for line in f:
+                    # GeoJSON text sequences start features with RS
+                    line = line.strip().lstrip('\x1e')
+                    if line:
+                        yield line
+            else:
+                # a FeatureCollection, this has to fit in memory
+                for feature in json.load(f).get('features', ()):
+                    yield feature
+    else:
+        raise ValueError('unknown format {}'.format(format))
+
+
+class RowParser(object):
+    '''Turn raw rows into `(pin_id, geohash, serialized_data)` tuples.
+
+    Instances are sent to the worker processes, so everything they hold
+    must be picklable. A `serialize` method like the one of a
+    :py:class:`geonear.codec.Codec` is sent as its instance and name.
+
+    :param str format: `csv` or `geojson`.
+    :param str id_field: Column or feature property with the pin id,
+        GeoJSON features may have an `id` instead.
+    :param str lat_field: Column with the latitude, not used for GeoJSON.
+    :param str lon_field: Column with the longitude, not used for GeoJSON.
+    :param data_fields: Columns or properties to save as data of the pins,
+        None for all of them except the id and coordinates.
+    :param serialize: The `data_serialize` of the globe.
+    :param projected_fields: The `projected_fields` of the globe.
+    '''
+
+    def __init__(self, format, id_field='id', lat_field='lat',
+                 lon_field='lon', data_fields=None, serialize=json.dumps,
+                 projected_fields=()):
+        self.format = format
+        self.id_field = id_field
+        self.lat_field = lat_field
+        self.lon_field = lon_field
+        self.data_fields = data_fields
+        self.serialize = serialize
+        self.projected_fields = tuple(projected_fields)
+
+    def parse(self, row):
+        '''Return the tuple for one row, raise ValueError for bad rows.'''
+        if self.format == 'csv':
+            pin_id, lat, lon, fields = self._parse_csv(row)
+        else:
+            pin_id, lat, lon, fields = self._parse_feature(row)
+        if not pin_id:
+            raise ValueError('no pin id')
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError('coordinates out of range')
+
+        if self.data_fields is None:
+            data = fields
+        else:
+            data = dict((key, fields[key]) for key in self.data_fields
+                        if key in fields)
+        gh = geohash.encode(lat, lon, precision=GEOHASH_LENGTH)
+        return pin_id, gh, serialize_pin_data(data, self.serialize,
+                                              self.projected_fields)
+
+    def _parse_csv(self, row):
+        try:
+            pin_id = row[self.id_field]
+            lat = float(row[self.lat_field])
+            lon = float(row[self.lon_field])
+        except KeyError as exc:
+            raise ValueError('missing column {}'.format(exc))
+        except (TypeError, ValueError):
+            raise ValueError('invalid coordinates')
+        fields = dict((key, value) for key, value in row.items()
+                      if key not in (self.id_field, self.lat_field,
+                                     self.lon_field))
+        return pin_id, lat, lon, fields
+
+    def _parse_feature(self, feature):
+        if not isinstance(feature, dict):
+            feature = json.loads(feature)
+        properties = dict(feature.get('properties') or {})
+        pin_id = properties.pop(self.id_field, None) or feature.get('id')
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') != 'Point':
+            raise ValueError('geometry is not a point')
+        try:
+            lon, lat = map(float, geometry['coordinates'][:2])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('invalid coordinates')
+        if pin_id is not None and not isinstance(pin_id, basestring):
+            pin_id = str(pin_id)
+        return pin_id, lat, lon, properties
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        owner = getattr(self.serialize, '__self__', None)
+        # bound methods can not be pickled with Python 2, unlike their
+        # instance, functions of modules are pickled by name
+        if owner is not None and not isinstance(owner, types.ModuleType):
+            state['serialize'] = (owner, self.serialize.__name__)
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state['serialize'], tuple):
+            owner, name = state['serialize']
+            state['serialize'] = getattr(owner, name)
+        self.__dict__.update(state)
+
+
+def _parse_chunk(parser, chunk):
+    # runs in the worker processes, bad rows are returned, not raised
+    pins = []
+    bad_rows = []
+    for row_number, row in chunk:
+        try:
+            pins.append(parser.parse(row))
+        except ValueError as exc:
+            bad_rows.append((row_number, row, str(exc)))
+    return pins, bad_rows
+
+
+def _chunks(rows, size, skip):
+    chunk = []
+    for row_number, row in enumerate(rows, 1):
+        if row_number <= skip:
+            continue
+        chunk.append((row_number, row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parsed_chunks(parser, chunks, processes):
+    # yield (last row number, pins, bad rows) in input order, keeping a
+    # bounded amount of chunks in the pool
+    if processes == 0:
+        for chunk in chunks:
+            yield (chunk[-1][0],) + _parse_chunk(parser, chunk)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    max_pending = 2 * (processes or multiprocessing.cpu_count())
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk[-1][0], pool.apply_async(
+                _parse_chunk, (parser, chunk))))
+            if len(pending) >= max_pending:
+                row_number, result = pending.popleft()
+                yield (row_number,) + result.get()
+        while pending:
+            row_number, result = pending.popleft()
+            yield (row_number,) + result.get()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def read_checkpoint(checkpoint, path):
+    '''Return the amount of rows of `path` written according to the
+    checkpoint file, 0 if there is none for this input.
+    '''
+    try:
+        with open(checkpoint) as f:
+            state = json.load(f)
+    except IOError:
+        return 0
+    if state.get('input') != os.path.abspath(path):
+        return 0
+    return state['rows']
+
+
+def _write_checkpoint(checkpoint, path, rows):
+    # replace the file atomically, a crash must not leave half of it
+    tmp = checkpoint + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'input': os.path.abspath(path), 'rows': rows}, f)
+    os.rename(tmp, checkpoint)
+
+
+def ingest(globe, path, format=None, id_field='id', lat_field='lat',
+           lon_field='lon', data_fields=None, processes=None,
+           chunk_size=2000, batch_size=500, pipeline_size=10,
+           checkpoint=None, on_bad_row=None, report=None):
+    '''Add or move the pins of a CSV or GeoJSON file, return a dict with
+    the counts of `rows`, `pins` and `bad_rows` and the `seconds` it took.
+
+    See :py:class:`RowParser` for the fields and :py:func:`guess_format`
+    for the `format`.
+
+    :param int processes: Amount of worker processes, by default one per
+        CPU, 0 to parse in this process.
+    :param int chunk_size: Rows sent to a worker at once.
+    :param int batch_size: Pins written per script call.
+    :param int pipeline_size: Script calls sent per round trip.
+    :param str checkpoint: File remembering how many rows were written,
+        to continue after them when ingesting the same file again. It is
+        updated after every round trip.
+    :param on_bad_row: Called with the row number, the raw row and the
+        reason for every row which could not be parsed. Bad rows are
+        skipped silently by default.
+    :param report: Called with a dict of the `rows`, `pins`, `bad_rows`
+        and `rows_per_second` so far after every round trip.
+    '''
+    if format is None:
+        format = guess_format(path)
+    parser = RowParser(format, id_field, lat_field, lon_field, data_fields,
+                       globe._data_serialize, globe._projected_fields)
+    if processes != 0:
+        try:
+            pickle.dumps(parser, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as exc:
+            raise ValueError(
+                'the data_serialize of the globe can not be sent to the '
+                'worker processes ({}), pass processes=0 to parse in this '
+                'process'.format(exc))
+    skip = read_checkpoint(checkpoint, path) if checkpoint else 0
+
+    started = time.time()
+    stats = {'rows': skip, 'pins': 0, 'bad_rows': 0}
+    pipe = globe._redis.pipeline(transaction=False)
+    queued = 0
+
+    def flush(rows):
+        execute_pipeline(pipe)
+        stats['rows'] = rows
+        if checkpoint:
+            _write_checkpoint(checkpoint, path, rows)
+        if report:
+            elapsed = time.time() - started
+            report(dict(stats, rows_per_second=(
+                (rows - skip) / elapsed if elapsed else 0.0)))
+
+    chunks = _chunks(read_rows(path, format), chunk_size, skip)
+    last_row = skip
+    for last_row, pins, bad_rows in _parsed_chunks(parser, chunks,
+                                                    processes):
+        for row_number, row, reason in bad_rows:
+            if on_bad_row:
+                on_bad_row(row_number, row, reason)
+        stats['bad_rows'] += len(bad_rows)
+        for i in range(0, len(pins), batch_size):
+            globe._pin_many(pins[i:i + batch_size], client=pipe)
+            queued += 1
+        stats['pins'] += len(pins)
+        # only whole chunks are flushed, so the checkpoint is exact
+        if queued >= pipeline_size:
+            flush(last_row)
+            queued = 0
+    flush(last_row)
+
+    stats['seconds'] = time.time() - started
+    return stats
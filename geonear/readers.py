@@ -0,0 +1,80 @@
+'''
+Spread read only commands over replicas of the Redis written to.
+
+Replicas failing with a connection error are skipped for a while, reads
+fall back to the primary when no replica is left.
+'''
+
+import time
+from itertools import cycle
+
+
+class ReaderPool(object):
+    '''Round robin over the clients of Redis replicas.
+
+    Pass it or a list of clients as `readers` to a :py:class:`geonear.Globe`.
+
+    :param clients: `StrictRedis` instances connected to replicas.
+    :param fallback: Client used when all replicas fail, usually the
+        primary. Set by the globe if None.
+    :param float retry_after: Seconds to skip a replica after it failed.
+    '''
+
+    def __init__(self, clients, fallback=None, retry_after=5.0):
+        self._clients = list(clients)
+        if not self._clients:
+            raise ValueError('a reader pool needs at least one client')
+        self.fallback = fallback
+        self._retry_after = retry_after
+        self._order = cycle(range(len(self._clients)))
+        self._down_until = [0.0] * len(self._clients)
+
+    def __len__(self):
+        return len(self._clients)
+
+    @property
+    def clients(self):
+        '''All replica clients, healthy or not.'''
+        return tuple(self._clients)
+
+    @property
+    def healthy(self):
+        '''The clients not skipped because of a recent failure.'''
+        now = time.time()
+        return tuple(client for client, down_until
+                     in zip(self._clients, self._down_until)
+                     if down_until <= now)
+
+    def _candidates(self):
+        # the healthy clients, starting with the next one in turn
+        start = next(self._order)
+        now = time.time()
+        for i in range(len(self._clients)):
+            i = (start + i) % len(self._clients)
+            if self._down_until[i] <= now:
+                yield i, self._clients[i]
+
+    def execute(self, read, check=None):
+        '''Return `read(client)` for the next healthy replica.
+
+        Other replicas and finally the `fallback` are tried if the replica
+        fails with a connection error or timeout.
+
+        :param check: Called with a replica before reading, replicas it
+            returns False for are passed over without being marked down,
+            e.g. because they lag behind.
+        '''
+        from redis.exceptions import ConnectionError, TimeoutError
+
+        for i, client in self._candidates():
+            try:
+                if check is not None and not check(client):
+                    continue
+                return read(client)
+            except (ConnectionError, TimeoutError):
+                self._down_until[i] = time.time() + self._retry_after
+        return read(self.fallback)
+
+    def __repr__(self):
+        return '<ReaderPool with {} of {} replicas healthy>'.format(
+            len(self.healthy), len(self))
@@ -0,0 +1,302 @@
+'''
+Draw areas and pins to SVG or PNG files, without network access.
+
+The geohashes of an area are merged into outlines: the edges of all cells
+are put on a grid of the most precise geohash, edges shared by two cells
+cancel out and collinear edges are joined. Dense pins are thinned by
+clustering them on a grid of pixels, every cluster is drawn as one dot
+growing with its amount of pins.
+
+>>> rings = outlines(['u33d8', 'u33d9'])  # two neighbors, one rectangle
+>>> len(rings), len(rings[0])
+(1, 5)
+'''
+
+import math
+from collections import Counter
+
+import geohash  # install with `pip install python-geohash`
+from common import import_numpy
+
+MAX_LATITUDE = 85.0511  # the limit of the web mercator projection
+
+
+def _bits(precision):
+    # the amount of longitude and latitude bits of a geohash
+    return (5 * precision + 1) // 2, 5 * precision // 2
+
+
+def _net_segments(intervals):
+    # sweep over the (start, end, direction) intervals of one line and
+    # return the maximal (start, end, direction) pieces where they do not
+    # cancel out
+    events = Counter()
+    for start, end, direction in intervals:
+        events[start] += direction
+        events[end] -= direction
+    segments = []
+    total = 0
+    open_at = None
+    for position in sorted(events):
+        previous, total = total, total + events[position]
+        if previous == total:
+            continue
+        if previous:
+            segments.append((open_at, position, previous))
+        open_at = position if total else None
+    return segments
+
+
+def outlines(geohashes):
+    '''Return the outlines of the geohashes, which may be of different
+    precision, as closed lists of `(latitude, longitude)` points.
+
+    Outer outlines run counterclockwise, the ones of holes clockwise, so
+    they can be filled with the even-odd rule.
+    '''
+    geohashes = list(geohashes)
+    if not geohashes:
+        return []
+    lon_bits, lat_bits = _bits(max(len(gh) for gh in geohashes))
+
+    # the directed edges of every cell, counterclockwise, on the lines of
+    # the grid they lie on
+    rows = {}
+    columns = {}
+    for gh in geohashes:
+        bbox = geohash.bbox(gh)
+        x0 = int(round((bbox['w'] + 180) / 360 * 2 ** lon_bits))
+        x1 = int(round((bbox['e'] + 180) / 360 * 2 ** lon_bits))
+        y0 = int(round((bbox['s'] + 90) / 180 * 2 ** lat_bits))
+        y1 = int(round((bbox['n'] + 90) / 180 * 2 ** lat_bits))
+        rows.setdefault(y0, []).append((x0, x1, 1))
+        rows.setdefault(y1, []).append((x0, x1, -1))
+        columns.setdefault(x1, []).append((y0, y1, 1))
+        columns.setdefault(x0, []).append((y0, y1, -1))
+
+    # the remaining edges by their first point
+    edges = {}
+    for y, intervals in rows.items():
+        for start, end, direction in _net_segments(intervals):
+            if direction > 0:
+                edges.setdefault((start, y), []).append((end, y))
+            else:
+                edges.setdefault((end, y), []).append((start, y))
+    for x, intervals in columns.items():
+        for start, end, direction in _net_segments(intervals):
+            if direction > 0:
+                edges.setdefault((x, start), []).append((x, end))
+            else:
+                edges.setdefault((x, end), []).append((x, start))
+
+    def to_latlon(point):
+        x, y = point
+        return (float(y) / 2 ** lat_bits * 180 - 90,
+                float(x) / 2 ** lon_bits * 360 - 180)
+
+    rings = []
+    while edges:
+        first = next(iter(edges))
+        ring = [first]
+        point = first
+        while True:
+            targets = edges[point]
+            target = targets.pop()
+            if not targets:
+                del edges[point]
+            if target == first:
+                break
+            ring.append(target)
+            point = target
+        ring.append(first)
+        rings.append([to_latlon(point) for point in ring])
+    return rings
+
+
+def signed_area(ring):
+    '''Return the area of a closed ring of `(latitude, longitude)` points
+    in square degrees, positive if it runs counterclockwise.
+    '''
+    return sum(lon1 * lat2 - lon2 * lat1 for (lat1, lon1), (lat2, lon2)
+               in zip(ring, ring[1:])) / 2.0
+
+
+class Projection(object):
+    '''Fit the web mercator projection of a bounding box into an image of
+    `size` pixels, with a margin of `padding` pixels.
+    '''
+
+    def __init__(self, s, w, n, e, size, padding=10):
+        width, height = size
+        self._x0, self._y1 = self._mercator(n, w)
+        x1, y0 = self._mercator(s, e)
+        span = max(x1 - self._x0, self._y1 - y0) or 1e-9
+        self._scale = (min(width, height) - 2 * padding) / span
+        self._padding = padding
+
+    @staticmethod
+    def _mercator(lat, lon):
+        lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+        return (math.radians(lon),
+                math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)))
+
+    def __call__(self, lat, lon):
+        '''Return the pixel of a point.'''
+        x, y = self._mercator(lat, lon)
+        return (self._padding + (x - self._x0) * self._scale,
+                self._padding + (self._y1 - y) * self._scale)
+
+    def many(self, lats, lons):
+        '''Return the pixels of numpy arrays of points as two arrays.'''
+        numpy = import_numpy()
+        lats = numpy.radians(numpy.clip(lats, -MAX_LATITUDE, MAX_LATITUDE))
+        xs = numpy.radians(lons)
+        ys = numpy.log(numpy.tan(math.pi / 4 + lats / 2))
+        return (self._padding + (xs - self._x0) * self._scale,
+                self._padding + (self._y1 - ys) * self._scale)
+
+
+def cluster_points(latlons, project, cluster_size=4):
+    '''Return `(x, y, count)` tuples of the points grouped by squares of
+    `cluster_size` pixels, at the mean pixel of the points of a square.
+
+    Vectorised with numpy if it is installed.
+    '''
+    numpy = import_numpy()
+    if numpy is not None and len(latlons):
+        lats, lons = numpy.asarray(latlons, dtype=float).reshape(-1, 2).T
+        xs, ys = project.many(lats, lons)
+        keys = (numpy.floor(xs / cluster_size).astype(numpy.int64) << 32) + \
+            numpy.floor(ys / cluster_size).astype(numpy.int64)
+        _, inverse, counts = numpy.unique(keys, return_inverse=True,
+                                          return_counts=True)
+        inverse = inverse.ravel()
+        sum_x = numpy.bincount(inverse, weights=xs)
+        sum_y = numpy.bincount(inverse, weights=ys)
+        return list(zip((sum_x / counts).tolist(), (sum_y / counts).tolist(),
+                        counts.tolist()))
+
+    clusters = {}
+    for lat, lon in latlons:
+        x, y = project(lat, lon)
+        key = int(x // cluster_size), int(y // cluster_size)
+        cluster = clusters.get(key)
+        if cluster is None:
+            clusters[key] = [x, y, 1]
+        else:
+            cluster[0] += x
+            cluster[1] += y
+            cluster[2] += 1
+    return [(x / count, y / count, count)
+            for x, y, count in clusters.values()]
+
+
+def _bounds(layers):
+    # the (s, w, n, e) of all outlines and pins
+    numpy = import_numpy()
+    lats = []
+    lons = []
+    for _, _, rings, latlons in layers:
+        for ring in rings:
+            lats.extend(lat for lat, _ in ring)
+            lons.extend(lon for _, lon in ring)
+        if not len(latlons):
+            continue
+        if numpy is not None:
+            points = numpy.asarray(latlons, dtype=float).reshape(-1, 2)
+            (s, w), (n, e) = points.min(axis=0), points.max(axis=0)
+            lats.extend((float(s), float(n)))
+            lons.extend((float(w), float(e)))
+        else:
+            lats.extend(lat for lat, _ in latlons)
+            lons.extend(lon for _, lon in latlons)
+    if not lats:
+        return -MAX_LATITUDE, -180.0, MAX_LATITUDE, 180.0
+    return min(lats), min(lons), max(lats), max(lons)
+
+
+def _radius(count):
+    return 1.5 + math.log(count, 2)
+
+
+def _svg(path, size, layers):
+    width, height = size
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="{0}" '
+             'height="{1}" viewBox="0 0 {0} {1}">'.format(width, height),
+             '<rect width="100%" height="100%" fill="#FFFFFF"/>']
+    for label, color, rings, clusters in layers:
+        parts.append('<g fill="{0}" stroke="{0}"><title>{1}</title>'.format(
+            color, label.replace('&', '&amp;').replace('<', '&lt;')))
+        if rings:
+            parts.append('<path fill-opacity="0.35" fill-rule="evenodd" '
+                         'stroke-width="1" d="{}"/>'.format(' '.join(
+                             'M' + ' '.join('{:.1f},{:.1f}'.format(x, y)
+                                            for x, y in ring[:-1]) + 'Z'
+                             for ring in rings)))
+        for x, y, count in clusters:
+            parts.append('<circle cx="{:.1f}" cy="{:.1f}" r="{:.1f}" '
+                         'stroke="none"/>'.format(x, y, _radius(count)))
+        parts.append('</g>')
+    parts.append('</svg>\n')
+    with open(path, 'w') as f:
+        f.write('\n'.join(parts))
+
+
+def _png(path, size, layers):
+    # Pillow is only needed for PNG files
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', size, '#FFFFFF')
+    for label, color, rings, clusters in layers:
+        if rings:
+            # holes lie inside larger outlines, drawing the larger ones
+            # first and clearing the holes fills by the even-odd rule
+            mask = Image.new('L', size, 0)
+            draw = ImageDraw.Draw(mask)
+            for area, ring in sorted(
+                    ((signed_area(ring), ring) for ring in rings),
+                    key=lambda item: -abs(item[0])):
+                # pixels are (x, y) with y flipped, this keeps the sign
+                draw.polygon(ring, fill=90 if area > 0 else 0)
+            image.paste(color, mask=mask)
+            draw = ImageDraw.Draw(image)
+            for ring in rings:
+                draw.line(ring, fill=color)
+        draw = ImageDraw.Draw(image)
+        for x, y, count in clusters:
+            radius = _radius(count)
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                         fill=color)
+    image.save(path, 'PNG')
+
+
+def render(path, layers, size=(800, 600), cluster_size=4, format=None):
+    '''Write an image of the layers to `path`.
+
+    :param layers: `(label, color, outlines, latlons)` tuples, drawn in
+        this order. `outlines` as returned by :py:func:`outlines` and
+        `latlons` a sequence of `(latitude, longitude)` pins.
+    :param size: Width and height in pixels.
+    :param int cluster_size: Pins closer than this many pixels are drawn as
+        one dot.
+    :param str format: `svg` or `png`, by default guessed by the extension
+        of `path`. PNG files need Pillow.
+    '''
+    if format is None:
+        format = 'png' if path.lower().endswith('.png') else 'svg'
+    if format not in ('svg', 'png'):
+        raise ValueError('unknown format {}'.format(format))
+
+    s, w, n, e = _bounds(layers)
+    project = Projection(s, w, n, e, size)
+
+    projected = []
+    for label, color, rings, latlons in layers:
+        projected.append((
+            label, color,
+            [[project(lat, lon) for lat, lon in ring] for ring in rings],
+            cluster_points(latlons, project, cluster_size)))
+    if format == 'svg':
+        _svg(path, size, projected)
+    else:
+        _png(path, size, projected)
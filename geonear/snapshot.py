@@ -0,0 +1,129 @@
+'''
+A columnar file format for snapshots of the pins of a globe.
+
+The file starts with :py:data:`MAGIC`, followed by blocks of pins and an
+empty block ending the file. A block starts with its amount of pins as
+little endian uint32 and holds one column after another:
+
+- the lengths of the pin ids as uint32 and the concatenated pin ids,
+- the geohashes as uint64, see :py:func:`geohash_to_int`,
+- the lengths of the serialized data as uint32, 0 for pins without data,
+  and the concatenated data.
+
+>>> geohash_to_int('u33d')
+4611686018428243052
+>>> int_to_geohash(geohash_to_int('u33dbczk8'))
+'u33dbczk8'
+'''
+
+import mmap
+import struct
+
+from common import BASE32
+
+MAGIC = b'GEONEAR\x01'
+
+# int(gh, 32) reads the digits 0-9a-v
+_TO_INT_DIGITS = dict(zip(BASE32, '0123456789abcdefghijklmnopqrstuv'))
+_COUNT = struct.Struct('<I')
+
+
+def geohash_to_int(gh):
+    '''Return a geohash of up to 12 characters as integer below 2 ** 64,
+    its length in the highest 4 bits.
+    '''
+    if not 0 < len(gh) <= 12:
+        raise ValueError('can not convert geohash {!r}'.format(gh))
+    try:
+        value = int(''.join(_TO_INT_DIGITS[c] for c in gh), 32)
+    except KeyError:
+        raise ValueError('invalid geohash {!r}'.format(gh))
+    return len(gh) << 60 | value
+
+
+def int_to_geohash(n):
+    '''Return the geohash of an integer from :py:func:`geohash_to_int`.'''
+    length = n >> 60
+    value = n & (1 << 60) - 1
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 32)
+        chars.append(BASE32[digit])
+    return ''.join(reversed(chars))
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class SnapshotWriter(object):
+    '''Write blocks of pins to an open binary file.'''
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._file.write(MAGIC)
+
+    def write_block(self, pins):
+        '''Write a list of `(pin_id, geohash, serialized_data)` tuples,
+        `serialized_data` None for pins without data.
+        '''
+        if not pins:
+            return
+        count = len(pins)
+        ids = [_to_bytes(pin_id) for pin_id, _, _ in pins]
+        datas = [_to_bytes(data) or b'' for _, _, data in pins]
+        self._file.write(b''.join((
+            _COUNT.pack(count),
+            struct.pack('<{}I'.format(count), *map(len, ids)),
+            b''.join(ids),
+            struct.pack('<{}Q'.format(count),
+                        *(geohash_to_int(gh) for _, gh, _ in pins)),
+            struct.pack('<{}I'.format(count), *map(len, datas)),
+            b''.join(datas),
+        )))
+
+    def close(self):
+        '''Write the end of the snapshot, the file stays open.'''
+        self._file.write(_COUNT.pack(0))
+
+
+def read_snapshot(path):
+    '''Yield the blocks of a snapshot file as lists of `(pin_id, geohash,
+    serialized_data)` tuples, reading the file memory mapped.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is no geonear snapshot'.format(path))
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = len(MAGIC)
+            while True:
+                count, = _COUNT.unpack_from(buf, offset)
+                offset += _COUNT.size
+                if not count:
+                    break
+
+                id_lengths = struct.unpack_from('<{}I'.format(count), buf,
+                                                offset)
+                offset += 4 * count
+                ids = []
+                for length in id_lengths:
+                    ids.append(buf[offset:offset + length])
+                    offset += length
+
+                ghs = struct.unpack_from('<{}Q'.format(count), buf, offset)
+                offset += 8 * count
+
+                data_lengths = struct.unpack_from('<{}I'.format(count), buf,
+                                                  offset)
+                offset += 4 * count
+                datas = []
+                for length in data_lengths:
+                    datas.append(buf[offset:offset + length] or None)
+                    offset += length
+
+                yield zip(ids, map(int_to_geohash, ghs), datas)
+        finally:
+            buf.close()
@@ -26,5 +26,8 @@ setup(name='geonear',
           'python-geohash',
           'gpolyencode',
       ],
+      entry_points={
+          'console_scripts': ['geonear = geonear.cli:main'],
+      },
       include_package_data=True,
       zip_safe=True)
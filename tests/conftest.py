@@ -0,0 +1,23 @@
+import pytest
+
+
+@pytest.fixture
+def redis():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')  # fakeredis runs the Lua scripts with it
+    return fakeredis.FakeStrictRedis(decode_responses=True)
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    # the bytes of every command or pipeline sent to Redis
+    from redis.connection import Connection
+    calls = []
+    send = Connection.send_packed_command
+
+    def counting(self, command, *args, **kw):
+        calls.append(command if isinstance(command, bytes)
+                     else b''.join(command))
+        return send(self, command, *args, **kw)
+    monkeypatch.setattr(Connection, 'send_packed_command', counting)
+    return calls
@@ -0,0 +1,41 @@
+import random
+
+import geohash
+
+import geonear
+
+QUERY = (52.502, 13.404)
+
+
+def put(globe, pins, pin_id, latlon):
+    pins[pin_id] = latlon
+    globe.pin(pin_id, latlon=latlon)
+
+
+def random_latlon():
+    return random.uniform(52.3, 52.7), random.uniform(13.2, 13.6)
+
+
+def hotspot_latlon():
+    return 52.5 + random.uniform(0, 0.004), 13.4 + random.uniform(0, 0.008)
+
+
+def near_pins(pins, precision):
+    cells = geonear.geohash_and_neighbors(
+        geohash.encode(*QUERY, precision=precision))
+    return set(pin_id for pin_id, latlon in pins.items()
+               if geohash.encode(*latlon, precision=precision) in cells)
+
+
+def check_index(redis, globe, pins, precision):
+    # every pin is in exactly one set, and the index lists all sets
+    cell_keys = redis.keys('globe::gh:*')
+    members = {}
+    for key in cell_keys:
+        for pin_id in redis.smembers(key):
+            assert pin_id not in members
+            members[pin_id] = key
+    assert set(members) == set(pins)
+    assert redis.zcard('globe::cells') == len(cell_keys)
+    assert len(globe) == len(pins)
+    assert set(globe.near(latlon=QUERY)) == near_pins(pins, precision)
@@ -0,0 +1,95 @@
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geohash
+import geonear
+
+
+@pytest.fixture
+def globe(redis):
+    return geonear.Globe(redis, 6)
+
+
+def test_last_write_wins(globe):
+    flushed = []
+    with globe.buffer(on_flush=flushed.append) as buf:
+        buf.pin('car', latlon=(52.52, 13.40), data={'speed': 10})
+        buf.pin('car', latlon=(52.52, 13.41))
+        buf.pin('bike', latlon=(52.50, 13.30))
+        assert len(buf) == 2
+        assert len(globe) == 0
+    assert len(buf) == 0
+    assert flushed == [('car', 'bike')]
+    assert globe.geohash('car')[:6] == geohash.encode(52.52, 13.41, 6)
+    # the move without data keeps the data of the first write
+    assert globe.map_with_data(['car']) == {'car': {'speed': 10}}
+
+
+def test_flush_triggers(globe):
+    flushed = []
+    buf = globe.buffer(max_pins=3, batch_size=2, max_delay=60,
+                       on_flush=flushed.append)
+    for i in range(3):
+        buf.pin('car{}'.format(i), latlon=(52.5, 13.4))
+    assert len(buf) == 0
+    assert [len(batch) for batch in flushed] == [2, 1]
+
+    buf = globe.buffer(max_delay=0)
+    buf.pin('car9', latlon=(52.5, 13.4))
+    assert len(buf) == 0
+    assert 'car9' in globe
+
+
+def test_drops_moves_to_the_last_position(globe):
+    buf = globe.buffer()
+    buf.pin('car', latlon=(52.52, 13.40))
+    buf.flush()
+    buf.pin('car', latlon=(52.52, 13.40))
+    assert len(buf) == 0
+    # a move inside the same geohash of the globe is written
+    buf.pin('car', latlon=(52.52, 13.4001))
+    assert len(buf) == 1
+
+    lossy = globe.buffer(drop_cell_moves=True)
+    lossy.pin('bus', latlon=(52.52, 13.40))
+    lossy.flush()
+    lossy.pin('bus', latlon=(52.52, 13.4001))
+    assert len(lossy) == 0
+
+
+def test_cache_evicts_least_recently_used(globe):
+    buf = globe.buffer(cache_size=2)
+    for pin_id in ('a', 'b'):
+        buf.pin(pin_id, latlon=(52.5, 13.4))
+    buf.flush()
+    buf.pin('a', latlon=(52.5, 13.4))  # dropped, a is used last now
+    buf.pin('c', latlon=(52.5, 13.4))
+    buf.flush()  # evicts b
+    buf.pin('a', latlon=(52.5, 13.4))
+    assert len(buf) == 0
+    buf.pin('b', latlon=(52.5, 13.4))
+    assert len(buf) == 1
+
+
+def test_without_cache_for_several_writers(globe):
+    buf = globe.buffer(cache_size=0)
+    buf.pin('car', latlon=(52.52, 13.40))
+    buf.flush()
+    globe.pin('car', latlon=(48.14, 11.58))  # another writer
+    buf.pin('car', latlon=(52.52, 13.40))
+    buf.flush()
+    assert globe.geohash('car')[:6] == geohash.encode(52.52, 13.40, 6)
+
+
+def test_delete(globe):
+    buf = globe.buffer()
+    buf.pin('car', latlon=(52.52, 13.40))
+    buf.delete('car')
+    assert len(buf) == 0
+    buf.pin('bus', latlon=(52.52, 13.40))
+    buf.flush()
+    buf.delete('bus')
+    assert 'bus' not in globe
+    with pytest.raises(ValueError):
+        buf.delete('bus')
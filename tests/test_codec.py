@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+from geonear import codec
+
+DATA = {'name': 'bike', 'speed': 12, 'tags': ['red', 'fast']}
+
+
+@pytest.mark.parametrize('name', ['json', 'marshal', 'msgpack'])
+@pytest.mark.parametrize('compress_above', [None, 0])
+def test_round_trip(name, compress_above):
+    if name == 'msgpack':
+        pytest.importorskip('msgpack')
+    blob = codec.Codec(name, compress_above=compress_above).serialize(DATA)
+    assert blob[0] == codec.HEADER
+    assert blob[2] == (codec.NOT_COMPRESSED if compress_above is None
+                       else codec.ZLIB)
+    assert codec.deserialize(blob) == DATA
+
+
+def test_compress_above():
+    small = codec.Codec('json', compress_above=1000).serialize(DATA)
+    large = codec.Codec('json', compress_above=1000).serialize(
+        ['x' * 100] * 100)
+    assert small[2] == codec.NOT_COMPRESSED
+    assert large[2] == codec.ZLIB
+    assert len(large) < 1000
+
+
+def test_plain_json_and_errors():
+    assert codec.deserialize('{"speed": 12}') == {'speed': 12}
+    with pytest.raises(ValueError):
+        codec.deserialize(codec.HEADER + '?-{}')
+    with pytest.raises(ValueError):
+        codec.Codec('pickle')
+
+
+def test_lazy():
+    blobs = {'a': codec.Codec('json').serialize(DATA), 'b': None}
+    data = codec.LazyDataMap(blobs, codec.deserialize)
+    assert sorted(data) == ['a', 'b']
+    assert data['b'] is None
+    lazy = codec.LazyData(blobs['a'], codec.deserialize)
+    assert repr(lazy) == '<LazyData not decoded>'
+    assert lazy.value == DATA
+    assert data['a'] == DATA
+    assert dict(data) == {'a': DATA, 'b': None}
+
+
+def test_serialize_pin_data():
+    serialize = codec.Codec('json', compress_above=None).serialize
+    assert codec.serialize_pin_data(None, serialize) is None
+    blob, name, color = codec.serialize_pin_data(
+        DATA, serialize, projected_fields=('name', 'color'))
+    assert codec.deserialize(blob) == DATA
+    assert codec.deserialize(name) == 'bike'
+    assert color == ''  # deletes the field
+
+
+def test_globe(redis):
+    geonear = pytest.importorskip('geonear')
+    json_codec = codec.Codec('json', compress_above=None)
+    globe = geonear.Globe(redis, 6, data_serialize=json_codec.serialize,
+                          data_deserialize=json_codec.deserialize)
+    # pins written with the default JSON stay readable
+    geonear.Globe(redis, 6).pin('old', latlon=(1, 1), data={'v': 1})
+    globe.pin('new', latlon=(1, 1), data={'v': 2})
+    assert globe.map_with_data(['old', 'new']) == {
+        'old': {'v': 1}, 'new': {'v': 2}}
+    assert globe.map_with_data(['new'], lazy=True)['new'] == {'v': 2}
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geohash
+import geonear
+from redis.exceptions import ResponseError
+from helpers import QUERY, hotspot_latlon, near_pins, put, random_latlon
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_layout_round_trip(redis, compact):
+    random.seed(4)
+    globe = geonear.Globe(redis, 6, compact=compact, pin_buckets=8,
+                          split_threshold=20)
+    pins = {}
+    for i in range(200):
+        put(globe, pins, 'h{}'.format(i), hotspot_latlon())
+    for i in range(300):
+        put(globe, pins, 's{}'.format(i), random_latlon())
+    for i in range(150, 160):
+        globe.delete('h{}'.format(i))
+        del pins['h{}'.format(i)]
+    globe.pin('s0', latlon=pins['s0'], data={'name': 'pin s0'})
+
+    length = geonear.COMPACT_PRECISION if compact else geonear.MAX_PRECISION
+    expected = dict((pin_id, geohash.encode(*latlon, precision=length))
+                    for pin_id, latlon in pins.items())
+    assert dict(globe.geohash_scan(7)) == expected
+    assert len(globe) == len(pins)
+    assert 'h150' not in globe and 'h0' in globe
+    assert globe.geohash('s1') == expected['s1']
+    assert set(globe.near(latlon=QUERY)) == near_pins(pins, 6)
+    assert list(globe.filter_data(['s0'])) == [{'name': 'pin s0'}]
+    if compact:
+        # the geohashes are integers spread over small hashes
+        assert not redis.exists('globe::pins')
+        assert sorted(redis.keys('globe::pins:*')) == sorted(
+            'globe::pins:{}'.format(bucket) for bucket in range(8))
+        assert all(value.isdigit() for bucket in range(8)
+                   for value in redis.hvals('globe::pins:{}'.format(bucket)))
+
+
+def test_cut_geohashes(redis):
+    globe = geonear.Globe(redis, 6, compact=True)
+    globe.pin('1', latlon=QUERY)
+    globe.pin('2', latlon=QUERY)
+    assert globe.geohash('1') == geohash.encode(*QUERY, precision=6)
+    assert dict(globe.geohash_scan()) == {'1': globe.geohash('1'),
+                                          '2': globe.geohash('1')}
+    assert redis.smembers('globe::gh:' + globe.geohash('1')) == set(
+        ['1', '2'])
+    globe.delete('1')
+    assert list(globe.near(latlon=QUERY)) == ['2']
+    assert len(globe) == 1
+
+
+def test_layouts_do_not_mix(redis):
+    geonear.Globe(redis, 6).pin('a', latlon=QUERY)
+    with pytest.raises(ResponseError):
+        geonear.Globe(redis, 6, compact=True).pin('b', latlon=QUERY)
+    with pytest.raises(ValueError):
+        geonear.Globe(redis, 11, compact=True)
+    compact = geonear.Globe(redis, 6, namespace='c', compact=True)
+    compact.pin('a', latlon=QUERY)
+    with pytest.raises(ResponseError):
+        geonear.Globe(redis, 6, namespace='c').pin('b', latlon=QUERY)
+    with pytest.raises(ValueError):
+        compact.reindex(7)
@@ -0,0 +1,80 @@
+import random
+import warnings
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geohash
+import geonear
+
+BBOX = (52.50, 13.39, 52.51, 13.41)
+
+
+@pytest.fixture
+def pins():
+    random.seed(6)
+    return dict(('p{}'.format(i), (random.uniform(52.49, 52.52),
+                                   random.uniform(13.37, 13.43)))
+                for i in range(300))
+
+
+@pytest.fixture
+def globe(redis, pins):
+    globe = geonear.Globe(redis, 7, full_geohashes=True)
+    for pin_id, latlon in pins.items():
+        globe.pin(pin_id, latlon=latlon)
+    return globe
+
+
+def inside(pins, s, w, n, e):
+    return set(pin_id for pin_id, (lat, lon) in pins.items()
+               if s <= lat <= n and w <= lon <= e)
+
+
+def test_in_bbox(globe, pins):
+    area = globe.in_bbox(*BBOX, max_cells=16)
+    assert set(area) == inside(pins, *BBOX)
+    assert len(area) == len(inside(pins, *BBOX))
+    assert 'p0' in globe
+
+
+def test_cut_geohashes(redis, pins):
+    globe = geonear.Globe(redis, 7, namespace='cut')
+    globe.pin('p0', latlon=pins['p0'])
+    assert globe.geohash('p0') == geohash.encode(*pins['p0'], precision=7)
+    # the border geohashes are filtered by the centres of the pins' cells
+    s, w, n, e = BBOX
+    area = globe.in_bbox(s, w, n, e)
+    lat, lon = geohash.decode(globe.geohash('p0'))
+    assert ('p0' in set(area)) == (s <= lat <= n and w <= lon <= e)
+
+
+def test_in_polygon(globe, pins):
+    s, w, n, e = BBOX
+    square = [(s, w), (s, e), (n, e), (n, w)]
+    assert set(globe.in_polygon(square)) == inside(pins, *BBOX)
+
+
+def test_operators(globe, pins):
+    left = globe.in_bbox(52.50, 13.39, 52.51, 13.40)
+    right = globe.in_bbox(52.50, 13.395, 52.51, 13.41)
+    assert set(left & right) == inside(pins, 52.50, 13.395, 52.51, 13.40)
+    with pytest.raises(ValueError):
+        left | right
+
+    near = globe.near(latlon=(52.505, 13.40))
+    cells = globe.make_area(near.geohashes)
+    assert near == cells
+    assert set(near | cells) == set(near)
+    assert set(near & globe.make_area(['u33'])) == set(near)
+
+
+def test_legacy_signature(redis, globe, pins):
+    gh = geohash.encode(*pins['p0'], precision=7)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        area = geonear.Area(redis, [gh], 'globe::')
+    assert [w.category for w in caught] == [DeprecationWarning]
+    assert 'p0' in set(area)
+    assert set(area) == set(globe.make_area([gh]))
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geohash
+import geonear
+
+
+def count(pins, precision, prefix=''):
+    counts = {}
+    for latlon in pins.values():
+        cell = geohash.encode(*latlon, precision=precision)
+        if cell.startswith(prefix):
+            counts[cell] = counts.get(cell, 0) + 1
+    return counts
+
+
+@pytest.fixture
+def pins():
+    random.seed(5)
+    return dict(('p{}'.format(i), (random.uniform(52.3, 52.7),
+                                   random.uniform(13.2, 13.6)))
+                for i in range(300))
+
+
+@pytest.fixture
+def globe(redis, pins):
+    globe = geonear.Globe(redis, 6, density_precisions=(3, 5))
+    for pin_id, latlon in pins.items():
+        globe.pin(pin_id, latlon=latlon)
+    return globe
+
+
+def test_counts_follow_writes(globe, pins):
+    for i in range(50):
+        pins['p{}'.format(i)] = (52.5, 13.4)
+        globe.pin('p{}'.format(i), latlon=(52.5, 13.4))
+    for i in range(50, 80):
+        del pins['p{}'.format(i)]
+        globe.delete('p{}'.format(i))
+    assert globe.density(5) == count(pins, 5)
+    assert globe.density(3) == count(pins, 3)
+    with pytest.raises(ValueError):
+        globe.density(4)
+
+
+def test_area(globe, pins):
+    cell = geohash.encode(52.5, 13.4, precision=5)
+    area = globe.make_area([cell])
+    assert globe.density(5, area) == count(pins, 5, cell)
+    assert globe.density(3, area) == count(pins, 3, cell[:3])
+
+    # coarse area geohashes are looked up in the index of counted cells
+    coarse = globe.make_area([cell[:4]])
+    assert globe.density(5, coarse) == count(pins, 5, cell[:4])
+
+
+def test_rebuild(redis, globe, pins):
+    expected = globe.density(5)
+    for key in redis.keys('globe::density:*'):
+        redis.delete(key)
+    assert globe.density(5) == {}
+    globe.rebuild_density()
+    assert globe.density(5) == expected
+    assert globe.density(5, globe.make_area(['u33'])) == count(
+        pins, 5, 'u33')
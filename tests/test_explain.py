@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geonear
+
+from helpers import QUERY, random_latlon
+
+
+@pytest.fixture
+def globe(redis):
+    random.seed(3)
+    globe = geonear.Globe(redis, 6, full_geohashes=True)
+    with globe.buffer(batch_size=100, cache_size=0) as buf:
+        for i in range(500):
+            buf.pin('p{}'.format(i), latlon=random_latlon())
+    return globe
+
+
+def test_explain(globe):
+    area = globe.near(latlon=QUERY, size=2)
+    plan = area.explain()
+    assert plan['pins'] == len(list(area))
+    assert plan['non_empty'] == sum(1 for size in plan['cells'].values()
+                                    if size)
+    assert plan['round_trips'] == 1
+    assert 'SCRIPT EXISTS' not in plan['commands']
+    assert plan['cost'] == sum(plan['commands'].values()) + plan['pins']
+
+    clipped = globe.in_bbox(52.45, 13.35, 52.55, 13.45).explain()
+    assert clipped['round_trips'] == 1
+    assert clipped['commands']['EVALSHA'] == 2
+    assert clipped['commands']['MULTI'] == 1
+
+
+@pytest.mark.parametrize('clip', [False, True])
+def test_one_round_trip(globe, sent, clip):
+    if clip:
+        area = globe.in_bbox(52.45, 13.35, 52.55, 13.45)
+    else:
+        area = globe.near(latlon=QUERY, size=2)
+    del sent[:]
+    plan = area.explain()
+    assert len(sent) == 1
+    del sent[:]
+    pins = list(iter(area))  # list(area) would ask len(area) first
+    assert len(sent) == plan['round_trips']
+    assert len(pins) <= plan['pins']
+
+
+def test_scripts_are_loaded_again(globe, sent):
+    area = globe.in_bbox(52.45, 13.35, 52.55, 13.45)
+    pins = sorted(area)
+    plan = area.explain()
+    globe._redis.script_flush()
+    del sent[:]
+    assert sorted(iter(area)) == pins
+    # one more round trip loading the scripts and repeating the calls
+    assert len(sent) == 2
+    assert area.explain() == plan
+
+    # and by the writes of sessions, sent with their marker
+    session = geonear.Globe(globe._redis, 6, readers=[globe._redis],
+                            consistency='session').session()
+    globe._redis.script_flush()
+    session.pin('new', latlon=QUERY)
+    assert 'new' in set(session.near(latlon=QUERY))
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geonear
+from geonear import snapshot
+
+
+def test_geohash_ints():
+    for gh in ('u', 'u33d', 'u33dbczk8', 'zzzzzzzzzzzz', '000000000000'):
+        assert snapshot.int_to_geohash(snapshot.geohash_to_int(gh)) == gh
+    for gh in ('', 'u33dbczk8u33d', 'u33a'):
+        with pytest.raises(ValueError):
+            snapshot.geohash_to_int(gh)
+
+
+def test_blocks(tmpdir):
+    path = str(tmpdir.join('pins.snapshot'))
+    blocks = [[('a', 'u33d', '{}'), ('b', 'u33dbczk8', None)],
+              [('c' * 300, 's0000000000', 'x' * 1000)]]
+    with open(path, 'wb') as f:
+        writer = snapshot.SnapshotWriter(f)
+        for block in blocks:
+            writer.write_block(block)
+        writer.write_block([])  # left out
+        writer.close()
+    assert [list(block) for block in snapshot.read_snapshot(path)] == blocks
+
+    tmpdir.join('other').write('not a snapshot')
+    with pytest.raises(ValueError):
+        list(snapshot.read_snapshot(str(tmpdir.join('other'))))
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_round_trip(redis, tmpdir, compact):
+    random.seed(7)
+    path = str(tmpdir.join('pins.snapshot'))
+    source = geonear.Globe(redis, 7, namespace='source',
+                           projected_fields=('speed',))
+    for i in range(1234):
+        source.pin('p{}'.format(i), latlon=(random.uniform(-80, 80),
+                                            random.uniform(-170, 170)),
+                   data={'speed': i} if i % 3 else None)
+    assert source.export(path, buffer=100) == 1234
+
+    target = geonear.Globe(redis, 7, namespace='target', compact=compact,
+                           projected_fields=('speed',))
+    assert target.import_(path, batch_size=100, pipeline_size=3) == 1234
+    assert len(target) == 1234
+    pin_ids = ['p0', 'p1', 'p2', 'p1000']
+    assert [target.geohash(pin_id) for pin_id in pin_ids] == [
+        source.geohash(pin_id) for pin_id in pin_ids]
+    assert target.map_with_data(pin_ids) == source.map_with_data(pin_ids)
+    assert target.map_with_field(pin_ids, 'speed') == {
+        'p0': None, 'p1': 1, 'p2': 2, 'p1000': 1000}
+    latlon = source.latlon('p5')
+    assert set(target.near(latlon=latlon)) == set(source.near(latlon=latlon))
@@ -0,0 +1,83 @@
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geohash
+import geonear
+
+INSIDE = (52.52, 13.40)
+OUTSIDE = (48.14, 11.58)
+
+
+@pytest.fixture
+def globe(redis):
+    return geonear.Globe(redis, 6)
+
+
+def events(globe, last_id='0-0'):
+    return [(event['fence'], event['pin'], event['event'])
+            for _, event in globe.fence_events(last_id)]
+
+
+def test_enter_and_exit(globe):
+    globe.pin('inside', latlon=INSIDE)
+    globe.set_fence('berlin', [geohash.encode(*INSIDE, precision=4)])
+    assert globe.fences() == set(['berlin'])
+    # pins already inside the fence do not publish an event
+    assert events(globe) == []
+
+    globe.pin('car', latlon=OUTSIDE)
+    globe.pin('car', latlon=INSIDE)
+    globe.pin('car', latlon=(52.521, 13.401))
+    globe.pin('car', latlon=OUTSIDE)
+    globe.pin('bike', latlon=INSIDE)
+    globe.delete('bike')
+    assert events(globe) == [('berlin', 'car', 'enter'),
+                             ('berlin', 'car', 'exit'),
+                             ('berlin', 'bike', 'enter'),
+                             ('berlin', 'bike', 'exit')]
+
+
+def test_fences_of_several_precisions(globe):
+    globe.set_fence('city', [geohash.encode(*INSIDE, precision=4)])
+    globe.set_fence('block', [geohash.encode(*INSIDE, precision=6)])
+    globe.pin('car', latlon=INSIDE)
+    assert sorted(events(globe)) == [('block', 'car', 'enter'),
+                                     ('city', 'car', 'enter')]
+
+
+def test_redefine_and_delete(globe):
+    gh = geohash.encode(*INSIDE, precision=5)
+    globe.set_fence('berlin', [gh])
+    globe.set_fence('berlin', [geohash.encode(*OUTSIDE, precision=5)])
+    assert globe.fence_geohashes('berlin') == set(
+        [geohash.encode(*OUTSIDE, precision=5)])
+    globe.pin('car', latlon=INSIDE)
+    assert events(globe) == []
+
+    globe.delete_fence('berlin')
+    assert globe.fences() == set()
+    globe.pin('car', latlon=OUTSIDE)
+    assert events(globe) == []
+    with pytest.raises(ValueError):
+        globe.delete_fence('berlin')
+
+
+def test_invalid_fences(globe):
+    with pytest.raises(ValueError):
+        globe.set_fence('empty', [])
+    with pytest.raises(ValueError):
+        globe.set_fence('fine', [geohash.encode(*INSIDE, precision=7)])
+
+
+def test_consumer_group(globe):
+    globe.set_fence('berlin', [geohash.encode(*INSIDE, precision=4)])
+    globe.pin('car', latlon=INSIDE)
+    globe.pin('bike', latlon=INSIDE)
+    first = globe.fence_events(count=1, group='alerts', consumer='a')
+    second = globe.fence_events(count=1, group='alerts', consumer='b')
+    assert [event['pin'] for _, event in first + second] == ['car', 'bike']
+    assert globe.fence_events(group='alerts', consumer='a') == []
+    globe.ack_fence_events('alerts', first[0][0], second[0][0])
+    with pytest.raises(TypeError):
+        globe.fence_events(group='alerts')
@@ -0,0 +1,127 @@
+import json
+import random
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geohash
+import geonear
+from geonear.codec import Codec
+from geonear.ingest import RowParser, guess_format, ingest
+
+BERLIN = (52.5, 13.4)
+
+
+@pytest.fixture
+def globe(redis):
+    return geonear.Globe(redis, 7, projected_fields=('speed',),
+                         full_geohashes=True)
+
+
+@pytest.fixture
+def rows(tmpdir):
+    # pins moved by later rows, then three bad rows
+    random.seed(8)
+    path = tmpdir.join('pins.csv')
+    lines = ['id,lat,lon,speed']
+    for i in range(1000):
+        lines.append('p{},{:.6f},{:.6f},{}'.format(
+            i % 700, random.uniform(-80, 80), random.uniform(-170, 170), i))
+    lines.extend(['bad,x,1,2', ',1,1,2', 'far,100,1,2'])
+    path.write('\n'.join(lines) + '\n')
+    return str(path), lines[1:1001]
+
+
+def check_pins(globe, lines):
+    last = {}
+    for line in lines:
+        pin_id, lat, lon, speed = line.split(',')
+        last[pin_id] = (float(lat), float(lon), speed)
+    assert len(globe) == len(last)
+    for pin_id, (lat, lon, speed) in last.items():
+        assert globe.geohash(pin_id) == geohash.encode(lat, lon)
+    assert globe.map_with_field(sorted(last), 'speed') == dict(
+        (pin_id, speed) for pin_id, (_, _, speed) in last.items())
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_csv(globe, rows, processes):
+    path, lines = rows
+    bad = []
+    reports = []
+    stats = ingest(globe, path, processes=processes, chunk_size=100,
+                   batch_size=50, pipeline_size=2,
+                   on_bad_row=lambda *args: bad.append(args),
+                   report=reports.append)
+    assert (stats['rows'], stats['pins'], stats['bad_rows']) == (
+        1003, 1000, 3)
+    assert [(row_number, reason) for row_number, _, reason in bad] == [
+        (1001, 'invalid coordinates'), (1002, 'no pin id'),
+        (1003, 'coordinates out of range')]
+    assert reports[-1]['rows'] == 1003
+    check_pins(globe, lines)
+
+
+def test_checkpoint(globe, rows, tmpdir):
+    path, lines = rows
+    checkpoint = str(tmpdir.join('checkpoint'))
+    with open(checkpoint, 'w') as f:
+        json.dump({'input': path, 'rows': 990}, f)
+    stats = ingest(globe, path, processes=0, checkpoint=checkpoint)
+    assert (stats['pins'], stats['bad_rows']) == (10, 3)
+    with open(checkpoint) as f:
+        assert json.load(f)['rows'] == 1003
+
+    # a finished input is skipped, another one starts from the top
+    assert ingest(globe, path, processes=0,
+                  checkpoint=checkpoint)['pins'] == 0
+    with open(checkpoint, 'w') as f:
+        json.dump({'input': 'other.csv', 'rows': 990}, f)
+    assert ingest(globe, path, processes=0,
+                  checkpoint=checkpoint)['pins'] == 1000
+    check_pins(globe, lines)
+
+
+def test_geojson(globe, tmpdir):
+    features = [{'type': 'Feature', 'id': 'f{}'.format(i),
+                 'geometry': {'type': 'Point',
+                              'coordinates': [BERLIN[1], BERLIN[0]]},
+                 'properties': {'speed': i}} for i in range(5)]
+    lines = tmpdir.join('pins.geojsonl')
+    lines.write('\n'.join(map(json.dumps, features)) + '\n' +
+                '{"type": "Feature", "geometry": {"type": "LineString"}}\n')
+    collection = tmpdir.join('pins.geojson')
+    collection.write(json.dumps({'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'id': 7, 'speed': 1},
+         'geometry': {'type': 'Point', 'coordinates': [13.4, 52.5]}}]}))
+
+    assert ingest(globe, str(lines), processes=0)['bad_rows'] == 1
+    assert ingest(globe, str(collection), processes=0)['pins'] == 1
+    assert sorted(globe.near(latlon=BERLIN)) == [
+        '7', 'f0', 'f1', 'f2', 'f3', 'f4']
+    assert globe.map_with_data(['7', 'f3']) == {
+        '7': {'speed': 1}, 'f3': {'speed': 3}}
+
+
+def test_parser():
+    assert guess_format('a.tsv') == 'csv'
+    assert guess_format('a.ndjson') == 'geojson'
+    with pytest.raises(ValueError):
+        guess_format('a.xml')
+
+    parser = RowParser('csv', data_fields=['name'],
+                       serialize=Codec('json', compress_above=None).serialize)
+    pin_id, gh, (data,) = parser.parse(
+        {'id': 'a', 'lat': '52.5', 'lon': '13.4', 'name': 'x', 'other': 1})
+    assert (pin_id, gh) == ('a', geohash.encode(52.5, 13.4))
+    assert Codec('json').deserialize(data) == {'name': 'x'}
+    with pytest.raises(ValueError):
+        parser.parse({'id': 'a', 'lat': '52.5'})
+
+
+def test_unpicklable_serializer(globe, rows):
+    globe._data_serialize = lambda data: json.dumps(data)
+    with pytest.raises(ValueError):
+        ingest(globe, rows[0], processes=2)
+    assert ingest(globe, rows[0], processes=0)['pins'] == 1000
@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geonear
+
+from helpers import hotspot_latlon, random_latlon
+
+
+def fill(orders, couriers):
+    random.seed(1)
+    for i in range(120):
+        latlon = hotspot_latlon() if i % 2 else random_latlon()
+        orders.pin('o{}'.format(i), latlon=latlon)
+    for i in range(80):
+        couriers.pin('c{}'.format(i), latlon=random_latlon())
+
+
+def check_join(orders, couriers, pairs, size=1):
+    assert sorted(pin_id for pin_id, _ in pairs) == sorted(
+        'o{}'.format(i) for i in range(120))
+    for pin_id, courier_ids in pairs:
+        assert courier_ids == sorted(couriers.near(
+            latlon=orders.latlon(pin_id), size=size)), pin_id
+
+
+@pytest.mark.parametrize('options', [
+    dict(geohash_precision=7),
+    dict(geohash_precision=7, compact=True),
+    dict(geohash_precision=5, full_geohashes=True),
+    dict(geohash_precision=5, split_threshold=4),
+], ids=['precise', 'compact', 'coarse', 'split'])
+def test_join(redis, options):
+    orders = geonear.Globe(redis, namespace='orders', **options)
+    couriers = geonear.Globe(redis, 6, namespace='couriers')
+    fill(orders, couriers)
+    # small batches, so that the pins of a geohash of `other` are spread
+    # over several of them
+    check_join(orders, couriers, list(orders.join(couriers, buffer=3,
+                                                  pipeline_size=4)))
+    check_join(orders, couriers, list(orders.join(couriers, size=2)), 2)
+
+
+def test_streams(redis, monkeypatch):
+    orders = geonear.Globe(redis, 7, namespace='orders')
+    couriers = geonear.Globe(redis, 6, namespace='couriers')
+    fill(orders, couriers)
+    batches = []
+    read = orders._cell_batch
+    monkeypatch.setattr(orders, '_cell_batch', lambda last, buffer: (
+        batches.append(last) or read(last, buffer)))
+
+    pairs = orders.join(couriers, buffer=10)
+    next(pairs)
+    assert len(batches) == 1
+    rest = list(pairs)
+    cells = redis.zcard('globe:orders:cells')
+    assert len(batches) == cells // 10 + 1
+    assert len(rest) == 119
@@ -0,0 +1,74 @@
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+fakeredis = pytest.importorskip('fakeredis')
+
+import geonear
+from geonear.readers import ReaderPool
+from redis.exceptions import ConnectionError
+
+LATLON = (52.52, 13.40)
+
+
+class Down(object):
+    '''A replica failing every read.'''
+
+    def __init__(self):
+        self.reads = 0
+
+    def get(self, key):
+        self.reads += 1
+        raise ConnectionError('down')
+
+
+def test_failover(redis):
+    down = Down()
+    pool = ReaderPool([down, redis], fallback=redis, retry_after=60)
+    redis.set('key', 'value')
+    assert [pool.execute(lambda client: client.get('key'))
+            for _ in range(4)] == ['value'] * 4
+    # the failed replica is skipped afterwards
+    assert down.reads == 1
+    assert pool.healthy == (redis,)
+
+    pool = ReaderPool([Down(), Down()], fallback=redis)
+    assert pool.execute(lambda client: client.get('key')) == 'value'
+    assert pool.healthy == ()
+    with pytest.raises(ValueError):
+        ReaderPool([])
+
+
+def test_session_reads_its_writes(redis):
+    replica = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer(),
+                                        decode_responses=True)
+    globe = geonear.Globe(redis, 6, readers=[replica],
+                          consistency='session')
+    session = globe.session()
+    session.pin('a', latlon=LATLON)
+    # the replica did not get the write yet
+    assert 'a' in session
+    assert 'a' not in globe
+
+    # nor the one of a newer session
+    geonear.Globe(replica, 6).pin('a', latlon=LATLON)
+    replica.set(session._marker_key, 1)
+    assert 'a' in session
+    other = session.session()
+    other.pin('b', latlon=LATLON)
+    assert set(other.near(latlon=LATLON)) == set(['a', 'b'])
+    assert set(session.near(latlon=LATLON)) == set(['a'])
+
+
+def test_memory_stats_count_session_markers(redis, monkeypatch):
+    globe = geonear.Globe(redis, 6, readers=[redis], consistency='session')
+    monkeypatch.setattr(globe, '_memory_usage', lambda keys, samples, buffer:
+                        [10 if redis.exists(key) else 0 for key in keys])
+    assert globe.memory_stats()['sessions'] == 0
+    globe.session().pin('a', latlon=LATLON)
+    globe.session().pin('b', latlon=LATLON)
+    stats = globe.memory_stats()
+    assert stats['sessions'] == 20
+    assert stats['total'] == sum(value for key, value in stats.items()
+                                 if key in ('pins', 'data', 'fields', 'index',
+                                            'density', 'fences', 'cells',
+                                            'sessions'))
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geohash
+import geonear
+from helpers import QUERY, check_index, put, random_latlon
+
+
+@pytest.mark.parametrize('full_geohashes', [False, True])
+def test_reindex_with_concurrent_writes(redis, full_geohashes):
+    random.seed(2)
+    globe = geonear.Globe(redis, 6, full_geohashes=full_geohashes)
+    old_globe = geonear.Globe(redis, 6, full_geohashes=full_geohashes)
+    pins = {}
+    for i in range(500):
+        put(globe, pins, 'p{}'.format(i), random_latlon())
+
+    reindex = globe.reindex(8)
+    reindex.step(100)
+    reindex.step(100)
+    assert reindex.status == 'copying'
+    # writes of a globe still at the old precision reach both indexes
+    for i in range(50):
+        put(old_globe, pins, 'p{}'.format(i), random_latlon())
+    old_globe.delete('p60')
+    del pins['p60']
+    put(old_globe, pins, 'new', QUERY)
+
+    reindex.run(batch=100)
+    assert reindex.progress()['status'] == 'done'
+    assert redis.get('globe::precision') == '8'
+    assert set(len(key) - len('globe::gh:')
+               for key in redis.keys('globe::gh:*')) == set([8])
+    assert not redis.exists('globe::pins:old', 'globe::cells:old')
+    check_index(redis, globe, pins, 8)
+    for pin_id, latlon in pins.items():
+        if full_geohashes:
+            assert globe.geohash(pin_id) == geohash.encode(*latlon)
+        else:
+            # pins not moved meanwhile are at the centre of their old cell
+            assert len(globe.geohash(pin_id)) == 8
+            assert globe.geohash(pin_id)[:6] == geohash.encode(
+                *latlon, precision=6)
+
+
+def test_reindex_abort(redis):
+    globe = geonear.Globe(redis, 6)
+    globe.pin('a', latlon=QUERY)
+    reindex = globe.reindex(7)
+    reindex.step(100)
+    globe.pin('b', latlon=(1, 1))
+    reindex.abort()
+    reindex.run()
+    assert not redis.exists('globe::reindex', 'globe::pins:next')
+    check_index(redis, globe, {'a': QUERY, 'b': (1, 1)}, 6)
+
+
+def test_refused(redis):
+    globe = geonear.Globe(redis, 6, density_precisions=(5,))
+    for precision in (0, 13, 4, 6):
+        with pytest.raises(ValueError):
+            globe.reindex(precision)
+    globe.reindex(7)
+    with pytest.raises(ValueError):
+        globe.reindex(8)  # another reindex is running
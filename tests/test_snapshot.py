@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geonear
+
+from helpers import QUERY, random_latlon
+
+BBOX = (52.48, 13.37, 52.52, 13.43)
+
+
+@pytest.fixture(params=[False, True], ids=['regular', 'compact'])
+def globe(request, redis):
+    random.seed(2)
+    globe = geonear.Globe(redis, 6, compact=request.param)
+    for i in range(300):
+        globe.pin('p{}'.format(i), latlon=random_latlon(),
+                  data={'n': i} if i % 3 else None)
+    return globe
+
+
+def test_reads(globe):
+    area = globe.near(latlon=QUERY, size=2)
+    box = globe.in_bbox(*BBOX)
+    with globe.snapshot() as s:
+        pins = s.pins(area)
+        count = s.count(area)
+        with_data = s.pins_with_data(area)
+        box_pins = s.pins(box)
+        box_count = s.count(box)
+        box_data = s.pins_with_data(box, lazy=True)
+        data = s.data('p1')
+        mapped = s.map_with_data(['p1', 'p3', 'nope'])
+        geohashes = s.geohashes(['p1', 'nope'])
+        nothing = s.map_with_data([])
+        with pytest.raises(ValueError):
+            pins.value
+
+    assert pins.value == list(area)
+    assert count.value == len(area) == len(with_data.value)
+    assert with_data.value == globe.map_with_data(list(area))
+    assert box_pins.value == list(box)
+    assert box_count.value == len(box) == len(box_data.value)
+    assert dict((pin_id, box_data.value[pin_id])
+                for pin_id in box_data.value) == globe.map_with_data(box)
+    assert data.value == {'n': 1}
+    assert mapped.value == {'p1': {'n': 1}, 'p3': None, 'nope': None}
+    assert geohashes.value == [globe.geohash('p1'), None]
+    assert nothing.value == {}
+
+
+def test_one_round_trip(globe, sent):
+    area = globe.near(latlon=QUERY, size=2)
+    box = globe.in_bbox(*BBOX)
+    snapshot = globe.snapshot()
+    pins = snapshot.pins(area)
+    box_count = snapshot.count(box)
+    del sent[:]
+    snapshot.execute()
+    assert len(sent) == 1
+    assert (pins.value, box_count.value) == (sorted(iter(area)), len(box))
+
+
+def test_scripts_are_loaded_again(globe, sent):
+    # the whole transaction is repeated, not only the failed calls
+    area = globe.near(latlon=QUERY, size=2)
+    snapshot = globe.snapshot()
+    pins = snapshot.pins(area)
+    data = snapshot.data('p1')
+    globe._redis.script_flush()
+    del sent[:]
+    snapshot.execute()
+    assert len(sent) == 2
+    assert b'HGET' in sent[1]
+    assert pins.value == sorted(iter(area))
+    assert data.value == {'n': 1}
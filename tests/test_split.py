@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geohash
+import geonear
+from helpers import check_index, hotspot_latlon, put, random_latlon
+
+
+def test_split_and_merge(redis):
+    random.seed(3)
+    globe = geonear.Globe(redis, 6, split_threshold=20)
+    pins = {}
+    for i in range(200):
+        put(globe, pins, 'h{}'.format(i), hotspot_latlon())
+    for i in range(100):
+        put(globe, pins, 's{}'.format(i), random_latlon())
+
+    assert redis.hlen('globe::split')
+    assert max(redis.scard(key) for key in redis.keys('globe::gh:*')) <= 20
+    check_index(redis, globe, pins, 6)
+    # splitting needs the full geohashes of the pins
+    assert globe.geohash('h0') == geohash.encode(*pins['h0'])
+    bbox = (52.501, 13.401, 52.503, 13.405)
+    assert set(globe.in_bbox(*bbox)) == set(
+        pin_id for pin_id, (lat, lon) in pins.items()
+        if bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3])
+
+    # moving the hotspot away merges the children back
+    for i in range(190):
+        put(globe, pins, 'h{}'.format(i), random_latlon())
+    for i in range(190, 200):
+        globe.delete('h{}'.format(i))
+        del pins['h{}'.format(i)]
+    assert not redis.exists('globe::split')
+    check_index(redis, globe, pins, 6)
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geonear
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+import startup
+
+
+def test_import_skips_optional_modules():
+    _, imported = startup.import_time(1)
+    assert imported == []
+
+
+def test_globe_sends_no_commands(redis):
+    geonear.Globe(redis, 6)
+    connections = []
+    get_connection = redis.connection_pool.get_connection
+    redis.connection_pool.get_connection = \
+        lambda *args, **kw: connections.append(args) or get_connection(
+            *args, **kw)
+    for _ in range(10):
+        geonear.Globe(redis, 6, namespace='other')
+    assert connections == []
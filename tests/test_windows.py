@@ -0,0 +1,85 @@
+import pickle
+import random
+import time
+
+import pytest
+
+pytest.importorskip('geohash')  # needed by geonear
+
+import geohash
+import geonear
+
+from helpers import QUERY, random_latlon
+
+NEW = ['n0', 'n1', 'n2', 'n3', 'n4', 'p0']
+
+
+@pytest.fixture(params=[False, True], ids=['regular', 'compact'])
+def globe(request, redis):
+    return geonear.Globe(redis, 6, track_updates=True,
+                         compact=request.param)
+
+
+def fill(globe):
+    # 100 old pins, then 5 new ones and a moved one at the query point,
+    # return a time between them by the clock of Redis
+    random.seed(5)
+    for i in range(100):
+        globe.pin('p{}'.format(i), latlon=random_latlon())
+    time.sleep(0.02)
+    seconds, microseconds = globe._redis.time()
+    time.sleep(0.02)
+    for pin_id in NEW:
+        globe.pin(pin_id, latlon=QUERY)
+    return seconds + microseconds / 1e6
+
+
+def test_since_and_until(globe):
+    middle = fill(globe)
+    area = globe.near(latlon=QUERY, size=2)
+    recent = globe.near(latlon=QUERY, size=2, since=middle)
+    assert sorted(recent) == NEW
+    old = globe.near(latlon=QUERY, size=2, until=middle)
+    assert len(old) == len(area) - len(NEW)
+    assert 'p0' not in set(old)
+    assert set(globe.in_bbox(52.49, 13.39, 52.51, 13.41,
+                             since=middle)) == set(NEW)
+
+    # a window holding more pins than the area looks up every pin
+    cell = [geohash.encode(*QUERY, precision=6)]
+    everything = globe.make_area(cell, since=0)
+    assert set(everything) == set(globe.make_area(cell))
+    assert 'ZSCORE' in everything.explain()['commands']
+    assert 'ZRANGEBYSCORE' in recent.explain()['commands']
+
+    globe.delete('n0')
+    assert 'n0' not in set(recent)
+    # deleted pins leave the ordered set of the update times
+    assert globe._redis.zcard(globe._key_prefix + 'updated') == len(globe)
+
+
+def test_combine(globe):
+    middle = fill(globe)
+    area = globe.near(latlon=QUERY, size=2)
+    recent = globe.near(latlon=QUERY, size=2, since=middle)
+    copy = pickle.loads(pickle.dumps(recent)).attach(globe)
+    assert copy == recent and copy != area
+    assert (area & recent) == recent
+    with pytest.raises(ValueError):
+        area | recent
+
+
+def test_needs_track_updates(redis):
+    globe = geonear.Globe(redis, 6)
+    with pytest.raises(ValueError):
+        list(globe.near(latlon=QUERY, since=1))
+
+
+def test_memory_stats(globe, monkeypatch):
+    monkeypatch.setattr(
+        globe, '_memory_usage', lambda keys, samples, buffer: [
+            globe._redis.zcard(key) if key.endswith(':updated') else 0
+            for key in keys])
+    fill(globe)
+    assert globe.memory_stats()['index'] == 105
+